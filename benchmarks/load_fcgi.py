@@ -0,0 +1,346 @@
+"""
+	Load test of the PRP core via FastCGI (without nginx), like nginx talks to it.
+
+	Sends requests at a fixed rate (open loop, i.e., independent of the responses) to the
+	socket served by proxy/wsgi.py and reports the latency (measured from the time a request
+	was scheduled, such that queueing is included), the throughput and how many requests
+	were approved, blocked or answered by a captcha. Repeats this for each given number of
+	concurrent connections.
+
+	Run via (from the root of the repository, while proxy/wsgi.py is running):
+		python benchmarks/load_fcgi.py --rate 100 --duration 10 --connections 1,4,16
+		python benchmarks/load_fcgi.py --replay proxy/logs/ --rate 50
+		python benchmarks/load_fcgi.py --http http://localhost/ --rate 50
+
+	With --http the requests are sent via HTTP (e.g., to nginx with benchmarks/upstream.py
+	as system_to_protect) instead of FastCGI.
+"""
+import os, sys, json, time, socket, struct, queue, argparse, threading, http.client
+from urllib.parse import urlencode, urlsplit, unquote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "proxy"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import create_corpus
+from run import percentile
+
+SOCKET = '/tmp/protection-proxy.sock'
+
+# FastCGI record types and header (version, type, request id, content length, padding length)
+FCGI_BEGIN_REQUEST = 1
+FCGI_END_REQUEST = 3
+FCGI_PARAMS = 4
+FCGI_STDIN = 5
+FCGI_STDOUT = 6
+FCGI_STDERR = 7
+FCGI_RESPONDER = 1
+FCGI_HEADER = struct.Struct('>BBHHBx')
+FCGI_MAX_CONTENT = 65535
+
+SESSION_COOKIE = "protection_session"
+RESULTS = ['approve', 'block', 'captcha', 'error']
+
+def fcgi_records(type, content, request_id=1):
+	"""
+		Returns the records (as bytes) of a stream, ending with an empty record.
+		Args:
+			type (int): The record type.
+			content (bytes): The content of the stream.
+	"""
+	records = b""
+	for start in range(0, len(content), FCGI_MAX_CONTENT):
+		chunk = content[start:start + FCGI_MAX_CONTENT]
+		records += FCGI_HEADER.pack(1, type, request_id, len(chunk), 0) + chunk
+	return records + FCGI_HEADER.pack(1, type, request_id, 0, 0)
+
+def fcgi_params(params):
+	"""
+		Encodes name-value pairs of FastCGI, returns the content of the records (flup decodes
+		each record on its own, so a pair must not be split between two records).
+	"""
+	contents = [b""]
+	for name, value in params.items():
+		name, value = name.encode('latin-1', 'replace'), value.encode('latin-1', 'replace')
+		pair = b""
+		for length in [len(name), len(value)]:
+			pair += struct.pack('>B', length) if length < 128 else struct.pack('>I', length | 0x80000000)
+		pair += name + value
+		if len(contents[-1]) + len(pair) > FCGI_MAX_CONTENT:
+			contents.append(b"")
+		contents[-1] += pair
+	return contents
+
+def recv_exactly(connection, size):
+	data = b""
+	while len(data) < size:
+		chunk = connection.recv(size - len(data))
+		if len(chunk) == 0:
+			raise ConnectionError("Connection closed by the FastCGI server")
+		data += chunk
+	return data
+
+def fcgi_request(socket_path, params, body, timeout=30):
+	"""
+		Sends a request to a FastCGI responder (one connection per request, like nginx does by default).
+		Returns the status code, the headers (dict, lower case names) and the body.
+	"""
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+		connection.settimeout(timeout)
+		connection.connect(socket_path)
+		connection.sendall(
+			FCGI_HEADER.pack(1, FCGI_BEGIN_REQUEST, 1, 8, 0) + struct.pack('>HB5x', FCGI_RESPONDER, 0)
+			+ b"".join(FCGI_HEADER.pack(1, FCGI_PARAMS, 1, len(content), 0) + content for content in fcgi_params(params) if len(content) > 0)
+			+ FCGI_HEADER.pack(1, FCGI_PARAMS, 1, 0, 0)
+			+ fcgi_records(FCGI_STDIN, body)
+		)
+
+		output = b""
+		while True:
+			_, type, _, length, padding = FCGI_HEADER.unpack(recv_exactly(connection, FCGI_HEADER.size))
+			content = recv_exactly(connection, length + padding)[:length]
+			if type == FCGI_STDOUT:
+				output += content
+			elif type == FCGI_END_REQUEST:
+				break
+
+	head, _, response_body = output.partition(b"\r\n\r\n")
+	status, headers = 200, {}
+	for line in head.decode('latin-1').split("\r\n"):
+		name, _, value = line.partition(":")
+		name, value = name.strip().lower(), value.strip()
+		if name == "status":
+			status = int(value.split(" ")[0])
+		elif name == "set-cookie" and name in headers:
+			headers[name] += "\n" + value
+		elif len(name) > 0:
+			headers[name] = value
+	return status, headers, response_body
+
+class Session():
+	"""
+		Keeps the session cookie of each connection id of the replayed requests, such that
+		the PRP core assigns the requests to the same connection (and window) as in the log.
+	"""
+
+	def __init__(self):
+		self.cookies = {}
+		self.lock = threading.Lock()
+
+	def cookie(self, connection_id, header_cookie=""):
+		"""
+			Returns the cookie header for the request of a connection.
+		"""
+		with self.lock:
+			session = self.cookies.get(connection_id)
+		return "; ".join(c for c in [header_cookie, session] if c)
+
+	def update(self, connection_id, headers):
+		"""
+			Stores the session cookie of a response.
+		"""
+		for cookie in headers.get("set-cookie", "").split("\n"):
+			if cookie.startswith(SESSION_COOKIE + "="):
+				with self.lock:
+					self.cookies[connection_id] = cookie.split(";")[0]
+
+def encode_body(entry):
+	body = entry['request']['body']
+	if isinstance(body, dict):
+		return urlencode(body).encode('utf-8')
+	return str(body).encode('utf-8')
+
+def fcgi_environ(entry, body, cookie):
+	"""
+		Returns the FastCGI params (as set by nginx' fastcgi_params and conf/proxy.conf) of a request.
+	"""
+	uri = entry['request']['uri']
+	path, _, query = uri.partition("?")
+	params = {
+		'QUERY_STRING' : query,
+		'REQUEST_METHOD' : entry['request']['method'],
+		'CONTENT_TYPE' : '',
+		'CONTENT_LENGTH' : str(len(body)) if len(body) > 0 else '',
+		'SCRIPT_NAME' : '',
+		'PATH_INFO' : unquote(path),
+		'REQUEST_URI' : uri,
+		'DOCUMENT_URI' : path,
+		'SERVER_PROTOCOL' : entry['request'].get('protocol', 'HTTP/1.1'),
+		'REQUEST_SCHEME' : 'http',
+		'GATEWAY_INTERFACE' : 'CGI/1.1',
+		'SERVER_SOFTWARE' : 'load_fcgi',
+		'REMOTE_ADDR' : entry.get('sender', {}).get('ip', '127.0.0.1'),
+		'REMOTE_PORT' : '40000',
+		'SERVER_ADDR' : '127.0.0.1',
+		'SERVER_PORT' : '80',
+		'SERVER_NAME' : '_'
+	}
+	for name, value in entry['header'].items():
+		if name.lower() == "cookie":
+			continue
+		key = name.upper().replace("-", "_")
+		if key in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
+			if key == 'CONTENT_TYPE':
+				params[key] = str(value)
+		else:
+			params['HTTP_' + key] = str(value)
+	if len(cookie) > 0:
+		params['HTTP_COOKIE'] = cookie
+	return params
+
+def classify(status, headers, body):
+	"""
+		Returns how the PRP core answered: approve (X-Accel-Redirect to @protected or the page of
+		the upstream stub), captcha (page with a captcha) or block.
+	"""
+	if headers.get("x-accel-redirect") == "@protected" or headers.get("x-upstream") == "stub":
+		return 'approve'
+	if b'name="captcha"' in body:
+		return 'captcha'
+	return 'block'
+
+def fcgi_sender(socket_path, session):
+	"""
+		Returns a function sending a request via FastCGI and returning the result (see classify).
+	"""
+	def send(entry):
+		body = encode_body(entry)
+		cookie = session.cookie(entry['connection-id'], entry['header'].get('Cookie', ''))
+		status, headers, response = fcgi_request(socket_path, fcgi_environ(entry, body, cookie), body)
+		session.update(entry['connection-id'], headers)
+		return classify(status, headers, response)
+	return send
+
+def http_sender(url, session):
+	"""
+		Returns a function sending a request via HTTP (e.g., to nginx) and returning the result.
+	"""
+	target = urlsplit(url)
+	def send(entry):
+		body = encode_body(entry)
+		headers = {name : str(value) for name, value in entry['header'].items() if name.lower() not in ['cookie', 'content-length', 'host', 'connection']}
+		cookie = session.cookie(entry['connection-id'], entry['header'].get('Cookie', ''))
+		if len(cookie) > 0:
+			headers['Cookie'] = cookie
+		headers['Connection'] = 'close'
+
+		connection = (http.client.HTTPSConnection if target.scheme == "https" else http.client.HTTPConnection)(target.netloc, timeout=30)
+		try:
+			connection.request(entry['request']['method'], target.path.rstrip("/") + entry['request']['uri'], body if len(body) > 0 else None, headers)
+			response = connection.getresponse()
+			response_headers = {}
+			for name, value in response.getheaders():
+				name = name.lower()
+				response_headers[name] = response_headers[name] + "\n" + value if name in response_headers else value
+			response_body = response.read()
+		finally:
+			connection.close()
+		session.update(entry['connection-id'], response_headers)
+		return classify(response.status, response_headers, response_body)
+	return send
+
+def run_level(send, entries, rate, duration, connections):
+	"""
+		Sends rate * duration requests at a fixed rate using the given number of concurrent
+		connections, returns the summary.
+	"""
+	total = int(rate * duration)
+	scheduled = queue.Queue()
+	latencies = []
+	results = {result : 0 for result in RESULTS}
+	lock = threading.Lock()
+
+	def worker():
+		while True:
+			item = scheduled.get()
+			if item == None:
+				return
+			at, entry = item
+			try:
+				result = send(entry)
+			except Exception:
+				result = 'error'
+			latency = time.perf_counter() - at
+			with lock:
+				latencies.append(latency)
+				results[result] += 1
+
+	workers = [threading.Thread(target=worker, daemon=True) for _ in range(connections)]
+	for thread in workers:
+		thread.start()
+
+	# the schedule does not wait for responses (open loop)
+	start = time.perf_counter()
+	for i in range(total):
+		at = start + i / rate
+		delay = at - time.perf_counter()
+		if delay > 0:
+			time.sleep(delay)
+		scheduled.put((at, entries[i % len(entries)]))
+	for _ in workers:
+		scheduled.put(None)
+	for thread in workers:
+		thread.join()
+	elapsed = time.perf_counter() - start
+
+	latencies.sort()
+	return {
+		'connections' : connections,
+		'rate' : rate,
+		'requests' : total,
+		'throughput' : total / elapsed,
+		'p50_ms' : percentile(latencies, 50) * 1000,
+		'p90_ms' : percentile(latencies, 90) * 1000,
+		'p99_ms' : percentile(latencies, 99) * 1000,
+		'max_ms' : latencies[-1] * 1000,
+		'results' : results
+	}
+
+def load_entries(args):
+	"""
+		Returns the requests to send, replayed from request logs or the synthetic corpus.
+	"""
+	if args.replay:
+		from log_reader import LogReader
+		entries = list(LogReader(args.replay).entries())
+		if len(entries) == 0:
+			raise ValueError("No requests in " + args.replay)
+		return entries
+	return create_corpus(seed=args.seed)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Open loop load test of the PRP core via FastCGI.")
+	parser.add_argument("--socket", default=SOCKET, help="FastCGI socket of the PRP core")
+	parser.add_argument("--http", help="send via HTTP to this url instead (e.g. http://localhost/ for nginx)")
+	parser.add_argument("--replay", help="replay the requests of a request log (file or directory)")
+	parser.add_argument("--seed", type=int, default=42, help="seed of the synthetic corpus")
+	parser.add_argument("--rate", type=float, default=50, help="requests per second")
+	parser.add_argument("--duration", type=float, default=10, help="seconds per number of connections")
+	parser.add_argument("--connections", default="1,4,16", help="numbers of concurrent connections to test")
+	parser.add_argument("--save", help="save the results as json to this file")
+	args = parser.parse_args()
+
+	entries = load_entries(args)
+	session = Session()
+	send = http_sender(args.http, session) if args.http else fcgi_sender(args.socket, session)
+
+	levels = []
+	print("%6s %8s %10s %8s %8s %8s %8s %8s %8s %8s %8s" % (
+		"conns", "requests", "requests/s", "p50 ms", "p90 ms", "p99 ms", "max ms", "approve", "block", "captcha", "error"))
+	for connections in [int(c) for c in args.connections.split(",")]:
+		level = run_level(send, entries, args.rate, args.duration, connections)
+		levels.append(level)
+		r = level['results']
+		print("%6d %8d %10.1f %8.2f %8.2f %8.2f %8.2f %8d %8d %8d %8d" % (
+			connections, level['requests'], level['throughput'], level['p50_ms'], level['p90_ms'],
+			level['p99_ms'], level['max_ms'], r['approve'], r['block'], r['captcha'], r['error']))
+
+	if args.save:
+		with open(args.save, "w") as file:
+			json.dump({
+				'target' : args.http if args.http else args.socket,
+				'source' : args.replay if args.replay else "corpus (seed " + str(args.seed) + ")",
+				'time' : time.strftime("%Y-%m-%d %H:%M:%S"),
+				'levels' : levels
+			}, file, indent=4)
+		print("Saved results to " + args.save)
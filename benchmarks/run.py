@@ -0,0 +1,184 @@
+"""
+	Benchmarks the stages of classifying a request on a fixed corpus (see corpus.py).
+
+	Run via (from the root of the repository, default models are models/dummy):
+		python benchmarks/run.py
+		python benchmarks/run.py --stages text,uri --repeat 5
+		python benchmarks/run.py --save benchmarks/baselines/my-machine.json
+		python benchmarks/run.py --compare benchmarks/baselines/my-machine.json
+
+	Reports throughput, p50 and p99 per stage. With --compare, the exit code is 1 if a
+	stage got slower than the baseline by more than --threshold.
+"""
+import os, sys, json, time, argparse, platform, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "protection"))
+sys.path.insert(0, os.path.join(ROOT, "proxy"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import create_corpus
+
+def create_stages(models_dir, names):
+	"""
+		Returns the stages to benchmark as {name : function(request dict)}, the heavy modules
+		(models) are only loaded if their stage is selected.
+	"""
+	stages = {}
+	if "text" in names:
+		from src.data.make_datasets_lda import get_text_from_request
+		from src.data.request_context import RequestContext
+		stages["text"] = lambda request: get_text_from_request(RequestContext(request))
+
+	if "uri" in names:
+		from src.transformation.HTTPTransformer import HTTPTransformer
+		stages["uri"] = lambda request: HTTPTransformer.uri_transformation_wrapper(request['request']['uri'])
+
+	if len(set(names) & set(["lda", "nn", "check"])) > 0:
+		from request_data import RequestData
+		index = json.load(open(models_dir + "index.json", 'r'))
+
+	if "lda" in names:
+		from src.models.predict_model_lda import LDAPredictor
+		lda = LDAPredictor(index['lda'], models_dir)
+		stages["lda"] = lambda request: lda.predict(RequestData.from_dict(request))
+
+	if "nn" in names:
+		from src.models.predict_model_nn import NNPredictor
+		nn = NNPredictor(index['nn-attack'], models_dir)
+		stages["nn"] = lambda request: nn.predict(RequestData.from_dict(request))
+
+	if "check" in names:
+		from request_check import RequestChecker
+		RequestChecker.MODELS_DIR = models_dir
+		checker = RequestChecker()
+		stages["check"] = lambda request: checker.is_safe(RequestData.from_dict(request))
+
+	return stages
+
+def percentile(values, p):
+	"""
+		Returns the p-th percentile of sorted values (nearest rank).
+	"""
+	return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+def summarize(durations):
+	"""
+		Returns throughput (per second), p50, p99 and mean (in milliseconds) of durations (in seconds).
+	"""
+	durations = sorted(durations)
+	return {
+		'count' : len(durations),
+		'throughput' : len(durations) / sum(durations) if sum(durations) > 0 else 0,
+		'p50_ms' : percentile(durations, 50) * 1000,
+		'p99_ms' : percentile(durations, 99) * 1000,
+		'mean_ms' : sum(durations) / len(durations) * 1000
+	}
+
+def run_stage(function, corpus, repeat, warmup):
+	"""
+		Calls the function for each request of the corpus (repeat times), returns the summary
+		over all requests and per category. Requests raising an error are counted (as in the
+		proxy, where they are blocked), their duration is included.
+	"""
+	for request in corpus[:warmup]:
+		try:
+			function(request)
+		except Exception:
+			pass
+
+	durations = {}
+	errors = {}
+	for _ in range(repeat):
+		for request in corpus:
+			start = time.perf_counter()
+			try:
+				function(request)
+			except Exception:
+				errors[request['category']] = errors.get(request['category'], 0) + 1
+			durations.setdefault(request['category'], []).append(time.perf_counter() - start)
+
+	result = summarize([d for category in durations.values() for d in category])
+	result['errors'] = sum(errors.values())
+	result['categories'] = {category : summarize(values) for category, values in sorted(durations.items())}
+	for category, count in errors.items():
+		result['categories'][category]['errors'] = count
+	return result
+
+def compare(results, baseline, threshold):
+	"""
+		Compares the results to a baseline, returns the list of regressions (as strings).
+	"""
+	regressions = []
+	for name, result in results.items():
+		if name not in baseline.get('stages', {}):
+			continue
+		base = baseline['stages'][name]
+
+		for key in ['p50_ms', 'p99_ms']:
+			if result[key] > base[key] * (1 + threshold):
+				regressions.append(name + " " + key + ": " + ("%.3f" % base[key]) + " -> " + ("%.3f" % result[key]))
+		if result['throughput'] < base['throughput'] * (1 - threshold):
+			regressions.append(name + " throughput: " + ("%.1f" % base['throughput']) + " -> " + ("%.1f" % result['throughput']))
+	return regressions
+
+def commit():
+	"""
+		Returns the current git commit (or None).
+	"""
+	try:
+		return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+	except:
+		return None
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmarks the stages of classifying a request.")
+	parser.add_argument("--models", default=os.path.join(ROOT, "models", "dummy") + "/", help="directory of the models (with index.json)")
+	parser.add_argument("--stages", default="text,uri,lda,nn,check", help="stages to run: text,uri,lda,nn,check")
+	parser.add_argument("--repeat", type=int, default=3, help="number of runs over the corpus")
+	parser.add_argument("--warmup", type=int, default=50, help="requests run before measuring")
+	parser.add_argument("--seed", type=int, default=42, help="seed of the corpus")
+	parser.add_argument("--save", help="save the results as baseline to this file")
+	parser.add_argument("--compare", help="compare the results to this baseline")
+	parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown compared to the baseline (0.2 = 20%%)")
+	args = parser.parse_args()
+
+	models_dir = args.models if args.models.endswith("/") else args.models + "/"
+	names = args.stages.split(",")
+	corpus = create_corpus(seed=args.seed)
+	stages = create_stages(models_dir, names)
+
+	results = {}
+	print("%-8s %8s %12s %10s %10s %8s" % ("stage", "requests", "requests/s", "p50 ms", "p99 ms", "errors"))
+	for name in names:
+		results[name] = run_stage(stages[name], corpus, args.repeat, args.warmup)
+		r = results[name]
+		print("%-8s %8d %12.1f %10.3f %10.3f %8d" % (name, r['count'], r['throughput'], r['p50_ms'], r['p99_ms'], r['errors']))
+		for category, c in r['categories'].items():
+			print("  %-14s %12.1f %10.3f %10.3f %8d" % (category, c['throughput'], c['p50_ms'], c['p99_ms'], c.get('errors', 0)))
+
+	if args.save:
+		with open(args.save, "w") as file:
+			json.dump({
+				'meta' : {
+					'commit' : commit(),
+					'time' : time.strftime("%Y-%m-%d %H:%M:%S"),
+					'python' : platform.python_version(),
+					'machine' : platform.platform() + ", " + str(os.cpu_count()) + " cpus",
+					'models' : models_dir,
+					'corpus' : {'requests' : len(corpus), 'seed' : args.seed},
+					'repeat' : args.repeat
+				},
+				'stages' : results
+			}, file, indent=4)
+		print("Saved baseline to " + args.save)
+
+	if args.compare:
+		baseline = json.load(open(args.compare, "r"))
+		regressions = compare(results, baseline, args.threshold)
+		if len(regressions) > 0:
+			print("Regressions compared to " + args.compare + " (commit " + str(baseline['meta'].get('commit')) + "):")
+			for regression in regressions:
+				print("\t" + regression)
+			sys.exit(1)
+		print("No regressions compared to " + args.compare)
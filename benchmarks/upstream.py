@@ -0,0 +1,65 @@
+"""
+	A minimal HTTP server to be used as system_to_protect when load testing the whole
+	path through nginx. Answers every request with a small page (and the header
+	X-Upstream: stub, which load_fcgi.py uses to detect approved requests).
+
+	Run via:
+		python benchmarks/upstream.py --port 80
+"""
+import sys, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BODY = b"<!DOCTYPE html><html><head><title>Upstream</title></head><body>Upstream stub</body></html>"
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+	"""
+		Answers all requests with BODY (reads and discards request bodies).
+	"""
+
+	protocol_version = "HTTP/1.1"
+
+	# number of requests served
+	requests = 0
+	lock = threading.Lock()
+
+	def respond(self):
+		length = int(self.headers.get('Content-Length', 0) or 0)
+		if length > 0:
+			self.rfile.read(length)
+
+		with UpstreamHandler.lock:
+			UpstreamHandler.requests += 1
+
+		self.send_response(200)
+		self.send_header("Content-Type", "text/html; charset=utf-8")
+		self.send_header("Content-Length", str(len(BODY)))
+		self.send_header("X-Upstream", "stub")
+		self.end_headers()
+		if self.command != "HEAD":
+			self.wfile.write(BODY)
+
+	do_GET = respond
+	do_POST = respond
+	do_PUT = respond
+	do_DELETE = respond
+	do_HEAD = respond
+	do_OPTIONS = respond
+	do_PATCH = respond
+
+	def log_message(self, format, *args):
+		pass
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Minimal upstream answering every request.")
+	parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+	parser.add_argument("--port", type=int, default=80, help="port to listen on")
+	args = parser.parse_args()
+
+	server = ThreadingHTTPServer((args.host, args.port), UpstreamHandler)
+	server.daemon_threads = True
+	print("Upstream stub listening on " + args.host + ":" + str(args.port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		print("Served " + str(UpstreamHandler.requests) + " requests")
+		sys.exit(0)
@@ -1,145 +1,202 @@
 import ipaddress
 import re
-from urllib.parse import unquote
+import string
+from functools import lru_cache
+
+from src.data.request_context import RequestContext
+
+# the classes of characters (regular expressions) which may appear in a value
+# 	=> the value is represented by the names of all classes found
+regToCategory = {
+	'alphanum' : re.compile(r'[A-Za-z0-9]'),
+	'onlyText' : re.compile(r'^[ \,\:\.\!\?\;A-Za-z0-9]+$'),
+	'alpha' : re.compile(r'[A-Za-z]'),
+	'alphaUpper' : re.compile(r'[A-Z]'),
+	'alphaLower' : re.compile(r'[a-z]'),
+	'url' : re.compile(r'[/?&]'),
+	'email' : re.compile(r'\w+@\w+\.\w'),
+	'tag' : re.compile(r'[<>/]'),
+	'function' : re.compile(r'\(.*\) *;?'),
+	'num' : re.compile(r'\d*[.,]?\d+'),
+	'onlyNum' : re.compile(r'^\d*[.,]?\d+$'),
+	'short_string' : re.compile(r'^.{1,100}$'),
+	'empty' : re.compile(r'^$'),
+	'long_string' : re.compile(r'^.{101}.*$'),
+	'reversepath' : re.compile(r'\.\.(\/|\\)')
+}
+
+# sets of characters for the classes consisting of single characters
+CHARS_ALPHA_UPPER = frozenset(string.ascii_uppercase)
+CHARS_ALPHA_LOWER = frozenset(string.ascii_lowercase)
+CHARS_ALPHA = CHARS_ALPHA_UPPER | CHARS_ALPHA_LOWER
+CHARS_ALPHANUM = CHARS_ALPHA | frozenset(string.digits)
+CHARS_ONLY_TEXT = CHARS_ALPHANUM | frozenset(' ,:.!?;')
+CHARS_URL = frozenset('/?&')
+CHARS_TAG = frozenset('<>/')
+
+# transformations of header values
+RE_VERSION = re.compile(r'(\d+(.|_))*\d+')
+RE_NON_ALPHANUM = re.compile(r'[^a-zA-Z0-9]')
+
+# values up to this length are cached (longer ones are rare and would make the cache unbounded in memory)
+MAX_CACHED_VALUE = 1024
+
+def valueToText(value):
+	"""Converts a value into the words representing the classes of characters
+	appearing in it (see regToCategory), e.g. `123` becomes
+	` value_alphanum value_onlyText value_short_string value_num value_onlyNum`.
+	The words of values up to MAX_CACHED_VALUE characters are cached.
+
+	Args:
+		value (str): The value to convert.
+
+	Returns:
+		str: the words, each prefixed by a space.
+	"""
+	if len(value) <= MAX_CACHED_VALUE:
+		return cachedValueToText(value)
+	return classifyValue(value)
+
+def classifyValue(value):
+	"""Converts a value into the words representing the classes of characters
+	appearing in it (see valueToText). The characters of the value are collected in a single pass, classes consisting of
+	single characters are decided by them and the remaining (compiled) expressions
+	are only run if the value contains the characters they need.
+
+	Args:
+		value (str): The value to convert.
+
+	Returns:
+		str: the words, each prefixed by a space.
+	"""
+	chars = set(value)
+	length = len(value)
+	has_num = regToCategory['num'].search(value) != None
+
+	t = ""
+	t += " value_alphanum" if not chars.isdisjoint(CHARS_ALPHANUM) else ""
+	t += " value_onlyText" if length > 0 and value[0] in CHARS_ONLY_TEXT and regToCategory['onlyText'].search(value) != None else ""
+	t += " value_alpha" if not chars.isdisjoint(CHARS_ALPHA) else ""
+	t += " value_alphaUpper" if not chars.isdisjoint(CHARS_ALPHA_UPPER) else ""
+	t += " value_alphaLower" if not chars.isdisjoint(CHARS_ALPHA_LOWER) else ""
+	t += " value_url" if not chars.isdisjoint(CHARS_URL) else ""
+	t += " value_email" if '@' in chars and '.' in chars and regToCategory['email'].search(value) != None else ""
+	t += " value_tag" if not chars.isdisjoint(CHARS_TAG) else ""
+	t += " value_function" if '(' in chars and ')' in chars and regToCategory['function'].search(value) != None else ""
+	t += " value_num" if has_num else ""
+	t += " value_onlyNum" if has_num and regToCategory['onlyNum'].search(value) != None else ""
+	t += " value_short_string" if 0 < length <= 101 and regToCategory['short_string'].search(value) != None else ""
+	t += " value_empty" if length <= 1 and regToCategory['empty'].search(value) != None else ""
+	t += " value_long_string" if length >= 101 and regToCategory['long_string'].search(value) != None else ""
+	t += " value_reversepath" if '..' in value and regToCategory['reversepath'].search(value) != None else ""
+	return t
+
+cachedValueToText = lru_cache(maxsize=8192)(classifyValue)
+
+def headerToText(context, header, isRequest=False, isResponse=False):
+	"""Converts a HTTP header into a list of words. Several value parameters are transformed:
+	- Version numbers are deleted or replaced by the string 'version'
+	- For dates, minutes and seconds are removed
+	- And others (see code).
+
+	Args:
+		context (RequestContext): The request the header belongs to.
+		header (list): HTTP header as list of (lowercased key, value) pairs
+		isRequest (bool, optional): Flag for request header. Defaults to False.
+		isResponse (bool, optional): Flag for response header. Defaults to False.
+
+	Returns:
+		list: A list of words generated from the header.
+	"""
+	t = []
+
+	if isRequest:
+		typePrefix = "request"
+	elif isResponse:
+		typePrefix = "response"
+	else:
+		typePrefix = ""
+
+	for key_low,value in header:
+		if key_low == 'cookie':
+			t.append(paramsToText(context, value, prefix=typePrefix + '_cookie', delimiter=';'))
+		elif key_low != 'x-zap-scan-id': # nothing to do for 'x-zap-scan-id' (internal zap flag for later classification)
+
+			if key_low not in ['accept', 'accept-encoding', 'accept-language', 'cache-control', 'connection', 'content-length', 'content-type', 'referer']:
+				t.append( typePrefix + '_header_' + key_low)
+
+			if key_low in ['x-powered-by', 'server', 'user-agent']:
+				t.append( RE_VERSION.sub('version', value).replace(' ', '') )
+			#elif key_low in ['accept', 'accept-language']:
+			#	t.append( re.sub(r';?q=[\d.]+', '', value).replace(' ', '') )
+			elif key_low in ['accept', 'accept-encoding', 'accept-language', 'connection', 'referer']:
+				pass
+			else:
+				t.append( RE_NON_ALPHANUM.sub('', value) )
+	return t
+
+def bodyToText(body):
+	"""Converts the body of a HTTP post request into a string of words. The
+	words represent the relevant classes of characters which appear in the value,
+	e.g. value_alphanum for alphanumerical characters (for the complete list,
+	see the dict called regToCategory above). Example: `key=123` becomes
+	`post_key value_alphanum value_onlyText value_short_string value_num value_onlyNum`.
+
+	Args:
+		body (dict): HTTP body key-value pairs.
+
+	Returns:
+		str: transformed body.
+	"""
+	t = []
+	for name, value in body.items():
+		t.append("post_" + name + valueToText(value))
+	return " ".join(t)
+
+def paramsToText(context, params, prefix='get', delimiter='&'):
+	"""Converts url parameters into a string of words. The words represent the
+	relevant classes of characters which appear in the values of the key-value
+	pairs. This is analogous to the `bodyToText` function.
+
+	Args:
+		context (RequestContext): The request the parameters belong to.
+		params (str): The url parameters to transform.
+		prefix (str, optional): Prefix specifying the request type. Defaults to 'get'.
+		delimiter (str, optional): The delimiter at which the parameters are split. Defaults to '&'.
+
+	Returns:
+		str: transformed url parameters.
+	"""
+	t = []
+	for parts in context.split_params(params, delimiter):
+		if len(parts) > 1:
+			# double url decode
+			t.append(prefix + "_" + parts[0] + valueToText(context.unquote(parts[1])))
+		else:
+			t.append(prefix + "_" + parts[0])
+	return " ".join(t)
 
 def get_text_from_request(request):
 	"""Converts a JSON request into text.
 
 	Args:
-		request (dict): The JSON request to transform into text
+		request (dict or RequestContext): The JSON request to transform into text
 
 	Returns:
 		str: The transformed request.
 	"""
-	regToCategory = {
-		'alphanum' : r'[A-Za-z0-9]',
-		'onlyText' : r'^[ \,\:\.\!\?\;A-Za-z0-9]+$',
-		'alpha' : r'[A-Za-z]',
-		'alphaUpper' : r'[A-Z]',
-		'alphaLower' : r'[a-z]',
-		'url' : r'[/?&]',
-		'email' : r'\w+@\w+\.\w',
-		'tag' : r'[<>/]',
-		'function' : r'\(.*\) *;?',
-		'num' : r'\d*[.,]?\d+',
-		'onlyNum' : r'^\d*[.,]?\d+$',
-		'short_string' : r'^.{1,100}$',
-		'empty' : r'^$',
-		'long_string' : r'^.{101}.*$',
-		'reversepath' : r'\.\.(\/|\\)'
-	}
-
-	def headerToText(header, isRequest=False, isResponse=False):
-		"""Converts a HTTP header into a list of words. Several value parameters are transformed:
-		- Version numbers are deleted or replaced by the string 'version'
-		- For dates, minutes and seconds are removed
-		- And others (see code).
-
-		Args:
-			header (dict): HTTP header as dict (representing the key-value pairs)
-			isRequest (bool, optional): Flag for request header. Defaults to False.
-			isResponse (bool, optional): Flag for response header. Defaults to False.
-
-		Returns:
-			list: A list of words generated from the header.
-		"""
-		t = []
-
-		if isRequest:
-			typePrefix = "request"
-		elif isResponse:
-			typePrefix = "response"
-		else:
-			typePrefix = ""			
-
-		for key,value in header.items():
-			key_low = key.lower()
-			if key_low == 'cookie':
-				t.append(paramsToText(value, prefix=typePrefix + '_cookie', delimiter=';'))
-			elif key_low != 'x-zap-scan-id': # nothing to do for 'x-zap-scan-id' (internal zap flag for later classification)
-				
-				if key_low not in ['accept', 'accept-encoding', 'accept-language', 'cache-control', 'connection', 'content-length', 'content-type', 'referer']:
-					t.append( typePrefix + '_header_' + key_low)
-			
-				if key_low in ['x-powered-by', 'server', 'user-agent']: 
-					t.append( re.sub(r'(\d+(.|_))*\d+', 'version', value).replace(' ', '') )
-				#elif key_low in ['accept', 'accept-language']: 
-				#	t.append( re.sub(r';?q=[\d.]+', '', value).replace(' ', '') )
-				elif key_low in ['accept', 'accept-encoding', 'accept-language', 'connection', 'referer']:
-					pass
-				else:
-					t.append( re.sub(r'[^a-zA-Z0-9]', '', value) )
-		return t
-
-	def bodyToText(body):
-		"""Converts the body of a HTTP post request into a string of words. The
-		words represent the relevant classes of characters which appear in the value,
-		e.g. value_alphanum for alphanumerical characters (for the complete list,
-		see the dict called regToCategory above). Example: `key=123` becomes
-		`post_key value_alphanum value_onlyText value_short_string value_num value_onlyNum`.
-
-		Args:
-			body (dict): HTTP body key-value pairs.
-
-		Returns:
-			str: transformed body.
-		"""
-		t = ""
-		for name, value in body.items():
-			if t != "":
-				t += " "
-
-			t += "post_" + name
-			for category, regex in regToCategory.items():
-				t += "" if re.search(regex, value) == None else " value_" + category
-		return t
-
-	def paramsToText(params, prefix='get', delimiter='&'):
-		"""Converts url parameters into a string of words. The words represent the
-		relevant classes of characters which appear in the values of the key-value
-		pairs. This is analogous to the `bodyToText` function.
-
-		Args:
-			params (str): The url parameters to transform.
-			prefix (str, optional): Prefix specifying the request type. Defaults to 'get'.
-			delimiter (str, optional): The delimiter at which the parameters are split. Defaults to '&'.
-
-		Returns:
-			str: transformed url parameters.
-		"""
-		t = ""
-		for param in params.split(delimiter):
-			if t != "":
-				t += " "
-
-			parts = param.split('=')
-			if len(parts) > 1:
-				name, value = parts[0], parts[1]
-
-				value_last = None # double url decode
-				while value_last != value:
-					value_last = value
-					value = unquote(value)
-
-				t += prefix + "_" + name
-				for category, regex in regToCategory.items():
-					t += "" if re.search(regex, value) == None else " value_" + category
-			else:
-				t += prefix + "_" + param
-
-		return t
+	context = RequestContext.of(request)
+	request = context.data
 
 	text = []
-	text.extend(headerToText(request['header'], isRequest=True))
-	text.extend(headerToText(request['honeypot']['response-header'], isResponse=True))
+	text.extend(headerToText(context, context.header_items, isRequest=True))
+	text.extend(headerToText(context, [(key.lower(), value) for key, value in request['honeypot']['response-header'].items()], isResponse=True))
 	text.append('request_method_' + request['request']['method'] + ' request_protocol_' + request['request']['protocol'])
 
 	# url as two parts => path to file and get params
-	if '?' in request['request']['uri']:
-		filepart = request['request']['uri'][0:request['request']['uri'].find('?')]
-		text.append(paramsToText(request['request']['uri'][request['request']['uri'].find('?')+1:]))
-	else:
-		filepart = request['request']['uri']
+	filepart, query = context.uri_parts
+	if query != None:
+		text.append(paramsToText(context, query))
 	
 	path_string = 'path_'
 	text.append( path_string )
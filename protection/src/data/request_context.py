@@ -0,0 +1,106 @@
+from src.transformation.HTTPTransformer import HTTPTransformer
+
+class RequestContext():
+	"""
+		Holds a request in the format used by the IDS together with the artifacts derived
+		from it (decoded uri, split parameters, lowercased headers, features for the models).
+		Each artifact is computed on first access and then reused by all predictors
+		classifying the same request.
+	"""
+
+	def __init__(self, data):
+		"""
+			Args:
+				data (dict): The request in the specified format used by the IDS.
+		"""
+		self.data = data
+		self.memo = {}
+
+	@staticmethod
+	def of(request):
+		"""
+			Returns the context for a request given as context or as dict.
+
+			Args:
+				request (dict or RequestContext): The request.
+		"""
+		return request if isinstance(request, RequestContext) else RequestContext(request)
+
+	def get(self, key, factory):
+		"""
+			Returns the artifact stored by key, creates it by calling factory()
+			if it does not exist yet.
+
+			Args:
+				key (string): The name of the artifact.
+				factory (callable): Creates the artifact.
+		"""
+		if key not in self.memo:
+			self.memo[key] = factory()
+		return self.memo[key]
+
+	def unquote(self, value):
+		"""
+			Repeatedly url decodes a value until it does not change anymore.
+
+			Args:
+				value (string): The encoded value.
+		"""
+		return self.get(('unquote', value), lambda: HTTPTransformer.nested_uri_decode(value))
+
+	def split_params(self, params, delimiter='&'):
+		"""
+			Splits parameters, e.g. of the query or the cookies, into a list of key-value pairs.
+			Each pair is a list of all parts separated by '=' (usually [key, value] or [key]).
+
+			Args:
+				params (string): The parameters to split.
+				delimiter (string): The delimiter between the parameters.
+		"""
+		return self.get(('params', params, delimiter), lambda: [param.split('=') for param in params.split(delimiter)])
+
+	@property
+	def uri(self):
+		"""
+			The uri as received.
+		"""
+		return self.data['request']['uri']
+
+	@property
+	def uri_parts(self):
+		"""
+			The uri split at the first '?', a tuple of the path and the query (None if no query given).
+		"""
+		def split():
+			if '?' in self.uri:
+				return self.uri[0:self.uri.find('?')], self.uri[self.uri.find('?')+1:]
+			return self.uri, None
+		return self.get('uri-parts', split)
+
+	@property
+	def query_pairs(self):
+		"""
+			The key-value pairs of the query (undecoded).
+		"""
+		return self.split_params(self.uri_parts[1] or "")
+
+	@property
+	def decoded_uri(self):
+		"""
+			The repeatedly url decoded uri.
+		"""
+		return self.unquote(self.uri)
+
+	@property
+	def uri_components(self):
+		"""
+			The components of the decoded uri (lowercased), see HTTPTransformer.split_uri_into_components().
+		"""
+		return self.get('uri-components', lambda: HTTPTransformer.split_uri_into_components(self.decoded_uri))
+
+	@property
+	def header_items(self):
+		"""
+			The request headers as list of (lowercased key, value).
+		"""
+		return self.get('header-items', lambda: [(key.lower(), value) for key, value in self.data['header'].items()])
\ No newline at end of file
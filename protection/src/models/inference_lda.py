@@ -0,0 +1,111 @@
+import numpy
+from scipy.special import psi
+
+def dirichlet_expectation(alpha):
+	"""
+		Expected value of log(theta) where theta is drawn from a Dirichlet distribution.
+		Args:
+			alpha (numpy.ndarray): Parameters of the Dirichlet distribution (one dimensional).
+	"""
+	return (psi(alpha) - psi(numpy.sum(alpha))).astype(alpha.dtype, copy=False)
+
+class LDAInference():
+	"""
+		Infers the topic distribution of a single document like the variational
+		E-step of gensim's LdaModel, but directly on the arrays of the model.
+		Only needs numpy (and scipy) to run.
+	"""
+
+	def __init__(self, exp_elogbeta, alpha, iterations=50, gamma_threshold=0.001, random_state=None):
+		"""
+			Args:
+				exp_elogbeta (numpy.ndarray): exp(E[log(beta)]) of the model, shape (topics, words).
+				alpha (numpy.ndarray): Prior of the topic distribution, shape (topics,).
+				iterations (int): Maximum number of iterations per document.
+				gamma_threshold (float): Minimum mean change of gamma to continue iterating.
+				random_state (numpy.random.RandomState): Used to initialize gamma (unless warm started).
+		"""
+		self.exp_elogbeta = exp_elogbeta
+		self.dtype = exp_elogbeta.dtype
+		self.alpha = numpy.asarray(alpha, dtype=self.dtype)
+		self.num_topics = exp_elogbeta.shape[0]
+
+		self.iterations = iterations
+		self.gamma_threshold = gamma_threshold
+		self.epsilon = numpy.finfo(self.dtype).eps
+		self.random_state = random_state if random_state != None else numpy.random.RandomState()
+
+	@staticmethod
+	def load(tm_path):
+		"""
+			Loads the inference of a gensim LdaModel saved at tm_path. The arrays saved next
+			to the model (e.g., expElogbeta) are memory mapped, the model itself is not kept.
+
+			Args:
+				tm_path (string): The path the model was saved to.
+		"""
+		import gensim
+		return LDAInference.from_model(gensim.models.ldamodel.LdaModel.load(tm_path, mmap='r'))
+
+	@staticmethod
+	def from_model(model):
+		"""
+			Creates the inference for a loaded gensim LdaModel, using its saved random state
+			(like gensim does), such that the verdicts are reproducible.
+
+			Args:
+				model (gensim.models.ldamodel.LdaModel): The loaded model.
+		"""
+		return LDAInference(model.expElogbeta, model.alpha, model.iterations, model.gamma_threshold, model.random_state)
+
+	def infer(self, bow, gamma=None):
+		"""
+			Runs the E-step for a document.
+
+			Args:
+				bow (list): The document as bag of words [(id, count), ...].
+				gamma (numpy.ndarray): Start from this gamma (e.g., of a similar document) instead
+					of a random one.
+
+			Returns (numpy.ndarray): gamma, the parameters of the topic distribution of the document.
+		"""
+		ids = numpy.fromiter((i for i, _ in bow), dtype=numpy.intp, count=len(bow))
+		cts = numpy.fromiter((c for _, c in bow), dtype=self.dtype, count=len(bow))
+
+		if gamma is None:
+			gammad = self.random_state.gamma(100., 1. / 100., self.num_topics).astype(self.dtype, copy=False)
+		else:
+			gammad = numpy.array(gamma, dtype=self.dtype)
+
+		exp_elogthetad = numpy.exp(dirichlet_expectation(gammad))
+		exp_elogbetad = self.exp_elogbeta[:, ids]
+		phinorm = numpy.dot(exp_elogthetad, exp_elogbetad) + self.epsilon
+
+		for _ in range(self.iterations):
+			lastgamma = gammad
+			gammad = self.alpha + exp_elogthetad * numpy.dot(cts / phinorm, exp_elogbetad.T)
+			exp_elogthetad = numpy.exp(dirichlet_expectation(gammad))
+			phinorm = numpy.dot(exp_elogthetad, exp_elogbetad) + self.epsilon
+
+			if numpy.mean(numpy.abs(gammad - lastgamma)) < self.gamma_threshold:
+				break
+
+		return gammad
+
+	def get_document_topics(self, bow, minimum_probability=0.001, gamma=None):
+		"""
+			Returns the topic distribution of a document, like LdaModel.get_document_topics()
+			(without per word topics).
+
+			Args:
+				bow (list): The document as bag of words [(id, count), ...].
+				minimum_probability (float): Topics with a lower probability are left out.
+				gamma (numpy.ndarray): Start from this gamma, see self.infer().
+
+			Returns two values: the distribution [(topic id, probability), ...], gamma of the document
+		"""
+		gamma = self.infer(bow, gamma)
+		topic_dist = gamma / numpy.sum(gamma)
+
+		minimum_probability = max(minimum_probability, 1e-8)
+		return [(tid, float(p)) for tid, p in enumerate(topic_dist) if p >= minimum_probability], gamma
@@ -0,0 +1,132 @@
+import os, time, threading, queue
+
+from src.models.predict_model import Predictor
+
+class BatchJob():
+	"""
+		A request waiting for its prediction by the BatchingPredictor.
+	"""
+
+	def __init__(self, processed_data):
+		self.processed_data = processed_data
+		self.result = None
+		self.error = None
+		self.done = threading.Event()
+
+class BatchingPredictor(Predictor):
+	"""
+		Wraps a NNPredictor and collects requests arriving concurrently, such that
+		they are run through the model in one call. A request is only delayed
+		while other requests are about to join the batch, a single request
+		is run directly.
+	"""
+
+	def __init__(self, predictor, max_wait=0.002, max_size=32):
+		"""
+			Args:
+				predictor (NNPredictor): The predictor to run the batches.
+				max_wait (float): Seconds to wait for further requests before running a batch.
+				max_size (int): Maximum number of requests per batch.
+		"""
+		self.predictor = predictor
+		self.max_wait = max_wait
+		self.max_size = max_size
+
+		self.jobs = queue.Queue()
+		self.lock = threading.Lock()
+		# number of callers currently in predict() (processing their request or waiting for the result)
+		self.pending = 0
+		# number of callers still processing their request, i.e., about to join the batch
+		self.processing = 0
+		# the thread running the batches is started by the first request of each process
+		self.pid = None
+		self.thread = None
+
+	def predict(self, request_data):
+		with self.lock:
+			self.pending += 1
+			self.processing += 1
+			if self.pid != os.getpid():
+				self.pid = os.getpid()
+				self.thread = threading.Thread(target=self.run_batches, daemon=True)
+				self.thread.start()
+
+		try:
+			try:
+				job = BatchJob(self.predictor.features(request_data.get_context()))
+				self.jobs.put(job)
+			finally:
+				with self.lock:
+					self.processing -= 1
+			job.done.wait()
+		finally:
+			with self.lock:
+				self.pending -= 1
+
+		if job.error != None:
+			raise job.error
+		return job.result
+
+	def fingerprint(self, context):
+		"""
+			See NNPredictor.fingerprint().
+		"""
+		return self.predictor.fingerprint(context)
+
+	def close(self):
+		"""
+			Stops the thread running the batches (after the queued requests), the predictor
+			must not be used afterwards.
+		"""
+		self.jobs.put(None)
+
+	def collect_batch(self):
+		"""
+			Waits for the next request and adds all requests arriving
+			within max_wait (as long as there are callers which did not
+			queue their request yet).
+
+			Returns the list of BatchJobs to run (None if closed).
+		"""
+		job = self.jobs.get()
+		if job == None:
+			return None
+		batch = [job]
+		deadline = time.monotonic() + self.max_wait
+		while len(batch) < self.max_size:
+			try:
+				job = self.jobs.get_nowait()
+			except queue.Empty:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0 or self.processing == 0:
+					break
+				try:
+					job = self.jobs.get(timeout=remaining)
+				except queue.Empty:
+					break
+
+			if job == None:
+				# closed, run this batch and stop with the next call
+				self.jobs.put(None)
+				break
+			batch.append(job)
+		return batch
+
+	def run_batches(self):
+		"""
+			Runs the collected batches and hands the results back to the callers.
+		"""
+		while True:
+			batch = self.collect_batch()
+			if batch == None:
+				return
+			try:
+				results = self.predictor.predict_processed([job.processed_data for job in batch])
+				for job, result in zip(batch, results):
+					job.result = result
+			except Exception as e:
+				for job in batch:
+					job.error = e
+			finally:
+				for job in batch:
+					job.done.set()
\ No newline at end of file
@@ -1,9 +1,72 @@
 import gensim 
 import json
-import time, os
+import numpy
+import os, sys
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from src.data.make_datasets_lda import get_text_from_request
 from src.models.predict_model import Predictor
+from src.models.inference_lda import LDAInference
+from src.utils.connection_table import ConnectionTable
+from src.utils.shared_state import is_shared, SharedWindowStore
+from src.utils import metrics
+from src.utils.metrics import STAGES
+
+TRUNCATED = metrics.counter("prp_lda_truncated_requests_total", "Requests with more different words than stored per request in the windows shared by the workers (CONNECTION_WORDS).")
+
+class ConnectionWindow():
+	"""
+		The window of the last requests of a connection. Each request is kept as arrays
+		of its word ids and counts, the bag of words of the whole window is updated
+		incrementally by adding the newest and subtracting the expired request.
+	"""
+
+	SIZE = 5
+
+	def __init__(self):
+		self.requests = deque()
+		self.counts = {}
+		# gamma of the last inference for the window (see LDAPredictor.WARM_START)
+		self.gamma = None
+
+	def push(self, bow):
+		"""
+			Adds a request to the window, removes the oldest one if the window is full.
+
+			Args:
+				bow (list): The request as bag of words [(id, count), ...].
+		"""
+		if len(self.requests) >= ConnectionWindow.SIZE:
+			ids, cts = self.requests.popleft()
+			for i, c in zip(ids, cts):
+				if self.counts[i] == c:
+					del self.counts[i]
+				else:
+					self.counts[i] -= c
+
+		for i, c in bow:
+			self.counts[i] = self.counts.get(i, 0) + c
+		self.requests.append((array('I', [i for i, _ in bow]), array('I', [c for _, c in bow])))
+
+	def bow(self):
+		"""
+			Returns the bag of words of all requests in the window [(id, count), ...].
+		"""
+		return sorted(self.counts.items())
+
+	def sizeof(self):
+		"""
+			Estimates the bytes of memory used by the window.
+		"""
+		size = sys.getsizeof(self) + sys.getsizeof(self.requests) + sys.getsizeof(self.counts) \
+			+ len(self.counts) * 2 * 28 # the ints of the counts
+		for ids, cts in self.requests:
+			size += sys.getsizeof(ids) + sys.getsizeof(cts)
+		if self.gamma is not None:
+			size += self.gamma.nbytes
+		return size
 
 class LDAPredictor(Predictor):
 	"""
@@ -11,10 +74,23 @@ class LDAPredictor(Predictor):
 	"""
 
 	BLOCK_CRAWLING = os.environ.get("BLOCK_CRAWLING") == "true"
-	CLEANUP_WINDOWS = 2000
-	KEEP_ON_CLEANUP = 1000
+	# start the inference for a window from the result of the connection's previous window
+	WARM_START = os.environ.get("LDA_WARM_START") == "true"
+	# limits for the windows of the connections: memory in MB and seconds until an idle window is removed
+	WINDOWS_MEMORY = float(os.environ.get("CONNECTION_MEMORY")) if len(os.environ.get("CONNECTION_MEMORY", "")) > 0 else 64
+	WINDOWS_TTL = int(os.environ.get("CONNECTION_TTL")) if len(os.environ.get("CONNECTION_TTL", "")) > 0 else 3600
+	# maximum number of different words stored per request in the windows shared by multiple workers
+	WINDOWS_WORDS = int(os.environ.get("CONNECTION_WORDS")) if len(os.environ.get("CONNECTION_WORDS", "")) > 0 else 256
 
-	def __init__(self, index, models_dir):
+	def __init__(self, index, models_dir, shared_windows=None):
+		"""
+			Args:
+				index (dict): The part of the index.json representing the model.
+				models_dir (string): The basepath where the models are located.
+				shared_windows (SharedWindowStore): The windows of a replaced predictor (on reload),
+					reused if there are multiple workers (the memory is shared with the other workers).
+					The windows are cleared, as the word ids of the models differ.
+		"""
 		self.load_model(
 			models_dir + index["topicmodel"],
 			models_dir + index["dictionary"],
@@ -22,8 +98,28 @@ class LDAPredictor(Predictor):
 		)
 
 		# store requests for window
-		self.known_requests = {}
-		self.connection_id_last = {}
+		#	multiple workers => windows in shared memory, visible to all workers
+		#		a request has at most as many different words as the dictionary, no need for larger slots
+		if is_shared():
+			num_topics = self.inference.num_topics if LDAPredictor.WARM_START else 0
+			max_words = max(1, min(len(self.dict), LDAPredictor.WINDOWS_WORDS))
+			if shared_windows != None and shared_windows.num_topics == num_topics and shared_windows.max_words == max_words:
+				self.shared_windows = shared_windows
+				self.shared_windows.clear()
+			else:
+				self.shared_windows = SharedWindowStore(
+					max(1, int(LDAPredictor.WINDOWS_MEMORY * 1024 * 1024) // SharedWindowStore.bytes_per_slot(ConnectionWindow.SIZE, max_words, num_topics)),
+					window_size=ConnectionWindow.SIZE,
+					max_words=max_words,
+					num_topics=num_topics
+				)
+		else:
+			self.shared_windows = None
+			self.known_requests = ConnectionTable(
+				max_bytes=int(LDAPredictor.WINDOWS_MEMORY * 1024 * 1024),
+				ttl=LDAPredictor.WINDOWS_TTL,
+				sizeof=lambda w: w.sizeof()
+			)
 
 	def load_model(self, tm_path, dict_path, dist_path):
 		"""Loads the LDA model which should be used for prediction (testing).
@@ -37,16 +133,26 @@ class LDAPredictor(Predictor):
 		"""
 
 		# load corpus (as bow) and dictionary
-		trained_topics = json.load(open(dist_path, 'r'))
-		self.trained_dists = self.transform_topics_for_hellinger(
+		#	reading (and parsing) the files concurrently, the distributions are the largest file
+		with ThreadPoolExecutor(max_workers=2, thread_name_prefix="loading-lda") as executor:
+			trained_topics = executor.submit(LDAPredictor.load_json, dist_path)
+			dictionary = executor.submit(gensim.corpora.Dictionary.load, dict_path)
+			# only the arrays of the model are kept (see LDAInference.load())
+			self.inference = LDAInference.load(tm_path)
+			self.dict = dictionary.result()
+			trained_topics = trained_topics.result()
+
+		self.trained_labels, self.trained_dists = self.transform_topics_for_hellinger(
 			trained_topics['requestTopics']['types'],
 			trained_topics['requestTopics']['emulators'], 
 			trained_topics['requestTopics']['zap-ids']
 		)
 
-		self.dict = gensim.corpora.Dictionary.load(dict_path)
-		self.model = gensim.models.ldamodel.LdaModel.load(tm_path)
 
+	@staticmethod
+	def load_json(path):
+		with open(path, 'r') as file:
+			return json.load(file)
 
 	def transform_topics_for_hellinger(self, *topics):
 		"""Brings the topic distributions into a format that can be used to compute the
@@ -56,67 +162,74 @@ class LDAPredictor(Predictor):
 			*topics (dict): The topic distributions which should be converted.
 
 		Returns:
-			(dict): A dictionary containing the probability distributions for each topic
-			in a format usable with gensim.hellinger.
+			(list, numpy.ndarray): The labels of the distributions and a matrix containing
+			the square roots of the probabilities, one row per label (same order).
 		"""
 
-		# extract known distributions of types and emulators in a format that can be used with gensim.hellinger
+		# extract known distributions of types and emulators (later ones replace equally named)
 		result = {}
 		for topic in topics:
 			for dist in topic.keys():
-				result[dist] = []
-				for tid,prob in enumerate(topic[dist], start=0):
-					result[dist].append([tid,prob])
+				result[dist] = topic[dist]
 
-		return result
+		num_topics = max([self.inference.num_topics] + [len(d) for d in result.values()])
+		matrix = numpy.zeros((len(result), num_topics))
+		for row, dist in enumerate(result.values()):
+			matrix[row, :len(dist)] = dist
 
-	def get_best_topics(self, bow):
+		return list(result.keys()), numpy.sqrt(matrix)
+
+	def get_best_topics(self, bow, topn=5, gamma=None):
 		"""
 			Calculate the prediction, by assuming the topic distribution and
 			matching against all known distributions. 
 			Args:
 				bow: a bag of word of the request
-			Returns (array): attack types [['type', distance], ...] sorted by distance
+				topn (int): number of most similar distributions to return
+				gamma (numpy.ndarray): start the inference from this gamma (see LDAInference.infer())
+			Returns two values: attack types [['type', distance], ...] sorted by distance (array), gamma of the bow
 		"""
-		predicted_dist = self.model.get_document_topics(
-			bow,
-			minimum_probability=0.001,
-			minimum_phi_value=0.001,
-			per_word_topics=False
-		)
+		with STAGES.time('lda_inference'):
+			predicted_dist, gamma = self.inference.get_document_topics(bow, minimum_probability=0.001, gamma=gamma)
+
+		with STAGES.time('lda_matching'):
+			predicted = numpy.zeros(self.trained_dists.shape[1])
+			for tid, prob in predicted_dist:
+				predicted[tid] = prob
 
-		# compare predictions to all known distributions of types and emulators
-		hellinger_distances = []
-		for dist_type,dist_values in self.trained_dists.items():
-			hellinger_distances.append([dist_type, gensim.matutils.hellinger(predicted_dist, dist_values)])
+			# compare predictions to all known distributions of types and emulators (hellinger distance)
+			distances = numpy.sqrt(0.5 * numpy.square(self.trained_dists - numpy.sqrt(predicted)).sum(axis=1))
 
-		#  sort in a way, such that most similar label is first
-		hellinger_distances.sort(key=lambda t: t[1])
+			# select the most similar ones (including all equal to the topn-th), and
+			#	sort in a way, such that most similar label is first (keeping the order of the labels on ties)
+			if topn < len(distances):
+				kth = distances[numpy.argpartition(distances, topn - 1)[topn - 1]]
+				best = numpy.flatnonzero(distances <= kth)
+			else:
+				best = numpy.arange(len(distances))
+			best = best[numpy.argsort(distances[best], kind='stable')][:topn]
 
-		return hellinger_distances
+		return [[self.trained_labels[i], float(distances[i])] for i in best], gamma
 
 	def predict(self, request_data):
-		data = request_data.create_dict()
-		document = get_text_from_request(data)
+		context = request_data.get_context()
+		data = context.data
+		with STAGES.time('lda_text'):
+			document = get_text_from_request(context)
 
 		# create window of 5
-		if data["connection-id"] not in self.known_requests:
-			self.known_requests[data["connection-id"]] = []
-		elif len(self.known_requests[data["connection-id"]]) > 4:
-			self.known_requests[data["connection-id"]].pop(0)
-		self.known_requests[data["connection-id"]].append(document)
-		self.connection_id_last[data["connection-id"]] = int(time.time())
-
-		self.keep_memory_free()
-
-		bow = self.dict.doc2bow(
+		bow, gamma = self.push_window(data["connection-id"], self.dict.doc2bow(
 			filter(
 				lambda t: len(t.strip()) > 0,
-				' '.join(self.known_requests[data["connection-id"]]).split(' ')
+				document.split(' ')
 			)
-		)
+		))
+
+		predicted, gamma = self.get_best_topics(bow, 6, # one more than returned, as "attack" may be ignored
+			gamma if LDAPredictor.WARM_START else None)
+		if LDAPredictor.WARM_START:
+			self.store_gamma(data["connection-id"], gamma)
 
-		predicted = self.get_best_topics(bow)
 		# the best prediction is the one with the lowest hellinger distance
 		# 	but if "only zap id is attack", we learn on ZAP-files attacks (id != -1) and non attacks (id == -1) as "attack" so we ignore the prediction "attack"
 		#	and use only ids and emulators
@@ -128,13 +241,58 @@ class LDAPredictor(Predictor):
 
 		return is_attack, predicted[:5]
 
-	def keep_memory_free(self):
+	def push_window(self, connection_id, bow):
+		"""
+			Adds a request to the window of a connection.
+
+			Args:
+				connection_id (int): The id of the connection.
+				bow (list): The request as bag of words [(id, count), ...].
+
+			Returns two values: bag of words of the window [(id, count), ...], gamma of the
+			last inference for the window (None if there is none)
 		"""
-			Makes sure that the dictionary of known requests and the dictionary of
-			connection ids do not get too big by deleting the oldest entries when
-			the maximum size has been reached.
+		if self.shared_windows != None:
+			# the request itself is classified with all its words, the following ones with its most frequent words
+			if len(bow) > self.shared_windows.max_words:
+				TRUNCATED.inc()
+			return self.shared_windows.push(connection_id, bow)
+
+		# concurrent requests of a connection must not create two windows or push at the same time
+		#	(the counts would get out of sync with the requests of the window)
+		with self.known_requests.lock:
+			window = self.known_requests.get(connection_id)
+			if window == None:
+				window = ConnectionWindow()
+				self.known_requests.put(connection_id, window)
+			window.push(bow)
+			self.known_requests.resize(connection_id)
+
+			return window.bow(), window.gamma
+
+	def store_gamma(self, connection_id, gamma):
+		"""
+			Stores the gamma of the last inference for the window of a connection.
+
+			Args:
+				connection_id (int): The id of the connection.
+				gamma (numpy.ndarray): The gamma to store.
+		"""
+		if self.shared_windows != None:
+			self.shared_windows.store_gamma(connection_id, gamma)
+		else:
+			window = self.known_requests.get(connection_id)
+			if window != None:
+				window.gamma = gamma
+
+	def remove_window(self, connection_id):
+		"""
+			Removes the window of a connection.
+
+			Args:
+				connection_id (int): The id of the connection.
 		"""
-		if len(self.known_requests) > LDAPredictor.CLEANUP_WINDOWS:
-			for cid,_ in sorted(self.connection_id_last.items(), key=lambda l: l[1], reverse=True)[LDAPredictor.KEEP_ON_CLEANUP:]:
-				del self.known_requests[cid]
-				del self.connection_id_last[cid]
\ No newline at end of file
+		if self.shared_windows != None:
+			self.shared_windows.remove(connection_id)
+		else:
+			self.known_requests.pop(connection_id)
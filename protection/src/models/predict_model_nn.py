@@ -1,17 +1,21 @@
 import json
 import os
+import hashlib
+import warnings
 
 # disable tf warnings and infos
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
 
 import tensorflow as tf
-import pandas, numpy
-numpy.warnings.filterwarnings("ignore")
+import numpy
+warnings.filterwarnings("ignore")
 tf.get_logger().setLevel('ERROR')
 
 from src.transformation.HTTPTransformer import HTTPTransformer
 from src.transformation.HTTPHeaders import transform_header_dict, HTTP_RELEVANT_HEADERS
 from src.models.predict_model import Predictor
+from src.data.request_context import RequestContext
+from src.utils.metrics import STAGES
 
 class NNPredictor(Predictor):
 
@@ -19,22 +23,46 @@ class NNPredictor(Predictor):
 		self.model = tf.keras.models.load_model(models_dir + index["tfmodel"])
 		self.labels = json.load(open(models_dir + index["labels"], 'r'))
 
+		self.create_serving_function()
+
+	def create_serving_function(self):
+		"""
+			Reads the inputs of the model and traces a function running the model
+			for exactly these inputs. The requests are then passed as tensors directly,
+			without building a dataframe and a dataset per request.
+			Models without named inputs are run via self.create_tf_dataset().
+		"""
+		self.inputs = {}
+		self.serve = None
+
+		if getattr(self.model, 'inputs', None):
+			signature = {}
+			for model_input in self.model.inputs:
+				name = model_input.name.split(':')[0]
+				self.inputs[name] = model_input.dtype
+				signature[name] = tf.TensorSpec(shape=[None, 1], dtype=model_input.dtype, name=name)
+
+			self.serve = tf.function(lambda inputs: self.model(inputs, training=False), input_signature=[signature])
+
 	def process(self, data):
 		"""
 			Transforms the given request into a dictionary usable for the precition in the nn.
 			Args:
-				data (dict): The request in the specified format used by the IDS.
+				data (dict or RequestContext): The request in the specified format used by the IDS.
 		"""
+		context = RequestContext.of(data)
+		data = context.data
+
 		request = data['request']
-		uri_obj = HTTPTransformer.uri_transformation_wrapper(request['uri'])
+		uri_obj = context.uri_components
 		r = {
 			"label": "no zap id",
 			"original-zap-id": "no zap id",
 			"method": request['method'],
-			"uri-path": uri_obj['path'],
-			"uri-query": uri_obj['query'],
+			"uri-path": HTTPTransformer.handle_path(uri_obj['path']),
+			"uri-query": HTTPTransformer.handle_query(uri_obj['query']),
 			"body": "" if request['body'] == "" else HTTPTransformer.handle_body(request['body']),
-			"request-length": data['header']["Content-Length"] if "Content-Length" in data['header'] else -1,
+			"request-length": NNPredictor.content_length(data['header']),
 			"uri-length": len(request['uri']),
 			"body-length": len(request['body'])
 		}
@@ -42,26 +70,105 @@ class NNPredictor(Predictor):
 		header_dict = transform_header_dict(data['header'], headers=HTTP_RELEVANT_HEADERS)
 		return {**r, **header_dict}
 
+	@staticmethod
+	def content_length(header):
+		"""
+			Returns the Content-Length of a request as number, -1 if missing or invalid. Converted per
+			request, such that a single invalid value does not fail the prediction of a whole batch.
+			Args:
+				header (dict): The header of the request.
+		"""
+		try:
+			length = int(str(header.get("Content-Length", "")).strip())
+		except ValueError:
+			return -1
+		return length if length >= 0 else -1
+
+	def features(self, context):
+		"""
+			Returns the result of self.process() for a request, the nns share the
+			result for the same request.
+			Args:
+				context (RequestContext): The request to transform.
+		"""
+		def create():
+			with STAGES.time('nn_process'):
+				return self.process(context)
+		return context.get('nn-features', create)
+
+	def fingerprint(self, context):
+		"""
+			Returns a hash of the features used by the nn (method, masked path, query and body,
+			present headers and lengths). Requests with the same fingerprint get the same prediction.
+			Args:
+				context (RequestContext): The request to hash.
+		"""
+		def create():
+			features = self.features(context)
+			values = [[k, features[k]] for k in sorted(features.keys()) if k not in ['label', 'original-zap-id']]
+			return hashlib.blake2b(json.dumps(values).encode(), digest_size=16).digest()
+		return context.get('nn-fingerprint', create)
+
+	def create_tensors(self, processed_data):
+		"""
+			Packs the given data into one tensor per input of the model
+			Args:
+				processed_data (list): results of self.process(), one per request
+		"""
+		tensors = {}
+		for name, dtype in self.inputs.items():
+			if dtype == tf.string:
+				values = numpy.array([str(p[name]) for p in processed_data], dtype=object)
+			else:
+				values = numpy.array([float(p[name]) for p in processed_data], dtype=dtype.as_numpy_dtype)
+			tensors[name] = tf.constant(values.reshape(-1, 1), dtype=dtype)
+		return tensors
+
 	def create_tf_dataset(self, processed_data):
 		"""
 			Transform the given data into a dataframe for usage in TensorFlow
 			Args:
-				processed_data (dict): result of self.process()
+				processed_data (list): results of self.process(), one per request
 		"""
-		dataframe = pandas.DataFrame(processed_data, index=[0])
+		# only needed for models without named inputs (see create_serving_function())
+		import pandas
+		dataframe = pandas.DataFrame(processed_data, index=range(len(processed_data)))
 		dataframe['bin_label'] = dataframe.apply(lambda row: 'without zap-id' if row['label'] == "no zap id" else 'with zap-id', axis=1)
 		labels = dataframe.pop('bin_label')
 		ds = tf.data.Dataset.from_tensor_slices((dict(dataframe), labels))
-		return ds.batch(1)
+		return ds.batch(len(processed_data))
 
 	def predict(self, request_data):
-		data = request_data.create_dict()
-		processed_data = self.process(data)
+		processed_data = self.features(request_data.get_context())
 
-		predicted = self.model.predict(self.create_tf_dataset(processed_data))
-		
+		return self.predict_processed([processed_data])[0]
+
+	def predict_processed(self, processed_data):
+		"""
+			Runs the model once for a batch of requests.
+			Args:
+				processed_data (list): results of self.process(), one per request
+
+			Returns a list containing the two values of predict() for each request
+		"""
+		with STAGES.time('nn_predict'):
+			if self.serve != None:
+				predicted = self.serve(self.create_tensors(processed_data)).numpy()
+			else:
+				predicted = self.model.predict(self.create_tf_dataset(processed_data))
+
+		return [self.evaluate(p) for p in predicted]
+
+	def evaluate(self, predicted):
+		"""
+			Matches the output of the model for one request against the labels.
+			Args:
+				predicted (array): the probabilities for each label
+
+			Returns the two values of predict()
+		"""
 		predictions = []
-		for prob, label in zip(predicted[0], self.labels):
+		for prob, label in zip(predicted, self.labels):
 			predictions.append([label, 1-prob])
 
 		#  sort in a way, such that most probable label (=small value) is first 
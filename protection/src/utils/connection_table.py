@@ -0,0 +1,148 @@
+import time, threading
+from collections import OrderedDict
+
+class ConnectionTable():
+	"""
+		Bounded table holding some state per connection.
+
+		The entries are kept in the order of their last access, each access moves the
+		entry to the end in O(1). Hence, the entries idle for the longest time are
+		always at the front: expiring idle entries and removing entries to stay within
+		the limits (number of entries, memory) only looks at the front of the table.
+	"""
+
+	def __init__(self, max_entries=None, max_bytes=None, ttl=None, sizeof=None):
+		"""
+			Args:
+				max_entries (int): The maximum number of entries (None for no limit).
+				max_bytes (int): The maximum memory used by all entries, as estimated by
+					sizeof (None for no limit).
+				ttl (int): Seconds after which an entry not accessed is removed (None for never).
+				sizeof (callable): Estimates the bytes used by a value, called on each
+					put() and resize().
+		"""
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.sizeof = sizeof if sizeof != None else (lambda v: 0)
+
+		# key => [value, size, last access]
+		self.entries = OrderedDict()
+		self.bytes = 0
+		self.lock = threading.RLock()
+
+		self.evictions = 0
+		self.expirations = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, key):
+		return key in self.entries
+
+	def get(self, key, default=None):
+		"""
+			Returns the value of an entry (and marks it as accessed) or default if there is none.
+
+			Args:
+				key: The key of the entry (e.g., the connection id).
+				default: Returned if there is no entry.
+		"""
+		with self.lock:
+			self.cleanup()
+			if key not in self.entries:
+				return default
+
+			entry = self.entries[key]
+			entry[2] = time.monotonic()
+			self.entries.move_to_end(key)
+			return entry[0]
+
+	def put(self, key, value):
+		"""
+			Stores the value of an entry (replaces an existing one).
+
+			Args:
+				key: The key of the entry.
+				value: The value to store.
+		"""
+		with self.lock:
+			if key in self.entries:
+				self.bytes -= self.entries[key][1]
+			size = self.sizeof(value)
+			self.entries[key] = [value, size, time.monotonic()]
+			self.entries.move_to_end(key)
+			self.bytes += size
+			self.cleanup()
+
+	def resize(self, key):
+		"""
+			Estimates the memory of an entry again, call after changing the value.
+
+			Args:
+				key: The key of the entry.
+		"""
+		with self.lock:
+			if key in self.entries:
+				entry = self.entries[key]
+				size = self.sizeof(entry[0])
+				self.bytes += size - entry[1]
+				entry[1] = size
+				self.cleanup()
+
+	def pop(self, key, default=None):
+		"""
+			Removes an entry and returns its value (default if there is none).
+		"""
+		with self.lock:
+			if key not in self.entries:
+				return default
+			value, size, _ = self.entries.pop(key)
+			self.bytes -= size
+			return value
+
+	def items(self):
+		"""
+			Returns a list of (key, value) of all entries, oldest access first.
+		"""
+		with self.lock:
+			self.cleanup()
+			return [(key, entry[0]) for key, entry in self.entries.items()]
+
+	def clear(self):
+		"""
+			Removes all entries.
+		"""
+		with self.lock:
+			self.entries.clear()
+			self.bytes = 0
+
+	def cleanup(self):
+		"""
+			Removes idle entries and the least recently used ones while the table exceeds its limits.
+		"""
+		if self.ttl != None:
+			idle_since = time.monotonic() - self.ttl
+			while len(self.entries) > 0 and next(iter(self.entries.values()))[2] < idle_since:
+				_, size, _ = self.entries.popitem(last=False)[1]
+				self.bytes -= size
+				self.expirations += 1
+
+		while len(self.entries) > 1 and (
+			(self.max_entries != None and len(self.entries) > self.max_entries)
+			or (self.max_bytes != None and self.bytes > self.max_bytes)
+		):
+			_, size, _ = self.entries.popitem(last=False)[1]
+			self.bytes -= size
+			self.evictions += 1
+
+	def stats(self):
+		"""
+			Returns the counters of the table as dict.
+		"""
+		return {
+			'size' : len(self.entries),
+			'bytes' : self.bytes,
+			'evictions' : self.evictions,
+			'expirations' : self.expirations
+		}
\ No newline at end of file
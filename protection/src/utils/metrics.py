@@ -0,0 +1,390 @@
+import os, time, math, mmap, threading, multiprocessing, contextlib
+import numpy
+
+from src.utils.shared_state import is_shared
+
+def is_enabled():
+	"""
+		Returns whether metrics are collected (env. variable METRICS).
+	"""
+	return "METRICS" in os.environ and os.environ.get("METRICS") == "true"
+
+class Registry():
+	"""
+		Holds the values of all metrics in one array. If there are multiple workers, the
+		array is in memory shared by all processes forked after its creation, such that
+		each worker can export the metrics of all workers.
+
+		Metrics have to be declared before the workers are forked, i.e., when importing
+		the modules (as the position of a metric's values in the array is given by the
+		order of the declarations).
+	"""
+
+	# number of values of all counters and histograms
+	SIZE = 16384
+	# gauges are set by each process, number of processes and gauges
+	PROCESSES = 64
+	GAUGES = 128
+	# number of locks, metrics share a lock by their offset (modulo)
+	LOCKS = 16
+
+	def __init__(self):
+		self.enabled = is_enabled()
+		self.metrics = []
+		self.next_offset = 0
+		self.gauges = []
+
+		size = Registry.SIZE + Registry.PROCESSES * (Registry.GAUGES + 1)
+		if self.enabled and is_shared():
+			self.memory = mmap.mmap(-1, size * 8)
+			self.memory_values = numpy.frombuffer(self.memory, dtype=numpy.float64)
+			self.locks = [multiprocessing.Lock() for _ in range(Registry.LOCKS)]
+		else:
+			self.memory_values = numpy.zeros(size if self.enabled else 0, dtype=numpy.float64)
+			self.locks = [threading.Lock() for _ in range(Registry.LOCKS)]
+
+		self.values = self.memory_values[:Registry.SIZE] if self.enabled else self.memory_values
+		# updating single values is much faster via a memoryview than via numpy
+		self.cells = memoryview(self.values)
+		if self.enabled:
+			# row per process: pid, values of the gauges
+			self.gauge_rows = self.memory_values[Registry.SIZE:].reshape((Registry.PROCESSES, Registry.GAUGES + 1))
+
+		self.pid = None
+		self.row = None
+		self.last_update = 0
+
+		# threads not recording values (see paused())
+		self.paused_threads = set()
+
+	def allocate(self, metric, size):
+		"""
+			Reserves the values of a metric, returns the offset of the first one.
+		"""
+		if self.next_offset + size > Registry.SIZE:
+			raise ValueError("Too many metrics, increase Registry.SIZE!")
+		offset = self.next_offset
+		self.next_offset += size
+		self.metrics.append(metric)
+		return offset
+
+	def add_gauge(self, gauge):
+		"""
+			Registers a gauge, returns its index in the rows of the processes.
+		"""
+		if len(self.gauges) >= Registry.GAUGES:
+			raise ValueError("Too many gauges, increase Registry.GAUGES!")
+		self.gauges.append(gauge)
+		self.metrics.append(gauge)
+		return len(self.gauges) - 1
+
+	def claim_row(self):
+		"""
+			Returns the row of the current process to store its gauges (claims a free one or one
+			of a process not running anymore).
+		"""
+		with self.locks[0]:
+			pids = self.gauge_rows[:, 0]
+			for row in range(Registry.PROCESSES):
+				pid = int(pids[row])
+				if pid == 0 or pid == os.getpid() or not Registry.is_running(pid):
+					self.gauge_rows[row, :] = 0
+					self.gauge_rows[row, 0] = os.getpid()
+					return row
+		return None
+
+	@staticmethod
+	def is_running(pid):
+		try:
+			os.kill(pid, 0)
+			return True
+		except ProcessLookupError:
+			return False
+		except PermissionError:
+			return True
+
+	def update_gauges(self, force=False):
+		"""
+			Stores the current values of the gauges of this process, at most once per second.
+		"""
+		if not self.enabled or len(self.gauges) == 0:
+			return
+
+		now = time.monotonic()
+		if not force and now - self.last_update < 1:
+			return
+		self.last_update = now
+
+		if self.pid != os.getpid():
+			self.pid = os.getpid()
+			self.row = self.claim_row()
+		if self.row == None:
+			return
+
+		for i, gauge in enumerate(self.gauges):
+			try:
+				self.gauge_rows[self.row, i + 1] = gauge.callback()
+			except:
+				self.gauge_rows[self.row, i + 1] = 0
+
+	def gauge_sum(self, index):
+		"""
+			Returns the sum of a gauge over all running processes.
+		"""
+		total = 0
+		for row in range(Registry.PROCESSES):
+			pid = int(self.gauge_rows[row, 0])
+			if pid != 0 and (pid == os.getpid() or Registry.is_running(pid)):
+				total += self.gauge_rows[row, index + 1]
+		return total
+
+	@contextlib.contextmanager
+	def paused(self):
+		"""
+			Records no values of the calling thread within the block (e.g., while warming up
+			the models), other threads keep recording.
+		"""
+		thread = threading.get_ident()
+		self.paused_threads.add(thread)
+		try:
+			yield
+		finally:
+			self.paused_threads.discard(thread)
+
+	def is_recording(self):
+		"""
+			Returns whether values of the calling thread are recorded.
+		"""
+		return self.enabled and not (self.paused_threads and threading.get_ident() in self.paused_threads)
+
+	def render(self):
+		"""
+			Returns all metrics in the text format of Prometheus.
+		"""
+		if not self.enabled:
+			return ""
+
+		self.update_gauges(force=True)
+		lines = []
+		for metric in self.metrics:
+			lines.extend(metric.render())
+		return "\n".join(lines) + "\n"
+
+def format_labels(labels, extra=[]):
+	"""
+		Formats the labels of a series, e.g., {stage="lda",le="0.5"}.
+		Args:
+			labels (list): (name, value) of the labels
+			extra (list): (name, value) of further labels
+	"""
+	pairs = list(labels) + list(extra)
+	if len(pairs) == 0:
+		return ""
+	return "{" + ",".join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for name, value in pairs) + "}"
+
+class Metric():
+	"""
+		A metric with a fixed set of label values (all combinations are declared up front).
+	"""
+
+	TYPE = "untyped"
+
+	def __init__(self, registry, name, description, labels):
+		"""
+			Args:
+				registry (Registry): The registry holding the values.
+				name (string): The name of the metric.
+				description (string): The help text.
+				labels (dict): The values of each label {name : [value, ...]}.
+		"""
+		self.registry = registry
+		self.name = name
+		self.description = description
+		self.label_names = list(labels.keys())
+
+		# all combinations of label values
+		self.series = [()]
+		for name in self.label_names:
+			self.series = [s + (value,) for s in self.series for value in labels[name]]
+
+	def header(self):
+		return ["# HELP " + self.name + " " + self.description, "# TYPE " + self.name + " " + self.TYPE]
+
+	def labels(self, series):
+		return list(zip(self.label_names, series))
+
+class Counter(Metric):
+	"""
+		A value only increasing, e.g., the number of requests.
+	"""
+
+	TYPE = "counter"
+
+	def __init__(self, registry, name, description, labels={}):
+		super().__init__(registry, name, description, labels)
+		self.offset = registry.allocate(self, len(self.series)) if registry.enabled else 0
+		self.index = {series : self.offset + i for i, series in enumerate(self.series)}
+
+	def inc(self, *labels, amount=1):
+		"""
+			Increments the counter of the series given by the label values (in the order of declaration).
+			Unknown label values are ignored.
+		"""
+		if not self.registry.is_recording():
+			return
+		i = self.index.get(labels)
+		if i != None:
+			with self.registry.locks[i % Registry.LOCKS]:
+				self.registry.cells[i] += amount
+
+	def render(self):
+		return self.header() + [
+			self.name + format_labels(self.labels(series)) + " " + repr(float(self.registry.values[i]))
+			for series, i in self.index.items()
+		]
+
+class Histogram(Metric):
+	"""
+		Distribution of durations (in seconds), like an HDR histogram: each power of two
+		is split into SUB_BUCKETS buckets, such that the relative error is bounded
+		(about 19%) from a microsecond to minutes. Recording is O(1).
+	"""
+
+	TYPE = "histogram"
+
+	SUB_BUCKETS = 4
+	# smallest and largest bucket: 2^MIN_EXP (about 1us) to 2^MAX_EXP (128s)
+	MIN_EXP = -20
+	MAX_EXP = 7
+	# first bucket (<= 2^MIN_EXP), buckets per power of two, overflow bucket
+	BUCKETS = 1 + (MAX_EXP - MIN_EXP) * SUB_BUCKETS + 1
+
+	def __init__(self, registry, name, description, labels={}):
+		super().__init__(registry, name, description, labels)
+		# per series: buckets, sum
+		size = Histogram.BUCKETS + 1
+		self.offset = registry.allocate(self, len(self.series) * size) if registry.enabled else 0
+		self.index = {series : self.offset + i * size for i, series in enumerate(self.series)}
+
+		self.bounds = [2.0 ** Histogram.MIN_EXP] + [
+			2.0 ** (Histogram.MIN_EXP + octave) * (1 + (sub + 1) / Histogram.SUB_BUCKETS)
+			for octave in range(Histogram.MAX_EXP - Histogram.MIN_EXP)
+			for sub in range(Histogram.SUB_BUCKETS)
+		]
+
+	@staticmethod
+	def bucket(value):
+		"""
+			Returns the bucket of a value.
+		"""
+		if value <= MIN_VALUE:
+			return 0
+		mantissa, exponent = math.frexp(value) # value = mantissa * 2^exponent, 0.5 <= mantissa < 1
+		sub = (2 * mantissa - 1) * Histogram.SUB_BUCKETS
+		bucket = (exponent - 1 - Histogram.MIN_EXP) * Histogram.SUB_BUCKETS + int(sub)
+		# exact bounds belong to the lower bucket
+		if sub != int(sub):
+			bucket += 1
+		return bucket if bucket < Histogram.BUCKETS else Histogram.BUCKETS - 1
+
+	def observe(self, value, *labels):
+		"""
+			Records a value for the series given by the label values.
+		"""
+		if not self.registry.is_recording():
+			return
+		i = self.index.get(labels)
+		if i != None:
+			bucket = Histogram.bucket(value)
+			cells = self.registry.cells
+			with self.registry.locks[i % Registry.LOCKS]:
+				cells[i + bucket] += 1
+				cells[i + Histogram.BUCKETS] += value
+
+	def time(self, *labels):
+		"""
+			Returns a context manager recording the duration of its block.
+		"""
+		if not self.registry.is_recording():
+			return NULL_TIMER
+		return Timer(self, labels)
+
+	def render(self):
+		lines = self.header()
+		for series, i in self.index.items():
+			labels = self.labels(series)
+			counts = numpy.cumsum(self.registry.values[i:i + Histogram.BUCKETS])
+			for bound, count in zip(self.bounds, counts):
+				lines.append(self.name + "_bucket" + format_labels(labels, [("le", "%.9g" % bound)]) + " " + repr(float(count)))
+			lines.append(self.name + "_bucket" + format_labels(labels, [("le", "+Inf")]) + " " + repr(float(counts[-1])))
+			lines.append(self.name + "_sum" + format_labels(labels) + " " + repr(float(self.registry.values[i + Histogram.BUCKETS])))
+			lines.append(self.name + "_count" + format_labels(labels) + " " + repr(float(counts[-1])))
+		return lines
+
+class Timer():
+	"""
+		Context manager recording the duration of its block in a histogram.
+	"""
+
+	def __init__(self, histogram, labels):
+		self.histogram = histogram
+		self.labels = labels
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+NULL_TIMER = contextlib.nullcontext()
+MIN_VALUE = 2.0 ** Histogram.MIN_EXP
+
+class Gauge(Metric):
+	"""
+		A current value (e.g., the size of a queue), read by calling a function. Each process
+		stores its value (at most once per second), the exported value is the sum over all processes.
+	"""
+
+	TYPE = "gauge"
+
+	def __init__(self, registry, name, description, callback):
+		"""
+			Args:
+				callback (callable): Returns the current value (of the calling process).
+		"""
+		super().__init__(registry, name, description, {})
+		self.callback = callback
+		self.gauge = registry.add_gauge(self) if registry.enabled else 0
+
+	def render(self):
+		return self.header() + [self.name + " " + repr(float(self.registry.gauge_sum(self.gauge)))]
+
+# the registry of all metrics of the process
+registry = Registry()
+
+def counter(name, description, labels={}):
+	"""
+		Declares a counter, see Counter.
+	"""
+	return Counter(registry, name, description, labels)
+
+def histogram(name, description, labels={}):
+	"""
+		Declares a histogram, see Histogram.
+	"""
+	return Histogram(registry, name, description, labels)
+
+def gauge(name, description, callback):
+	"""
+		Declares a gauge, see Gauge.
+	"""
+	return Gauge(registry, name, description, callback)
+
+# durations of the stages of handling a request
+STAGES = histogram("prp_stage_seconds", "Duration of the stages of handling a request.", {
+	'stage' : [
+		'request', 'request_data', 'check', 'lda', 'lda_text', 'lda_inference', 'lda_matching',
+		'nn', 'nn_process', 'nn_predict', 'nn_types', 'captcha', 'log'
+	]
+})
@@ -0,0 +1,291 @@
+import os, time, mmap, itertools, multiprocessing
+import numpy
+
+from src.utils.connection_table import ConnectionTable
+
+def worker_count():
+	"""
+		Returns the number of worker processes serving requests (env. variable PRP_WORKERS),
+		raises a ValueError if it is no positive integer.
+	"""
+	value = os.environ.get("PRP_WORKERS", "").strip()
+	if len(value) == 0:
+		return 1
+	if not value.isdigit() or int(value) < 1:
+		raise ValueError("PRP_WORKERS has to be a positive integer, got '" + value + "'")
+	return int(value)
+
+def is_shared():
+	"""
+		Returns whether the state has to be shared between multiple worker processes.
+		Shared objects have to be created before the workers are forked.
+	"""
+	return worker_count() > 1
+
+def create_arrays(layout, shared=True):
+	"""
+		Returns the (zeroed) numpy arrays of a layout as dict, if shared in one anonymous mmap shared by
+		all processes forked after its creation.
+
+		Args:
+			layout (list): The arrays as [(name, dtype, shape), ...].
+			shared (bool): Whether to share the arrays, e.g., is_shared().
+	"""
+	if not shared:
+		return {name: numpy.zeros(shape, dtype=dtype) for name, dtype, shape in layout}
+
+	# each array starts at a multiple of 8 bytes
+	aligned = lambda n: (n + 7) // 8 * 8
+	memory = mmap.mmap(-1, sum(aligned(numpy.dtype(dtype).itemsize * int(numpy.prod(shape))) for _, dtype, shape in layout))
+
+	# the arrays keep the mmap alive
+	arrays = {}
+	offset = 0
+	for name, dtype, shape in layout:
+		count = int(numpy.prod(shape))
+		arrays[name] = numpy.frombuffer(memory, dtype=dtype, count=count, offset=offset).reshape(shape)
+		offset += aligned(numpy.dtype(dtype).itemsize * count)
+	return arrays
+
+class SharedCounter():
+	"""
+		Iterator returning increasing ids, unique among all processes forked after its creation.
+	"""
+
+	def __init__(self, start=0):
+		self.value = multiprocessing.RawValue('q', start)
+		self.lock = multiprocessing.Lock()
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		with self.lock:
+			value = self.value.value
+			self.value.value += 1
+		return value
+
+def create_counter(start=0):
+	"""
+		Returns an iterator over increasing ids, shared by all workers if there are multiple.
+	"""
+	return SharedCounter(start) if is_shared() else itertools.count(start)
+
+class SharedIdTable():
+	"""
+		Maps keys (bytes, e.g., hashes) to ids in memory shared by all processes forked after its
+		creation (anonymous shared mmap), like a ConnectionTable of ids.
+
+		A key is stored in the slot given by its hash (modulo the number of slots), a key taking
+		the slot of another one replaces it. Keys are compared by their first KEY_BYTES bytes.
+	"""
+
+	KEY_BYTES = 16
+	# number of locks, slots share a lock by their index (modulo)
+	LOCKS = 64
+
+	def __init__(self, max_entries, ttl=None):
+		"""
+			Args:
+				max_entries (int): The number of slots.
+				ttl (int): Seconds after which an entry not accessed is removed (None for never).
+		"""
+		self.slots = max_entries
+		self.ttl = ttl
+
+		layout = [
+			('used', numpy.int8, (max_entries,)),
+			('keys', numpy.uint8, (max_entries, SharedIdTable.KEY_BYTES)),
+			('values', numpy.int64, (max_entries,)),
+			('accessed', numpy.float64, (max_entries,))
+		]
+		for name, array in create_arrays(layout).items():
+			setattr(self, name, array)
+
+		self.locks = [multiprocessing.Lock() for _ in range(SharedIdTable.LOCKS)]
+
+	def slot(self, key):
+		"""
+			Returns the index of the slot and the stored form of a key.
+		"""
+		key = numpy.frombuffer(bytes(key[:SharedIdTable.KEY_BYTES]).ljust(SharedIdTable.KEY_BYTES, b"\0"), dtype=numpy.uint8)
+		return int.from_bytes(key[:8].tobytes(), "little") % self.slots, key
+
+	def get(self, key, default=None):
+		"""
+			Returns the id of a key (and marks it as accessed) or default if there is none.
+		"""
+		slot, key = self.slot(key)
+		with self.locks[slot % SharedIdTable.LOCKS]:
+			now = time.monotonic()
+			if not self.used[slot] or not numpy.array_equal(self.keys[slot], key):
+				return default
+			if self.ttl != None and self.accessed[slot] < now - self.ttl:
+				self.used[slot] = 0
+				return default
+
+			self.accessed[slot] = now
+			return int(self.values[slot])
+
+	def put(self, key, value):
+		"""
+			Stores the id of a key (replaces the key stored in its slot).
+		"""
+		slot, key = self.slot(key)
+		with self.locks[slot % SharedIdTable.LOCKS]:
+			self.used[slot] = 1
+			self.keys[slot] = key
+			self.values[slot] = value
+			self.accessed[slot] = time.monotonic()
+
+def create_id_table(max_entries, ttl=None):
+	"""
+		Returns a table mapping keys to ids (with get() and put()), shared by all workers if
+		there are multiple.
+	"""
+	if is_shared():
+		return SharedIdTable(max_entries, ttl)
+	return ConnectionTable(max_entries=max_entries, ttl=ttl)
+
+class SharedWindowStore():
+	"""
+		Holds the windows of the last requests per connection in memory shared by all
+		processes forked after its creation (anonymous shared mmap). Hence, any worker
+		handling the next request of a connection sees the connection's window.
+
+		The memory is split into a fixed number of slots, a connection is stored in the slot
+		given by its id (modulo the number of slots). A connection taking the slot of another
+		one replaces its window. Each request in a window stores up to max_words word ids (and counts),
+		the most frequent words of requests with more different words (see push()).
+	"""
+
+	# number of locks, slots share a lock by their index (modulo)
+	LOCKS = 64
+
+	def __init__(self, slots, window_size=5, max_words=256, num_topics=0):
+		"""
+			Args:
+				slots (int): The number of windows to store.
+				window_size (int): The number of requests per window.
+				max_words (int): The maximum number of different words stored per request.
+				num_topics (int): The size of the gammas stored for warm starts (0 to store none).
+		"""
+		self.slots = slots
+		self.window_size = window_size
+		self.max_words = max_words
+		self.num_topics = num_topics
+
+		layout = [
+			('used', numpy.int8, (slots,)),
+			('owner', numpy.int64, (slots,)),
+			('next', numpy.int64, (slots,)),
+			('has_gamma', numpy.int8, (slots,)),
+			('lengths', numpy.int32, (slots, window_size)),
+			('ids', numpy.uint32, (slots, window_size, max_words)),
+			('cts', numpy.uint32, (slots, window_size, max_words)),
+			('gamma', numpy.float64, (slots, max(num_topics, 1)))
+		]
+		for name, array in create_arrays(layout).items():
+			setattr(self, name, array)
+
+		self.locks = [multiprocessing.Lock() for _ in range(SharedWindowStore.LOCKS)]
+
+	@staticmethod
+	def bytes_per_slot(window_size=5, max_words=256, num_topics=0):
+		"""
+			Returns the bytes of memory needed per slot.
+		"""
+		return 1 + 8 + 8 + 1 + window_size * 4 + window_size * max_words * (4 + 4) + max(num_topics, 1) * 8
+
+	def slot(self, connection_id):
+		"""
+			Returns the index of the slot for a connection id.
+		"""
+		return hash(connection_id) % self.slots
+
+	def push(self, connection_id, bow):
+		"""
+			Adds a request to the window of a connection, removes the oldest one if the window is full.
+			A request with more than max_words different words is stored with its max_words most frequent
+			words, the returned window contains all words of the request (see LDAPredictor.push_window()).
+
+			Args:
+				connection_id (int): The id of the connection.
+				bow (list): The request as bag of words [(id, count), ...].
+
+			Returns two values: bag of words of the window [(id, count), ...], the stored gamma
+			of the window (None if there is none)
+		"""
+		slot = self.slot(connection_id)
+		with self.locks[slot % SharedWindowStore.LOCKS]:
+			# new connection in this slot
+			if not self.used[slot] or self.owner[slot] != connection_id:
+				self.used[slot] = 1
+				self.owner[slot] = connection_id
+				self.next[slot] = 0
+				self.has_gamma[slot] = 0
+				self.lengths[slot, :] = 0
+
+			position = self.next[slot] % self.window_size
+			self.next[slot] += 1
+
+			# the previous requests of the window (before storing the new one)
+			ids = numpy.concatenate([self.ids[slot, p, :self.lengths[slot, p]] for p in range(self.window_size) if p != position])
+			cts = numpy.concatenate([self.cts[slot, p, :self.lengths[slot, p]] for p in range(self.window_size) if p != position])
+
+			stored = bow if len(bow) <= self.max_words else sorted(sorted(bow, key=lambda w: w[1], reverse=True)[:self.max_words])
+			n = len(stored)
+			if n > 0:
+				self.ids[slot, position, :n] = [i for i, _ in stored]
+				self.cts[slot, position, :n] = [c for _, c in stored]
+			self.lengths[slot, position] = n
+
+			gamma = self.gamma[slot].copy() if self.has_gamma[slot] else None
+
+		ids = numpy.concatenate([ids, numpy.array([i for i, _ in bow], dtype=numpy.uint32)])
+		cts = numpy.concatenate([cts, numpy.array([c for _, c in bow], dtype=numpy.uint32)])
+		words, positions = numpy.unique(ids, return_inverse=True)
+		counts = numpy.bincount(positions, weights=cts, minlength=len(words)).astype(numpy.int64)
+
+		return list(zip(words.tolist(), counts.tolist())), gamma
+
+	def store_gamma(self, connection_id, gamma):
+		"""
+			Stores the gamma of the last inference for the window of a connection.
+
+			Args:
+				connection_id (int): The id of the connection.
+				gamma (numpy.ndarray): The gamma to store.
+		"""
+		if self.num_topics == 0:
+			return
+
+		slot = self.slot(connection_id)
+		with self.locks[slot % SharedWindowStore.LOCKS]:
+			if self.used[slot] and self.owner[slot] == connection_id:
+				self.gamma[slot, :] = gamma
+				self.has_gamma[slot] = 1
+
+	def remove(self, connection_id):
+		"""
+			Removes the window of a connection.
+
+			Args:
+				connection_id (int): The id of the connection.
+		"""
+		slot = self.slot(connection_id)
+		with self.locks[slot % SharedWindowStore.LOCKS]:
+			if self.used[slot] and self.owner[slot] == connection_id:
+				self.used[slot] = 0
+
+	def clear(self):
+		"""
+			Removes all windows.
+		"""
+		for lock in self.locks:
+			lock.acquire()
+		try:
+			self.used[:] = 0
+		finally:
+			for lock in self.locks:
+				lock.release()
\ No newline at end of file
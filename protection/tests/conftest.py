@@ -0,0 +1,5 @@
+import os, sys
+
+# the tests import the package src of the protection (as if installed via requirements.txt)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
@@ -0,0 +1,68 @@
+import os, json
+
+import gensim
+import numpy
+import pytest
+
+from src.models.inference_lda import LDAInference
+
+# the dummy model of the git repository
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "models", "dummy") + "/"
+
+# maximum difference of a probability (resp. a parameter of gamma) to gensim
+TOLERANCE = 1e-5
+
+@pytest.fixture(scope="module")
+def model():
+	with open(MODELS_DIR + "index.json", 'r') as file:
+		index = json.load(file)['lda']
+	model = gensim.models.ldamodel.LdaModel.load(MODELS_DIR + index["topicmodel"])
+	dictionary = gensim.corpora.Dictionary.load(MODELS_DIR + index["dictionary"])
+	return model, dictionary, LDAInference.from_model(model)
+
+def documents(dictionary, count=200):
+	"""
+		Returns random documents (bag of words) of the words in the dictionary, including empty ones.
+	"""
+	rng = numpy.random.RandomState(0)
+	for _ in range(count):
+		words = rng.choice(len(dictionary), size=rng.randint(0, 60))
+		yield dictionary.doc2bow([dictionary[i] for i in words])
+
+def test_gamma_equals_gensim(model):
+	model, dictionary, inference = model
+
+	# same random initialization for both
+	model.random_state = numpy.random.RandomState(42)
+	inference.random_state = numpy.random.RandomState(42)
+
+	for bow in documents(dictionary):
+		expected, _ = model.inference([bow])
+		actual = inference.infer(bow)
+		assert numpy.abs(expected[0] - actual).max() < TOLERANCE * numpy.abs(expected[0]).max()
+
+def test_topics_equal_gensim(model):
+	model, dictionary, inference = model
+
+	model.random_state = numpy.random.RandomState(42)
+	inference.random_state = numpy.random.RandomState(42)
+
+	for bow in documents(dictionary):
+		expected = dict(model.get_document_topics(bow, minimum_probability=0.001, minimum_phi_value=0.001, per_word_topics=False))
+		actual = dict(inference.get_document_topics(bow, minimum_probability=0.001)[0])
+		for tid in set(expected.keys()) | set(actual.keys()):
+			assert abs(expected.get(tid, 0) - actual.get(tid, 0)) < TOLERANCE
+
+def test_loaded_inference_reproduces_gensim(model):
+	_, dictionary, _ = model
+	with open(MODELS_DIR + "index.json", 'r') as file:
+		path = MODELS_DIR + json.load(file)['lda']["topicmodel"]
+
+	# both start from the random state saved with the model
+	expected = gensim.models.ldamodel.LdaModel.load(path)
+	inference = LDAInference.load(path)
+	assert isinstance(inference.exp_elogbeta, numpy.memmap)
+
+	for bow in documents(dictionary, count=20):
+		gamma, _ = expected.inference([bow])
+		assert numpy.abs(gamma[0] - inference.infer(bow)).max() < TOLERANCE * numpy.abs(gamma[0]).max()
@@ -0,0 +1,29 @@
+import os, json
+import pytest
+
+from src.data import make_datasets_lda
+from src.data.make_datasets_lda import get_text_from_request, MAX_CACHED_VALUE
+
+# requests (benchmark corpus, encodings, payloads and long values) with their text by the
+# tokenizer before it was compiled at module level
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "lda_tokenizer.json")
+
+with open(GOLDEN, encoding="utf-8") as file:
+	CASES = json.load(file)
+
+@pytest.mark.parametrize("case", CASES, ids=[str(case["request"]["id"]) for case in CASES])
+def test_text_equals_golden(case):
+	assert get_text_from_request(case["request"]) == case["text"]
+	# again, the words of the short values are cached now
+	assert get_text_from_request(case["request"]) == case["text"]
+
+def test_corpus_covers_long_values():
+	lengths = [len(case["request"]["request"]["uri"]) for case in CASES]
+	assert any(length > MAX_CACHED_VALUE for length in lengths)
+
+def test_long_values_not_cached():
+	make_datasets_lda.cachedValueToText.cache_clear()
+	make_datasets_lda.valueToText("a" * (MAX_CACHED_VALUE + 1))
+	assert make_datasets_lda.cachedValueToText.cache_info().currsize == 0
+	make_datasets_lda.valueToText("a" * MAX_CACHED_VALUE)
+	assert make_datasets_lda.cachedValueToText.cache_info().currsize == 1
@@ -0,0 +1,108 @@
+import time, threading
+
+from src.models.predict_model_batch import BatchingPredictor, BatchJob
+
+class StubPredictor():
+	"""
+		Doubles the features (the request itself) and records the size of each batch. Callers
+		wait in features() until the barrier is passed (if any).
+	"""
+
+	def __init__(self, barrier=None, error=None):
+		self.barrier = barrier
+		self.error = error
+		self.batches = []
+
+	def features(self, context):
+		if self.barrier != None:
+			self.barrier.wait(5)
+		return context
+
+	def predict_processed(self, processed_data):
+		self.batches.append(len(processed_data))
+		if self.error != None:
+			raise self.error
+		return [value * 2 for value in processed_data]
+
+class Request():
+
+	def __init__(self, value):
+		self.value = value
+
+	def get_context(self):
+		return self.value
+
+def predict_concurrently(predictor, values):
+	"""
+		Calls predict() for each value in an own thread, returns the results (resp. errors) by value.
+	"""
+	results = {}
+	def run(value):
+		try:
+			results[value] = predictor.predict(Request(value))
+		except Exception as e:
+			results[value] = e
+
+	threads = [threading.Thread(target=run, args=(value,)) for value in values]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join(10)
+	return results
+
+def test_concurrent_callers_share_a_batch():
+	stub = StubPredictor(threading.Barrier(8))
+	predictor = BatchingPredictor(stub, max_wait=5, max_size=32)
+
+	assert predict_concurrently(predictor, range(8)) == {value: value * 2 for value in range(8)}
+	assert stub.batches == [8]
+	assert predictor.pending == 0 and predictor.processing == 0
+
+def test_batches_are_limited_by_size():
+	stub = StubPredictor(threading.Barrier(8))
+	predictor = BatchingPredictor(stub, max_wait=5, max_size=3)
+
+	start = time.monotonic()
+	assert predict_concurrently(predictor, range(8)) == {value: value * 2 for value in range(8)}
+	assert sum(stub.batches) == 8 and max(stub.batches) == 3
+	# the last batch does not wait for the callers of the previous ones
+	assert time.monotonic() - start < 2
+
+def test_batch_runs_at_deadline():
+	stub = StubPredictor()
+	predictor = BatchingPredictor(stub, max_wait=0.2)
+
+	# another caller is still processing its request, the batch waits for it until the deadline
+	predictor.processing += 1
+	start = time.monotonic()
+	assert predictor.predict(Request(1)) == 2
+	assert 0.15 <= time.monotonic() - start < 2
+	predictor.processing -= 1
+
+	# a single caller is not delayed
+	start = time.monotonic()
+	assert predictor.predict(Request(2)) == 4
+	assert time.monotonic() - start < 0.15
+	assert stub.batches == [1, 1]
+
+def test_error_raised_to_every_caller():
+	error = ValueError("model failed")
+	stub = StubPredictor(threading.Barrier(3), error=error)
+	predictor = BatchingPredictor(stub, max_wait=5)
+
+	assert predict_concurrently(predictor, range(3)) == {value: error for value in range(3)}
+	assert stub.batches == [3]
+
+def test_close_runs_queued_requests_and_stops():
+	predictor = BatchingPredictor(StubPredictor())
+	job = BatchJob(1)
+	predictor.jobs.put(job)
+	predictor.close()
+	assert predictor.collect_batch() == [job]
+	assert predictor.collect_batch() == None
+
+	predictor = BatchingPredictor(StubPredictor())
+	assert predictor.predict(Request(1)) == 2
+	predictor.close()
+	predictor.thread.join(5)
+	assert not predictor.thread.is_alive()
@@ -0,0 +1,63 @@
+import os, sys, json, random, threading
+from collections import Counter
+
+import pytest
+
+from src.models.predict_model_lda import LDAPredictor, ConnectionWindow
+
+# the dummy model of the git repository
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "models", "dummy") + "/"
+
+@pytest.fixture(scope="module")
+def predictor():
+	with open(MODELS_DIR + "index.json", 'r') as file:
+		index = json.load(file)
+	return LDAPredictor(index['lda'], MODELS_DIR)
+
+def window_counts(window):
+	"""
+		Returns the bag of words of a window summed up from its requests.
+	"""
+	counts = Counter()
+	for ids, cts in window.requests:
+		for i, c in zip(ids, cts):
+			counts[i] += c
+	return dict(counts)
+
+def test_window_keeps_last_requests():
+	window = ConnectionWindow()
+	for i in range(ConnectionWindow.SIZE + 2):
+		window.push([(i, 1), (100, 2)])
+
+	assert len(window.requests) == ConnectionWindow.SIZE
+	assert window.bow() == [(i, 1) for i in range(2, ConnectionWindow.SIZE + 2)] + [(100, 2 * ConnectionWindow.SIZE)]
+
+def test_concurrent_requests_of_a_connection(predictor):
+	# switch between the threads as often as possible
+	interval = sys.getswitchinterval()
+	sys.setswitchinterval(1e-6)
+
+	errors = []
+	def send(seed):
+		rand = random.Random(seed)
+		try:
+			for _ in range(2000):
+				bow = sorted({rand.randrange(50): rand.randrange(1, 4) for _ in range(rand.randrange(1, 20))}.items())
+				predictor.push_window(7, bow)
+		except Exception as e:
+			errors.append(e)
+
+	try:
+		threads = [threading.Thread(target=send, args=(seed,)) for seed in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+	finally:
+		sys.setswitchinterval(interval)
+
+	window = predictor.known_requests.get(7)
+	assert errors == []
+	assert len(window.requests) == ConnectionWindow.SIZE
+	assert window.counts == window_counts(window)
+	predictor.remove_window(7)
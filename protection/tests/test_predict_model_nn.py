@@ -0,0 +1,46 @@
+import copy
+import pytest
+
+from src.models.predict_model_nn import NNPredictor
+from src.data.request_context import RequestContext
+
+REQUEST = {
+	"id" : 1,
+	"timestamp" : 1600000000,
+	"connection-id" : 3,
+	"request" : {"method" : "POST", "uri" : "/account/login?next=%2Fcart", "protocol" : "HTTP/1.1", "body" : {"user" : "user", "password" : "secret"}},
+	"header" : {"Host" : "shop.example", "User-Agent" : "Mozilla/5.0", "Content-Type" : "application/x-www-form-urlencoded", "Content-Length" : "26"},
+	"sender" : {"ip" : "10.0.0.1"}
+}
+
+@pytest.fixture
+def predictor():
+	# the fingerprint only needs the preprocessing, not the model
+	predictor = NNPredictor.__new__(NNPredictor)
+	# the labels of the training data (e.g., of requests replayed from a log)
+	predictor.process = lambda data: {
+		**NNPredictor.process(predictor, data),
+		"label" : RequestContext.of(data).data.get("label", "no zap id"),
+		"original-zap-id" : RequestContext.of(data).data.get("original-zap-id", "no zap id")
+	}
+	return predictor
+
+def fingerprint(predictor, request):
+	return predictor.fingerprint(RequestContext.of(request))
+
+def test_labels_share_fingerprint(predictor):
+	labeled = dict(copy.deepcopy(REQUEST), **{"label" : "SQL Injection", "original-zap-id" : "40018", "id" : 2, "connection-id" : 4})
+	assert predictor.process(labeled)["label"] == "SQL Injection"
+	assert fingerprint(predictor, labeled) == fingerprint(predictor, REQUEST)
+
+@pytest.mark.parametrize("change", [
+	lambda r: r["request"].update(uri="/account/login?next=%2Fadmin"),
+	lambda r: r["request"].update(uri="/account/logout?next=%2Fcart"),
+	lambda r: r["request"].update(method="PUT"),
+	lambda r: r["request"]["body"].update(user="' OR 1=1 --"),
+	lambda r: r["header"].update({"Content-Length" : "27"})
+])
+def test_features_change_fingerprint(predictor, change):
+	changed = copy.deepcopy(REQUEST)
+	change(changed)
+	assert fingerprint(predictor, changed) != fingerprint(predictor, REQUEST)
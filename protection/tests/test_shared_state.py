@@ -0,0 +1,41 @@
+import os, time, random
+
+from src.models.predict_model_lda import ConnectionWindow
+from src.utils.shared_state import SharedWindowStore, SharedIdTable
+
+def test_windows_equal_connection_window():
+	store = SharedWindowStore(4, window_size=ConnectionWindow.SIZE, max_words=64)
+	window = ConnectionWindow()
+
+	rand = random.Random(0)
+	for _ in range(50):
+		bow = sorted({rand.randrange(1000): rand.randrange(1, 100000) for _ in range(rand.randrange(0, 64))}.items())
+		window.push(bow)
+		assert store.push(3, bow)[0] == window.bow()
+
+def test_request_with_more_words():
+	store = SharedWindowStore(4, window_size=3, max_words=4)
+	bow = [(i, 5 if i in [2, 8] else 1) for i in range(10)]
+
+	# the request itself keeps all its words
+	assert store.push(3, bow)[0] == bow
+	# the following requests see its most frequent words
+	assert store.push(3, [(20, 1)])[0] == [(0, 1), (1, 1), (2, 5), (8, 5), (20, 1)]
+
+def test_ids_shared_with_forked_process():
+	table = SharedIdTable(100, ttl=3600)
+
+	pid = os.fork()
+	if pid == 0:
+		table.put(b"fingerprint of a", 7)
+		os._exit(0)
+	os.waitpid(pid, 0)
+
+	assert table.get(b"fingerprint of a") == 7
+	assert table.get(b"fingerprint of b") == None
+
+def test_ids_expire():
+	table = SharedIdTable(100, ttl=0)
+	table.put(b"fingerprint of a", 7)
+	time.sleep(0.01)
+	assert table.get(b"fingerprint of a", -1) == -1
@@ -8,7 +8,7 @@ os.environ['APPROACH_CONNECTOR'] = 'or'
 os.environ['ALLOW_AFTER_CAPTCHA'] = 'true'
 '''
 
-import random, string
+import random, string, hashlib, time
 
 from flask import Flask, request, make_response, render_template, session
 from werkzeug.routing import Rule
@@ -18,6 +18,13 @@ from request_data import RequestData
 from request_check import RequestChecker
 from captcha_handler import Captcha
 from request_log import RequestLogger
+from src.utils.shared_state import create_counter, create_id_table
+from src.utils import metrics
+from src.utils.metrics import STAGES
+
+RESPONSES = metrics.counter("prp_responses_total", "Responses to the requests.", {
+	'response' : ['approve', 'block', 'captcha', 'error']
+})
 
 # create flask
 app = Flask(__name__)
@@ -29,34 +36,67 @@ app.config['SESSION_COOKIE_NAME'] = "protection_session"
 # initialize the prediction
 checker = RequestChecker()
 # no users until now, start with it 0
-connection_id = 0
+#	(ids are shared between the workers, if there are multiple)
+connection_ids = create_counter(0)
+
+# clients not sending the session cookie (e.g. scanners) may be identified by ip and user agent
+#	=> they keep their connection id (and hence their window of requests)
+#	(the fingerprints are shared between the workers, if there are multiple)
+use_fingerprint = "CONNECTION_FINGERPRINT" in os.environ and os.environ.get("CONNECTION_FINGERPRINT") == "true"
+if use_fingerprint:
+	fingerprints = create_id_table(100000, ttl=3600)
 
 # check if we use a captcha
 use_captcha = "ALLOW_AFTER_CAPTCHA" in os.environ and os.environ.get("ALLOW_AFTER_CAPTCHA") == "true"
 if use_captcha:
 	# create captcha handler
 	captcha = Captcha()
+	metrics.gauge("prp_captcha_pool", "Rendered captchas in the pool.", lambda: len(captcha.pool) if captcha.pid == os.getpid() else 0)
 
 # check if we use request logger
 do_request_logging = "LOG_REQUESTS" in os.environ and os.environ.get("LOG_REQUESTS") in ["all", "attack"]
 if do_request_logging:
 	logger = RequestLogger()
+	metrics.gauge("prp_request_log_queue", "Requests waiting to be logged.", lambda: logger.queue.qsize() if logger.pid == os.getpid() else 0)
+	metrics.gauge("prp_request_log_dropped", "Requests not logged, as the queue was full.", lambda: logger.dropped if logger.pid == os.getpid() else 0)
+
+def metrics_response():
+	"""
+		Returns the metrics of all workers (in the text format of Prometheus). Only nginx' internal
+		metrics listener sets the parameter PRP_METRICS, requests to the protected application can not.
+	"""
+	if not metrics.registry.enabled:
+		return make_response("Metrics not enabled (METRICS=true)!", 404)
+	return make_response(metrics.registry.render(), 200, {'Content-Type' : 'text/plain; version=0.0.4; charset=utf-8'})
 
 # all request will be routed here by flask
 @app.errorhandler(404)
 def check_request(e):
-	global connection_id
+	if request.environ.get('PRP_METRICS') == 'true':
+		return metrics_response()
 
+	start = time.perf_counter()
 	try:
 		# setup the session for this users
 		session.permanent = True
 		# assign a new connection id, if its an unknown user
 		if not 'connection-id' in session:
-			session['connection-id'] = connection_id
-			connection_id += 1
+			if use_fingerprint:
+				fingerprint = hashlib.blake2b(
+					(str(request.environ.get('REMOTE_ADDR')) + "\n" + str(request.headers.get('User-Agent'))).encode(),
+					digest_size=16
+				).digest()
+				session['connection-id'] = fingerprints.get(fingerprint)
+
+			if session.get('connection-id') == None:
+				session['connection-id'] = next(connection_ids)
+
+				if use_fingerprint:
+					fingerprints.put(fingerprint, session['connection-id'])
 
 		# create the request object
-		data = RequestData(request, session['connection-id'])
+		with STAGES.time('request_data'):
+			data = RequestData(request, session['connection-id'])
 
 		# check the request and respond
 		if use_captcha:
@@ -64,33 +104,54 @@ def check_request(e):
 			if captcha.is_captcha_safe():
 				is_safe = None
 				response = nginx.approve()
+				RESPONSES.inc('approve')
 			# post values to solve captcha send?
 			elif captcha.is_captcha_post():
 				is_safe = None
-				response = captcha.handle()
+				with STAGES.time('captcha'):
+					response = captcha.handle()
+				RESPONSES.inc('captcha')
 			# check request
-			elif checker.is_safe(data):
+			elif check(data):
 				is_safe = True
 				response = nginx.approve()
+				RESPONSES.inc('approve')
 			# show captcha
 			else:
 				is_safe = False
-				response = captcha.handle()
+				with STAGES.time('captcha'):
+					response = captcha.handle()
+				RESPONSES.inc('captcha')
 		else:
-			if checker.is_safe(data):
+			if check(data):
 				is_safe = True
 				response = nginx.approve()
+				RESPONSES.inc('approve')
 			else:
 				is_safe = False
 				response = nginx.block()
+				RESPONSES.inc('block')
 
 		# call logging if active
 		if do_request_logging:
-			logger.log(data, is_safe, captcha.is_captcha_safe() if use_captcha else None)
+			with STAGES.time('log'):
+				logger.log(data, is_safe, captcha.is_captcha_safe() if use_captcha else None)
 
 		return response
 		
 	except:
 		# block everything which caused any type of error
+		RESPONSES.inc('error')
 		return nginx.block()
 
+	finally:
+		STAGES.observe(time.perf_counter() - start, 'request')
+		metrics.registry.update_gauges()
+
+def check(data):
+	"""
+		Classifies a request by the models (timed).
+	"""
+	with STAGES.time('check'):
+		return checker.is_safe(data)
+
@@ -70,6 +70,16 @@ class TypeHandler():
 		]
 	}
 
+	# type => category
+	categories = {t : category for category, types in all_types.items() for t in types}
+
+	@staticmethod
+	def category(t):
+		"""
+			Returns the category of a type (as used in BLOCK_TYPES and ALLOW_TYPES) or 'other'.
+		"""
+		return TypeHandler.categories.get(t, 'other')
+
 	def __init__(self):
 		"""
 			Loads the types to block and allow from env. variables. Initialization fails
@@ -1,11 +1,25 @@
-import base64, random, string
+import base64, random, string, os, time, threading
+from collections import deque
 
 from captcha.image import ImageCaptcha
 from flask import session, render_template, request
 
 import nginx
+from src.utils import metrics
+
+CAPTCHAS = metrics.counter("prp_captchas_total", "Captchas shown, taken from the pool or rendered while handling the request.", {
+	'source' : ['pool', 'render']
+})
+RENDERED = metrics.counter("prp_captchas_rendered_total", "Captchas rendered for the pool.")
 
 class Captcha():
+	"""
+		Shows captchas to blocked users and checks their solutions.
+
+		Rendering a captcha is expensive, so a background thread keeps a pool of
+		rendered captchas (each one is shown only once). If the pool is empty,
+		the captcha is rendered while handling the request.
+	"""
 
 	CHARS = 'abcdefghjkmnpqrstuvwxyz23456789'
 	LEN = 5
@@ -13,19 +27,101 @@ class Captcha():
 	def __init__(self):
 		self.captcha = ImageCaptcha()
 
+		# number of rendered captchas kept, 0 to render each while handling the request
+		self.pool_size = int(os.environ.get("CAPTCHA_POOL_SIZE")) if len(os.environ.get("CAPTCHA_POOL_SIZE", "")) > 0 else 50
+		self.pool = deque()
+		self.needed = threading.Event()
+
+		self.pid = None
+		self.lock = threading.Lock()
+
+		self.generated = 0
+		self.hits = 0
+		self.misses = 0
+
+	def start(self):
+		"""
+			Starts the thread filling the pool for the current process.
+		"""
+		self.pid = os.getpid()
+		self.pool.clear()
+		self.started = time.monotonic()
+		self.generated = 0
+
+		if self.pool_size > 0:
+			self.filler = threading.Thread(target=self.fill_pool, daemon=True)
+			self.filler.start()
+
+	def fill_pool(self):
+		"""
+			The filler thread, renders captchas until the pool is full and waits
+			until captchas are taken from the pool.
+		"""
+		# own instance, the main one is used by the requests
+		captcha = ImageCaptcha()
+		while True:
+			self.needed.clear()
+			while len(self.pool) < self.pool_size:
+				self.pool.append(Captcha.render(captcha))
+				self.generated += 1
+				RENDERED.inc()
+			self.needed.wait()
+
+	@staticmethod
+	def render(captcha):
+		"""
+			Renders a random captcha.
+
+			Args:
+				captcha (ImageCaptcha): The generator to use.
+
+			Returns: The value of the captcha and the base64 encoded image
+			source (value, source).
+		"""
+		value = ''.join(random.choices(Captcha.CHARS, k=Captcha.LEN))
+		image = captcha.generate(value)
+		image = base64.b64encode(image.read()).decode()
+
+		return value, 'data:image/png;base64,' + image
+
 	def generate_captcha(self):
 		"""
-			Generates a random captcha as a base64 encoded image.
+			Takes a random captcha from the pool (or renders one if the pool is empty).
 
 			Returns: The base64 encoded image source which can be
 			embedded directly into the html source (string).
 		"""
-		value = ''.join(random.choices(Captcha.CHARS, k=Captcha.LEN))
-		image = self.captcha.generate(value)
-		image = base64.b64encode(image.read()).decode()
+		with self.lock:
+			if self.pid != os.getpid():
+				self.start()
+
+		try:
+			value, image = self.pool.popleft()
+			self.hits += 1
+			CAPTCHAS.inc('pool')
+		except IndexError:
+			value, image = Captcha.render(self.captcha)
+			self.misses += 1
+			CAPTCHAS.inc('render')
+		self.needed.set()
+
 		session['CAPTCHA_VALUE'] = value
+		return image
 
-		return 'data:image/png;base64,' + image
+	def stats(self):
+		"""
+			Returns the counters of the captcha pool as dict (refill_rate is
+			in captchas per second since the start).
+		"""
+		running = time.monotonic() - self.started if self.pid != None else 0
+		return {
+			'pool_size' : len(self.pool),
+			'pool_capacity' : self.pool_size,
+			'generated' : self.generated,
+			'refill_rate' : self.generated / running if running > 0 else 0,
+			'hits' : self.hits,
+			'misses' : self.misses
+		}
 
 	def is_captcha_post(self):
 		"""
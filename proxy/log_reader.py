@@ -0,0 +1,270 @@
+import os, io, re, sys, json, struct, mmap, gzip
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+# record in the index files: timestamp, offset of the entry in the segment
+INDEX_RECORD = struct.Struct('<qQ')
+# prefix of each msgpack entry: length of the entry
+LENGTH_PREFIX = struct.Struct('>I')
+# whitespace between the entries of a json logfile
+WHITESPACE = re.compile(r'\s*')
+
+FORMATS = ["json", "ndjson", "msgpack"]
+COMPRESSIONS = ["", ".gz", ".zst"]
+
+class LogReader():
+	"""
+		Reads the request logs written by RequestLogger one entry at a time, without
+		loading whole files into memory (except for the format json).
+
+		Each entry is a dict as returned by RequestData.create_dict(), extended by the
+		property 'prp'.
+	"""
+
+	def __init__(self, path):
+		"""
+			Args:
+				path (string): A logfile (segment) or a directory containing logfiles.
+		"""
+		if os.path.isdir(path):
+			self.segments = sorted(
+				os.path.join(path, name) for name in os.listdir(path)
+				if name.startswith("requests_") and LogReader.split_name(name) != None
+			)
+		else:
+			self.segments = [path]
+
+	@staticmethod
+	def split_name(filename):
+		"""
+			Returns the format and the compression of a logfile by its extension (None if
+			it is no logfile).
+
+			Args:
+				filename (string): The name of the logfile.
+		"""
+		for compression in COMPRESSIONS:
+			for format in FORMATS:
+				if filename.endswith("." + format + compression):
+					return format, compression
+		return None
+
+	@staticmethod
+	def open(filename):
+		"""
+			Opens a logfile for reading (as binary), decompresses if needed.
+
+			Args:
+				filename (string): The name of the logfile.
+		"""
+		_, compression = LogReader.split_name(filename)
+		if compression == ".gz":
+			return gzip.open(filename, "rb")
+		elif compression == ".zst":
+			if zstandard == None:
+				raise ImportError("Package zstandard needed to read " + filename)
+			# the stream reader supports neither readline() nor iterating over lines
+			return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filename, "rb")))
+		else:
+			return open(filename, "rb")
+
+	@staticmethod
+	def read_index(filename):
+		"""
+			Reads the index of a logfile, returns a list of (timestamp, offset) or None if there is no index.
+
+			Args:
+				filename (string): The name of the logfile.
+		"""
+		format, compression = LogReader.split_name(filename)
+		indexname = filename[:len(filename) - len(compression)] + ".idx"
+		if not os.path.isfile(indexname):
+			return None
+
+		with open(indexname, "rb") as file:
+			data = file.read()
+		# the last record may be incomplete, if the process was killed
+		data = data[:len(data) - len(data) % INDEX_RECORD.size]
+		return list(INDEX_RECORD.iter_unpack(data))
+
+	def entries(self, start=None, end=None):
+		"""
+			Iterates over the entries of all logfiles.
+
+			Args:
+				start (int): Only entries with a timestamp >= start (None for all).
+				end (int): Only entries with a timestamp < end (None for all).
+		"""
+		for segment in self.segments:
+			yield from self.read_segment(segment, start, end)
+
+	def __iter__(self):
+		return self.entries()
+
+	def read_segment(self, filename, start=None, end=None):
+		"""
+			Iterates over the entries of a logfile.
+
+			Uncompressed ndjson and msgpack logfiles are memory mapped, if they have an index
+			and a time range is given, only the entries in the range are read.
+
+			Args:
+				filename (string): The name of the logfile.
+				start (int): Only entries with a timestamp >= start (None for all).
+				end (int): Only entries with a timestamp < end (None for all).
+		"""
+		in_range = lambda t: (start == None or t >= start) and (end == None or t < end)
+		format, compression = LogReader.split_name(filename)
+
+		if format == "json":
+			with LogReader.open(filename) as file:
+				content = file.read().decode('utf-8')
+			try:
+				entries = json.loads(content)
+			except json.JSONDecodeError:
+				# the process was killed before closing the array
+				entries = LogReader.repair_json(content)
+			for entry in entries:
+				if in_range(entry.get('timestamp', 0)):
+					yield entry
+			return
+
+		index = LogReader.read_index(filename) if compression == "" else None
+		if index != None and (start != None or end != None):
+			offsets = [offset for timestamp, offset in index if in_range(timestamp)]
+			if len(offsets) == 0:
+				return
+		else:
+			offsets = None
+
+		if compression == "" and os.path.getsize(filename) > 0:
+			with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+				for entry in LogReader.decode_entries(format, data, offsets):
+					if in_range(entry.get('timestamp', 0)):
+						yield entry
+		elif compression != "":
+			with LogReader.open(filename) as file:
+				for entry in LogReader.decode_stream(format, file):
+					if in_range(entry.get('timestamp', 0)):
+						yield entry
+
+	@staticmethod
+	def decode_entries(format, data, offsets=None):
+		"""
+			Decodes the entries of a memory mapped logfile.
+
+			Args:
+				format (string): ndjson or msgpack.
+				data (mmap.mmap): The content of the logfile.
+				offsets (list): Only decode the entries at these offsets (None for all).
+		"""
+		positions = iter(offsets) if offsets != None else None
+		position = 0
+		while True:
+			if positions != None:
+				position = next(positions, None)
+				if position == None:
+					return
+
+			if format == "ndjson":
+				newline = data.find(b"\n", position)
+				if newline < 0:
+					# incomplete last line
+					return
+				line = data[position:newline]
+				position = newline + 1
+				if len(line) > 0:
+					yield json.loads(line)
+			else:
+				if position + LENGTH_PREFIX.size > len(data):
+					return
+				length, = LENGTH_PREFIX.unpack_from(data, position)
+				position += LENGTH_PREFIX.size
+				if position + length > len(data):
+					return
+				yield LogReader.unpack(data[position:position + length])
+				position += length
+
+	@staticmethod
+	def decode_stream(format, file):
+		"""
+			Decodes the entries of a (compressed) logfile read sequentially.
+
+			Args:
+				format (string): ndjson or msgpack.
+				file: The opened logfile (buffered, i.e., read() only returns less than requested at the end).
+		"""
+		if format == "ndjson":
+			for line in file:
+				if line.endswith(b"\n"):
+					yield json.loads(line)
+		else:
+			while True:
+				prefix = file.read(LENGTH_PREFIX.size)
+				if len(prefix) < LENGTH_PREFIX.size:
+					return
+				length, = LENGTH_PREFIX.unpack(prefix)
+				data = file.read(length)
+				if len(data) < length:
+					# incomplete last entry
+					return
+				yield LogReader.unpack(data)
+
+	@staticmethod
+	def unpack(data):
+		"""
+			Decodes a msgpack entry.
+		"""
+		if msgpack == None:
+			raise ImportError("Package msgpack needed to read msgpack logfiles")
+		return msgpack.unpackb(data, raw=False)
+
+	@staticmethod
+	def repair_json(content):
+		"""
+			Returns the complete entries of a json logfile missing the closing array bracket.
+
+			Args:
+				content (string): The content of the logfile.
+		"""
+		# decodes one entry after another, up to the first incomplete one
+		decoder = json.JSONDecoder()
+		whitespace = lambda position: WHITESPACE.match(content, position).end()
+		entries = []
+		position = whitespace(0)
+		if not content.startswith("[", position):
+			return entries
+
+		position = whitespace(position + 1)
+		while position < len(content):
+			try:
+				entry, position = decoder.raw_decode(content, position)
+			except json.JSONDecodeError:
+				break
+			entries.append(entry)
+
+			position = whitespace(position)
+			if not content.startswith(",", position):
+				break
+			position = whitespace(position + 1)
+		return entries
+
+# Print the entries of logfiles as ndjson, run via:
+#	python log_reader.py /proxy/logs/ [start timestamp] [end timestamp]
+if __name__ == "__main__":
+	if len(sys.argv) < 2:
+		print("Usage: python log_reader.py <logfile or directory> [start] [end]")
+		sys.exit(1)
+
+	start = int(sys.argv[2]) if len(sys.argv) > 2 else None
+	end = int(sys.argv[3]) if len(sys.argv) > 3 else None
+	for entry in LogReader(sys.argv[1]).entries(start, end):
+		print(json.dumps(entry))
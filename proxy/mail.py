@@ -1,4 +1,4 @@
-import smtplib, os, sys
+import smtplib, os, sys, time, threading, queue
 
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -10,8 +10,18 @@ class Mailer():
 	"""
 		This class sends mails via smtp and reads the configuration from
 		env vars.
+
+		Mails are queued and sent by a background thread, such that no request waits
+		for the smtp server. The thread keeps the (authenticated) connection open
+		for further mails, retries failed mails and only sends the newest one of
+		multiple queued mails of the same kind.
 	"""
 
+	# maximum number of queued mails
+	QUEUE_SIZE = 100
+	# seconds until an unused connection is closed
+	IDLE_TIMEOUT = 60
+
 	def __init__(self):
 		"""
 			Get all configuration from env. vars.
@@ -28,48 +38,164 @@ class Mailer():
 		self.sender = os.environ.get("MAIL_FROM")
 		self.to = os.environ.get("MAIL_TO")
 
-	def send(self, text, subject="", debug=False):
+		# 'starttls' (default), 'ssl' or 'none' (e.g., for a local test server)
+		self.tls = os.environ.get("MAIL_TLS", "starttls")
+		# seconds to wait for the smtp server
+		self.timeout = float(os.environ.get("MAIL_TIMEOUT")) if len(os.environ.get("MAIL_TIMEOUT", "")) > 0 else 10
+		# attempts per mail, waiting 2, 4, 8, ... seconds between them
+		self.retries = int(os.environ.get("MAIL_RETRIES")) if len(os.environ.get("MAIL_RETRIES", "")) > 0 else 3
+
+		self.client = None
+		self.pid = None
+		self.lock = threading.Lock()
+
+	def start(self):
+		"""
+			Starts the sender thread for the current process.
+		"""
+		self.pid = os.getpid()
+		self.client = None
+		self.queue = queue.Queue(maxsize=Mailer.QUEUE_SIZE)
+		self.sender_thread = threading.Thread(target=self.run_sender, daemon=True)
+		self.sender_thread.start()
+
+	def send(self, text, subject="", kind=None):
+		"""
+			Queues a mail to the adress specified in env. vars, returns immediately.
+			Args:
+				text (string): The content of the email (should be html)
+				subject (string): The subject of the email.
+				kind (string): Of multiple queued mails of the same kind only the last one is sent
+					(e.g., 'emergency'), None to always send the mail.
+		"""
+		with self.lock:
+			if self.pid != os.getpid():
+				self.start()
+
+		try:
+			self.queue.put_nowait((kind, text, subject))
+		except queue.Full:
+			Logging.log("Mail queue full, dropping mail '" + subject + "'!", Logging.LEVEL_ERROR)
+
+	def run_sender(self):
+		"""
+			The sender thread, sends the queued mails and closes the connection when unused.
+		"""
+		while True:
+			try:
+				mails = [self.queue.get(timeout=Mailer.IDLE_TIMEOUT)]
+			except queue.Empty:
+				self.disconnect()
+				continue
+
+			# collect all queued mails (coalescing a burst)
+			try:
+				while True:
+					mails.append(self.queue.get_nowait())
+			except queue.Empty:
+				pass
+
+			for text, subject in Mailer.coalesce(mails):
+				self.deliver(text, subject)
+			for _ in mails:
+				self.queue.task_done()
+
+	@staticmethod
+	def coalesce(mails):
+		"""
+			Removes all but the last mail of each kind, keeps the order otherwise.
+			Args:
+				mails (list): The mails as (kind, text, subject).
 		"""
-			Sends a mail via smtp to the adress specified in env. vars.
+		last = {kind : i for i, (kind, _, _) in enumerate(mails) if kind != None}
+		return [(text, subject) for i, (kind, text, subject) in enumerate(mails) if kind == None or last[kind] == i]
+
+	def deliver(self, text, subject="", debug=False):
+		"""
+			Sends a mail via smtp (blocking), retries on errors.
 			Args:
 				text (string): The content of the email (should be html)
 				subject (string): The subject of the email.
 				debug (bool): Active the smtp debugging (outputs all messages between smtp server and class)
 		"""
+		# create mail
+		msg = MIMEMultipart()
+		msg['From'] = self.sender
+		msg['To'] = self.to
+		msg['Date'] = formatdate()
+		msg['Subject'] = "[PRP] " + (subject if len(subject) > 0 else "Notification")
+		msg.attach(MIMEText(text, _subtype='html', _charset='utf-8'))
+
+		for attempt in range(self.retries):
+			try:
+				if self.client == None:
+					self.connect(debug)
+
+				self.client.sendmail(self.sender, self.to, msg.as_string())
+				return True
+			except:
+				# the server may have closed the connection, connect again
+				self.disconnect()
+				if attempt + 1 < self.retries:
+					time.sleep(2 ** (attempt + 1))
+
+		Logging.log("Error sending mail!", Logging.LEVEL_ERROR)
+		return False
+
+	def connect(self, debug=False):
+		"""
+			Opens the smtp connection and authenticates.
+			Args:
+				debug (bool): Active the smtp debugging
+		"""
+		if self.tls == "ssl":
+			client = smtplib.SMTP_SSL(host=self.server, port=self.port, timeout=self.timeout)
+		else:
+			client = smtplib.SMTP(host=self.server, port=self.port, timeout=self.timeout)
+
 		try:
-			# create mail
-			msg = MIMEMultipart()
-			msg['From'] = self.sender
-			msg['To'] = self.to
-			msg['Date'] = formatdate()
-			msg['Subject'] = "[PRP] " + (subject if len(subject) > 0 else "Notification")
-			msg.attach(MIMEText(text, _subtype='html', _charset='utf-8'))
-
-			# smtp connection and authentication
-			client = smtplib.SMTP(host=self.server, port=self.port)
 			if debug:
 				client.set_debuglevel(1)
 			client.ehlo()
-			client.starttls()
-			client.ehlo()
-			client.login(self.user, self.password)
+			if self.tls == "starttls":
+				client.starttls()
+				client.ehlo()
+			if len(self.user or "") > 0:
+				client.login(self.user, self.password)
+		except:
+			client.close()
+			raise
 
-			# send the mail
-			try:
-				client.sendmail(self.sender, self.to, msg.as_string())
-			finally:
-				client.quit()
+		self.client = client
 
-		except:
-			Logging.log("Error sending mail!", Logging.LEVEL_ERROR)
+	def disconnect(self):
+		"""
+			Closes the smtp connection (if open).
+		"""
+		if self.client != None:
+			try:
+				self.client.quit()
+			except:
+				self.client.close()
+			self.client = None
 
 # Testing code for users, run via:
 # 	docker exec --user www-data protection_proxy python /proxy/mail.py
 #	docker exec --user www-data protection_proxy python /proxy/mail.py --debug
+# Testing the queue against a local server (MAIL_HOST=localhost MAIL_PORT=1025 MAIL_TLS=none), run via:
+#	pip install aiosmtpd && python -m aiosmtpd -n -l localhost:1025
+#	python mail.py --queue
 if __name__ == "__main__":
 	mailer = Mailer()
-	mailer.send(
-		"Hello user,\nthis is a testmail to verify that SMTP is configured correctly.\n\nProtective Reverse Proxy",
-		"Testmail",
-		debug=len(sys.argv) > 1 and sys.argv[1] == "--debug"
-	)
\ No newline at end of file
+	if len(sys.argv) > 1 and sys.argv[1] == "--queue":
+		# a burst of mails, only the last emergency mail and the testmail are sent
+		for i in range(10):
+			mailer.send("Emergency number " + str(i), "Emergency", kind="emergency")
+		mailer.send("Hello user,\nthis is a testmail sent via the queue.\n\nProtective Reverse Proxy", "Testmail")
+		mailer.queue.join()
+	else:
+		mailer.deliver(
+			"Hello user,\nthis is a testmail to verify that SMTP is configured correctly.\n\nProtective Reverse Proxy",
+			"Testmail",
+			debug=len(sys.argv) > 1 and sys.argv[1] == "--debug"
+		)
\ No newline at end of file
@@ -1,7 +1,11 @@
-import os, time
-from datetime import date
+import os, time, threading, multiprocessing
+from datetime import date, datetime
+import numpy
 
 from mail import Mailer
+from sketches import CountMinSketch, HyperLogLog
+
+from src.utils.shared_state import is_shared, create_arrays
 
 class Notifications():
 	"""
@@ -9,14 +13,36 @@ class Notifications():
 	"""
 
 	# the system can not keep all events in the memory, therefore it
-	# cleans up the memory from time to time, the following values 
-	# allow to influence the cleaning.
-	#	values kept on cleanup (keeping n newest)
-	CONNECTION_IDS_KEEP_ON_CLEANUP = 100
-	#	starts a cleanup when this limit is reached
-	MAX_CONNECTION_IDS = 200
-	#	number of request logged by connection (id)/ user
-	MAX_REQUESTS_PER_ID = 10
+	# only keeps the latest attacks (in a ring buffer) and counts all attacks
+	# per hour and per day, the following values define the (constant) memory used.
+	#	number of attacks kept
+	MAX_ATTACKS = 2000
+	#	number of types kept per attack and model
+	MAX_TYPES = 5
+	#	number of hours and days counted
+	HOURS = 48
+	DAYS = 21
+	#	number of top attackers listed in the daily report
+	TOP_ATTACKERS = 10
+	#	number of different attack types (and bytes of their names) kept
+	MAX_TYPE_NAMES = 256
+	TYPE_NAME_BYTES = 64
+
+	# the scalar values of the state (indices)
+	NEXT_ATTACK, TYPE_COUNT, LAST_ATTACKMAIL, LAST_REPORTMAIL = 0, 1, 2, 3
+
+	# an attack in the ring buffer, types are stored as index in type_names (-1 if unused)
+	ATTACK = numpy.dtype([
+		('time', numpy.int64),
+		('connection_id', numpy.int64),
+		('lda', numpy.bool_),
+		('nn', numpy.bool_),
+		('nn_calculated', numpy.bool_),
+		('lda_types', numpy.int16, (MAX_TYPES,)),
+		('lda_distances', numpy.float32, (MAX_TYPES,)),
+		('nn_types', numpy.int16, (MAX_TYPES,)),
+		('nn_distances', numpy.float32, (MAX_TYPES,))
+	])
 
 	@staticmethod
 	def is_active():
@@ -29,81 +55,171 @@ class Notifications():
 	def __init__(self):
 		"""
 			Initialize mail setup 
+
+			If there are multiple workers, the attacks, counts and times of the last mails are kept
+			in memory shared by all workers (created before forking them), such that the mails
+			cover the attacks seen by all workers and are sent once.
 		"""
 		self.mailer = Mailer()
-		self.attacks = {}
-		self.counts = {}
+		shared = is_shared()
+		self.lock = multiprocessing.Lock() if shared else threading.Lock()
+
+		arrays = create_arrays([
+			# ring buffer of the latest attacks
+			('attacks', Notifications.ATTACK, (Notifications.MAX_ATTACKS,)),
+			# names of the types stored in the attacks (by their index)
+			('type_names', 'S' + str(Notifications.TYPE_NAME_BYTES), (Notifications.MAX_TYPE_NAMES,)),
+			# attacks per hour and day, the slot of an hour (day) is reused after HOURS (DAYS)
+			('hour_stamps', numpy.int64, (Notifications.HOURS,)),
+			('hour_counts', numpy.int64, (Notifications.HOURS,)),
+			('day_stamps', numpy.int64, (Notifications.DAYS,)),
+			('day_counts', numpy.int64, (Notifications.DAYS,)),
+			('state', numpy.int64, (4,))
+		], shared)
+		for name, array in arrays.items():
+			setattr(self, name, array)
+		self.hour_stamps[:] = -1
+		self.day_stamps[:] = -1
+		# type ids of names already looked up (by this process)
+		self.type_ids = {}
+
+		# top and distinct attackers since the last daily report
+		self.top_ips = CountMinSketch(top=Notifications.TOP_ATTACKERS, shared=shared)
+		self.top_connections = CountMinSketch(top=Notifications.TOP_ATTACKERS, shared=shared)
+		self.distinct_ips = HyperLogLog(shared=shared)
+		self.distinct_connections = HyperLogLog(shared=shared)
 
 		self.send_daily = "SEND_DAILY_REPORT" in os.environ and os.environ.get("SEND_DAILY_REPORT") == "true"
 		self.send_emerg = "SEND_EMERGENCY" in os.environ and os.environ.get("SEND_EMERGENCY") == "true"
 
-		self.last_attackmail = 0
-		self.last_reportmail = int(time.time())
+		self.state[Notifications.LAST_ATTACKMAIL] = 0
+		self.state[Notifications.LAST_REPORTMAIL] = int(time.time())
 
-	def log_attack(self, connection_id, lda_is_attack, nn_is_attack, lda_types, nn_types = []):
+	def log_attack(self, connection_id, ip, lda_is_attack, nn_is_attack, lda_types, nn_types = []):
 		"""
 			Logs a detected attack
 			Args:
 				connection_id (int): the connection id of the user
+				ip (string): the ip address of the user
 				lda_is_attack (bool): answer by lda to "is attack?" 
 				nn_is_attack (bool): answer by nn to "is attack?"
 				lda_types (array): most probable attack types by lda; [['type', distance], ...], e.g. [['rfi', 0.2], ['lfi', 0.3], ...]]
 				nn_types (array): most probable attack types by nn; [['type', distance], ...]
 		"""
-		# create a new dict entry for a new suspicious connection id 
-		if connection_id not in self.attacks:
-			self.attacks[connection_id] = []
+		current_time = int(time.time())
 
-		# we only save up to a certain amount of request per id
-		if len(self.attacks[connection_id]) >= Notifications.MAX_REQUESTS_PER_ID:
-			self.attacks[connection_id].pop(0)
-		
-		# specify a suspicious entry for a request
-		self.attacks[connection_id].append({
-			'is_attack' : {
-				'lda' : lda_is_attack,
-				'nn' : nn_is_attack
-			},
-			'types' : {
-				'lda' : self.format_types(lda_types),
-				'nn' : self.format_types(nn_types) if nn_types != [] else 'not calculated'
-			},
-			'time' : int(time.time())
-		})
-
-		# track how many attacks are launched within a day
-		today = int(date.today().strftime("%s"))
-		if today not in self.counts:
-			self.counts[today] = 0
-		self.counts[today] += 1
+		with self.lock:
+			# store the attack in the ring buffer (overwrites the oldest one)
+			attack = self.attacks[self.state[Notifications.NEXT_ATTACK] % Notifications.MAX_ATTACKS]
+			self.state[Notifications.NEXT_ATTACK] += 1
+
+			attack['time'] = current_time
+			attack['connection_id'] = connection_id
+			attack['lda'] = lda_is_attack
+			attack['nn'] = nn_is_attack
+			attack['nn_calculated'] = nn_types != []
+			self.store_types(attack['lda_types'], attack['lda_distances'], lda_types)
+			self.store_types(attack['nn_types'], attack['nn_distances'], nn_types)
+
+			# track how many attacks are launched within an hour and a day
+			Notifications.count(self.hour_stamps, self.hour_counts, current_time // 3600)
+			Notifications.count(self.day_stamps, self.day_counts, date.today().toordinal())
+
+			# track the attackers
+			self.top_ips.add(ip)
+			self.top_connections.add(connection_id)
+			self.distinct_ips.add(ip)
+			self.distinct_connections.add(connection_id)
 
 		# if attack is detected, send an emergency mail(1h interval)
 		self.send_emergency()
 
-		# free dict entries, only save up to a certain amount of connection ids
-		self.keep_memory_free()
+	@staticmethod
+	def count(stamps, counts, bucket):
+		"""
+			Increments the count of an hour or day, resets the slot if it was used by an older one.
+			Args:
+				stamps (numpy.ndarray): The hour or day using each slot.
+				counts (numpy.ndarray): The counts per slot.
+				bucket (int): The hour (since epoch) or day (ordinal).
+		"""
+		slot = bucket % len(stamps)
+		if stamps[slot] != bucket:
+			stamps[slot] = bucket
+			counts[slot] = 0
+		counts[slot] += 1
+
+	def store_types(self, ids, distances, types):
+		"""
+			Stores the types of an attack in the compact form of the ring buffer (called with the lock held).
+			Types beyond MAX_TYPE_NAMES different ones are not stored.
+			Args:
+				ids (numpy.ndarray): The type ids of the attack (modified).
+				distances (numpy.ndarray): The distances of the attack (modified).
+				types (list): [['type', distance], ...]
+		"""
+		ids[:] = -1
+		distances[:] = 0
+		stored = 0
+		for t, p in types[:Notifications.MAX_TYPES]:
+			type_id = self.type_id(t)
+			if type_id >= 0:
+				ids[stored] = type_id
+				distances[stored] = p
+				stored += 1
+
+	def type_id(self, name):
+		"""
+			Returns the index of a type name in type_names, adds it if new (-1 if there is no space left).
+			Called with the lock held.
+			Args:
+				name (string): The name of the type.
+		"""
+		if name not in self.type_ids:
+			# the names are only appended, another worker may have added it
+			count = int(self.state[Notifications.TYPE_COUNT])
+			encoded = name.encode('utf-8')[:Notifications.TYPE_NAME_BYTES]
+			found = numpy.flatnonzero(self.type_names[:count] == encoded)
+			if len(found) > 0:
+				self.type_ids[name] = int(found[0])
+			elif count < Notifications.MAX_TYPE_NAMES:
+				self.type_names[count] = encoded
+				self.state[Notifications.TYPE_COUNT] += 1
+				self.type_ids[name] = count
+			else:
+				return -1
+		return self.type_ids[name]
 		
-	def format_types(self, types):
+	def format_types(self, ids, distances):
 		"""
 			Formats the assumed attack types and their distances for email dispatch.
 			
 			Args:
-				types (list): List of lists containing the attack type and its
-				distance for the most probable attack types: [['type', distance], ...].
+				ids (numpy.ndarray): The type ids of an attack (-1 if unused).
+				distances (numpy.ndarray): The distances of the types.
 		"""
 		s = []
-		for t,p in types:
-			s.append(t + ' (' + ("%.3f" % p) + ')')
+		for t,p in zip(ids, distances):
+			if t >= 0:
+				s.append(self.type_names[t].decode('utf-8', errors='replace') + ' (' + ("%.3f" % p) + ')')
 		return ', '.join(s)
 
-	def keep_memory_free(self):
+	def claim_mail(self, last_mail, current_time, interval):
 		"""
-			Makes sure that the dictionary of connection ids does not get too big
-			by deleting the oldest entries when the maximum size has been reached.
+			Returns whether the mail is due and marks it as sent, such that only one thread (or worker)
+			sends it.
+			Args:
+				last_mail (int): The index of the time the mail was sent last in state.
+				current_time (int): The current time.
+				interval (int): The seconds between two mails.
 		"""
-		if len(self.attacks) > Notifications.MAX_CONNECTION_IDS:
-			for cid,_ in sorted(self.attacks.items(), key=lambda l: l['time'], reverse=True)[Notifications.CONNECTION_IDS_KEEP_ON_CLEANUP:]:
-				del self.attacks[cid]
+		if current_time - self.state[last_mail] <= interval:
+			return False
+		with self.lock:
+			if current_time - self.state[last_mail] <= interval:
+				return False
+			self.state[last_mail] = current_time
+			return True
 
 	def send_emergency(self):
 		"""
@@ -112,25 +228,28 @@ class Notifications():
 			contains information about the attackers and the assumed attack types.
 		"""
 		current_time = int(time.time())
-		if self.send_emerg and current_time - self.last_attackmail > 3600:
-			self.last_attackmail = current_time
+		if self.send_emerg and self.claim_mail(Notifications.LAST_ATTACKMAIL, current_time, 3600):
 			time_range = current_time - 3600
 		
+			# the attacks of the last hour, grouped by user
+			with self.lock:
+				attacks = self.attacks[:min(self.state[Notifications.NEXT_ATTACK], Notifications.MAX_ATTACKS)]
+				attacks = attacks[attacks['time'] > time_range]
+				attacks = attacks[numpy.argsort(attacks['connection_id'], kind='stable')]
+
 			# setup mail content: Table containing user ID and potential attacks
 			text = '<html><style>table,th,tr,td { border:solid 1px black; border-collapse: collapse; padding: 2px; }</style><table>'
 			text += '<tr><th align="left">User ID</th><th align="left">Is Attack?</th><th align="left">Types (distance)</th></tr>'
-			count = 0
-			for cid, attacks in self.attacks.items():
-				for data in attacks:
-					if data['time'] > time_range:
-						count += 1
-						text += '<tr><td align="right">' + str(cid) + '</td>'
-						text += '<td align="left">LDA: '+ ('&check;' if data['is_attack']['lda'] else '&cross;') + '<br/> NN: ' + ('&check;' if data['is_attack']['nn'] else '&cross;') + '</td>'
-						text += '<td align="left">LDA: '+ data['types']['lda'] + '<br/> NN: ' + data['types']['nn'] + '</td></tr>'
+			count = len(attacks)
+			for data in attacks:
+				text += '<tr><td align="right">' + str(data['connection_id']) + '</td>'
+				text += '<td align="left">LDA: '+ ('&check;' if data['lda'] else '&cross;') + '<br/> NN: ' + ('&check;' if data['nn'] else '&cross;') + '</td>'
+				text += '<td align="left">LDA: '+ self.format_types(data['lda_types'], data['lda_distances']) + '<br/> NN: '
+				text += (self.format_types(data['nn_types'], data['nn_distances']) if data['nn_calculated'] else 'not calculated') + '</td></tr>'
 
 			text += '</table></html>'
 
-			self.mailer.send(text, "Emergency – "+ str(count) +" attacks in the last hour")
+			self.mailer.send(text, "Emergency – "+ str(count) +" attacks in the last hour", kind="emergency")
 
 	def send_daily_report(self):
 		"""
@@ -138,25 +257,42 @@ class Notifications():
 			the number of attack attempts per day.
 		"""
 		current_time = int(time.time())
-		if self.send_daily and current_time - self.last_reportmail > 86400:
-			self.last_reportmail = current_time
+		if self.send_daily and self.claim_mail(Notifications.LAST_REPORTMAIL, current_time, 86400):
+			with self.lock:
+				days = [(day, count) for day, count in zip(self.day_stamps.tolist(), self.day_counts.tolist()) if day >= 0]
+				hours = [(hour, count) for hour, count in zip(self.hour_stamps.tolist(), self.hour_counts.tolist()) if hour > current_time // 3600 - 24]
+				top_ips = self.top_ips.most_common()
+				top_connections = self.top_connections.most_common()
+				distinct_ips = self.distinct_ips.count()
+				distinct_connections = self.distinct_connections.count()
 
-			# setup mail content: Table containing user ID and potential attacks
+				# the attackers are counted per report
+				for sketch in [self.top_ips, self.top_connections, self.distinct_ips, self.distinct_connections]:
+					sketch.clear()
+
+			# setup mail content: Table containing the attacks per day (last 21 days)
 			text = '<html><style>table,th,tr,td { border:solid 1px black; border-collapse: collapse; padding: 2px; }</style><table>'
 			text += '<tr><th align="left">Day</th><th align="left">Number of attacks</th></tr>'
-			dellist = []
-			for day, count in self.counts.items():
-				text += '<tr><td>' + date.fromtimestamp(day).strftime("%Y-%m-%d") + '</td><td align="right">' + str(count) + '</td></tr>'
+			for day, count in sorted(days):
+				text += '<tr><td>' + date.fromordinal(day).strftime("%Y-%m-%d") + '</td><td align="right">' + str(count) + '</td></tr>'
+			text += '</table><br/>'
 
-				if current_time - day > 86400*21: # only keep last 21 days
-					dellist.append(day)
-			text += '</table></html>'
+			# table of the attacks per hour (last 24 hours)
+			text += '<table><tr><th align="left">Hour</th><th align="left">Number of attacks</th></tr>'
+			for hour, count in sorted(hours):
+				text += '<tr><td>' + datetime.fromtimestamp(hour * 3600).strftime("%Y-%m-%d %H:00") + '</td><td align="right">' + str(count) + '</td></tr>'
+			text += '</table>'
 
-			if len(dellist) > 0:
-				for day in dellist:
-					del self.counts[day]
+			# tables of the attackers since the last report (estimated)
+			text += '<p>Since the last report: about ' + str(distinct_ips) + ' attacking IPs and ' + str(distinct_connections) + ' attacking users.</p>'
+			for title, top in [('IP', top_ips), ('User ID', top_connections)]:
+				text += '<table><tr><th align="left">' + title + '</th><th align="left">Number of attacks (about)</th></tr>'
+				for key, count in top:
+					text += '<tr><td>' + str(key) + '</td><td align="right">' + str(count) + '</td></tr>'
+				text += '</table><br/>'
+			text += '</html>'
 
-			self.mailer.send(text, "Daily Report")
+			self.mailer.send(text, "Daily Report", kind="report")
 
 
 # Code for testing the email dispatch
@@ -164,16 +300,18 @@ class Notifications():
 if __name__ == "__main__":
 
 	n = Notifications()
-	n.log_attack(12, True, False, [['aa', 0.3], ['bb', 0.7]], [])
-	n.log_attack(12, True, False, [['aa', 0.3], ['bb', 0.7]], [['aa', 0.1], ['bb', 0.938373939443]])
-	n.log_attack(12, True, False, [['aa', 0.3], ['bb', 0.7]], [])
-	n.log_attack(12, True, False, [['aa', 0.3], ['bb', 0.7]], [])
-	n.log_attack(1, True, False, [['aa', 0.3], ['bb', 0.7]], [])
+	n.log_attack(12, '10.0.0.1', True, False, [['aa', 0.3], ['bb', 0.7]], [])
+	n.log_attack(12, '10.0.0.1', True, False, [['aa', 0.3], ['bb', 0.7]], [['aa', 0.1], ['bb', 0.938373939443]])
+	n.log_attack(12, '10.0.0.1', True, False, [['aa', 0.3], ['bb', 0.7]], [])
+	n.log_attack(12, '10.0.0.1', True, False, [['aa', 0.3], ['bb', 0.7]], [])
+	n.log_attack(1, '10.0.0.2', True, False, [['aa', 0.3], ['bb', 0.7]], [])
 
 	if False:
-		n.counts[1000] = 2
-		n.counts[900000] = 30
+		n.state[Notifications.LAST_REPORTMAIL] = 0
 
 		n.send_daily_report()
 		n.send_daily_report()
 		n.send_daily_report()
+
+	# wait for the queued mails
+	n.mailer.queue.join()
@@ -0,0 +1,168 @@
+import os, json, time, threading, importlib
+from concurrent.futures import ThreadPoolExecutor
+
+from log import Logging
+from warmup import warmup_requests, WARMUP_CONNECTION
+
+from src.models.predict_model_batch import BatchingPredictor
+from src.utils import metrics
+from src.utils.shared_state import is_shared
+
+class ModelSet():
+	"""
+		The predictors loaded from one index.json. RequestChecker replaces the whole set when
+		the models are reloaded, requests in progress finish with the set they started with.
+	"""
+
+	# number of sets loaded by this process
+	generations = 0
+
+	def __init__(self, models_dir, use_model, type_handling, previous=None, load_nn=True):
+		"""
+			Loads the models (raises an error if the index is invalid or a model failed to load).
+
+			Args:
+				models_dir (string): The directory of the models (containing the index.json).
+				use_model (string): The models to use (APPROACH_USE), others are not loaded.
+				type_handling (TypeHandler): The settings of the types, the nn for types is only
+					loaded if active.
+				previous (ModelSet): The set replaced by this one (None on startup), the memory
+					of its windows is reused.
+				load_nn (bool): Whether to load the nns now, otherwise they are loaded by load_nn()
+					(e.g., after forking the workers, as TensorFlow does not survive forking).
+		"""
+		self.models_dir = models_dir
+		# the time of the index loaded, read before reading the index (a newer index is loaded by the next reload)
+		self.index_mtime = os.stat(models_dir + "index.json").st_mtime_ns
+
+		# check index file of model
+		with open(models_dir + "index.json", 'r') as file:
+			self.index = json.load(file)
+		if 'lda' not in self.index or 'name' not in self.index or 'nn-crawl' not in self.index or 'nn-attack' not in self.index  or 'nn-types' not in self.index:
+			raise ValueError("Invalid Model Index!")
+		self.name = self.index['name']
+
+		ModelSet.generations += 1
+		self.generation = ModelSet.generations
+
+		self.use_model = use_model.split(",")
+		self.type_handling = type_handling
+		self.lda = None
+		self.nn = None
+		self.nn_types = None
+		self.load(["lda", "nn", "nn_types"] if load_nn else ["lda"], previous)
+
+		# number of requests currently using the set (see RequestChecker.acquire_models())
+		self.active = 0
+
+	def load(self, names, previous=None):
+		"""
+			Loads the given models of the index (only the used ones, see RequestChecker.model_connector())
+			and returns the names of the models loaded.
+
+			Args:
+				names (list): The models to load ('lda', 'nn' and 'nn_types').
+				previous (ModelSet): The set replaced by this one, see __init__().
+		"""
+		# load default 2 class models and the model to get type
+		#	the modules are imported on demand, as they import gensim resp. TensorFlow
+		#	the models are loaded concurrently, as loading is mostly waiting for reading the files
+		loading = {}
+		with ThreadPoolExecutor(thread_name_prefix="loading") as executor:
+			if "lda" in names and "lda" in self.use_model:
+				loading['lda'] = executor.submit(self.load_predictor, "lda", "src.models.predict_model_lda", "LDAPredictor", self.index['lda'],
+					shared_windows=previous.lda.shared_windows if previous != None and previous.lda != None else None)
+			if "nn" in names and "nn" in self.use_model:
+				loading['nn'] = executor.submit(self.load_predictor, "nn", "src.models.predict_model_nn", "NNPredictor",
+					self.index['nn-crawl'] if os.environ.get("BLOCK_CRAWLING") == "true" else self.index['nn-attack'])
+			if "nn_types" in names and "nn" in self.use_model and self.type_handling.is_active():
+				loading['nn_types'] = executor.submit(self.load_predictor, "nn_types", "src.models.predict_model_nn", "NNPredictor", self.index['nn-types'])
+
+		# raises the error of a model failed to load (as if loaded one after another)
+		for name, future in loading.items():
+			setattr(self, name, future.result())
+
+		if self.lda != None and self.lda.shared_windows != None and self.lda.shared_windows.max_words < len(self.lda.dict):
+			Logging.log("The windows shared by the workers store the " + str(self.lda.shared_windows.max_words) + " most frequent words of a request"
+				+ " (the dictionary has " + str(len(self.lda.dict)) + "), see CONNECTION_WORDS and prp_lda_truncated_requests_total", Logging.LEVEL_WARN)
+
+		# collect concurrent requests and run them through the nns in one call
+		#	waits at most NN_BATCH_WAIT milliseconds for further requests
+		#	a worker process (PRP_WORKERS > 1) serves one request at a time, there is nothing to batch
+		#		(wsgi.py warns once)
+		batch_wait = float(os.environ.get("NN_BATCH_WAIT")) if len(os.environ.get("NN_BATCH_WAIT", "")) > 0 else 0
+		if batch_wait > 0 and "nn" in loading and not is_shared():
+			max_size = int(os.environ.get("NN_BATCH_SIZE")) if "NN_BATCH_SIZE" in os.environ and len(os.environ.get("NN_BATCH_SIZE")) > 0 else 32
+			if previous == None:
+				Logging.log("Batching nn predictions (" + str(max_size) + " requests, " + os.environ.get("NN_BATCH_WAIT") + "ms)")
+
+			self.nn = BatchingPredictor(self.nn, batch_wait / 1000, max_size)
+			if self.nn_types != None:
+				self.nn_types = BatchingPredictor(self.nn_types, batch_wait / 1000, max_size)
+
+		return list(loading.keys())
+
+	def load_nn(self):
+		"""
+			Loads and warms up the nns, if the set was created without them (see __init__()).
+		"""
+		self.warmup(self.load(["nn", "nn_types"]))
+
+	def load_predictor(self, name, module, class_name, index, **kwargs):
+		"""
+			Imports the module of a predictor and loads its model, logs the time needed for both.
+
+			Args:
+				name (string): The name of the model (for the log).
+				module (string): The module containing the predictor.
+				class_name (string): The class of the predictor.
+				index (dict): The part of the index.json representing the model.
+				kwargs: Further arguments of the predictor.
+		"""
+		start = time.perf_counter()
+		predictor_class = getattr(importlib.import_module(module), class_name)
+		imported = time.perf_counter()
+		predictor = predictor_class(index, self.models_dir, **kwargs)
+		loaded = time.perf_counter()
+
+		Logging.log("Loaded " + name + " in " + ("%.2f" % (loaded - start)) + "s (import " + ("%.2f" % (imported - start)) + "s, model " + ("%.2f" % (loaded - imported)) + "s)")
+		return predictor
+
+	def warmup(self, names=["lda", "nn", "nn_types"]):
+		"""
+			Runs some requests through each loaded model, before the first real request arrives.
+			The first predictions are much slower, e.g., TensorFlow traces the model and allocates
+			its memory on the first call. Bypasses the verdict cache, notifications and metrics, the
+			window of the warmup connection is removed afterwards.
+
+			Args:
+				names (list): The models to warm up (if loaded).
+		"""
+		requests = warmup_requests()
+		predictors = [getattr(self, name) for name in names if getattr(self, name) != None]
+		if len(requests) == 0 or len(predictors) == 0:
+			return
+
+		# the batching predictors would start their threads in this process, use the wrapped nns
+		predictors = [p.predictor if isinstance(p, BatchingPredictor) else p for p in predictors]
+
+		start = time.perf_counter()
+		with metrics.registry.paused():
+			for predictor in predictors:
+				try:
+					for request_data in requests:
+						predictor.predict(request_data)
+				except Exception as e:
+					Logging.log("Error during warmup of " + type(predictor).__name__ + ": " + str(e), Logging.LEVEL_WARN)
+		if "lda" in names and self.lda != None:
+			self.lda.remove_window(WARMUP_CONNECTION)
+
+		Logging.log("Warmed up the models with " + str(len(requests)) + " requests in " + ("%.2f" % (time.perf_counter() - start)) + "s")
+
+	def close(self):
+		"""
+			Stops the threads of the set (the batching), the set must not be used afterwards.
+		"""
+		for predictor in [self.nn, self.nn_types]:
+			if isinstance(predictor, BatchingPredictor):
+				predictor.close()
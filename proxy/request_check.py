@@ -1,11 +1,29 @@
-import os, json
+import os, gc, time, signal, threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from log import Logging
 from attack_types import TypeHandler
 from mail_wrapper import Notifications
+from verdict_cache import VerdictCache
+from model_set import ModelSet
 
-from src.models.predict_model_lda import LDAPredictor
-from src.models.predict_model_nn import NNPredictor
+from src.models.predict_model_batch import BatchingPredictor
+from src.utils import metrics
+from src.utils.metrics import STAGES
+from src.utils.shared_state import is_shared
+
+VERDICTS = metrics.counter("prp_verdicts_total", "Verdicts of the models and the combined one (prp).", {
+	'model' : ['lda', 'nn', 'prp'],
+	'verdict' : ['safe', 'attack']
+})
+TYPES = metrics.counter("prp_attack_types_total", "Most probable attack type (category) of the requests classified as attack.", {
+	'model' : ['lda', 'nn_types'],
+	'category' : list(TypeHandler.all_types.keys()) + ['other']
+})
+RELOADS = metrics.counter("prp_model_reloads_total", "Reloads of the models.", {
+	'result' : ['success', 'error']
+})
 
 class RequestChecker():
 	"""
@@ -25,26 +43,22 @@ class RequestChecker():
 			Logging.log("Using dummy model!", Logging.LEVEL_WARN)
 			os.system("cp -R /dummy-model/ " + RequestChecker.MODELS_DIR)
 		
-		# check index file of model
-		self.models = json.load(open(RequestChecker.MODELS_DIR + "index.json", 'r'))
-		if 'lda' not in self.models or 'name' not in self.models or 'nn-crawl' not in self.models or 'nn-attack' not in self.models  or 'nn-types' not in self.models:
-			Logging.log("Invalid Model Index!", Logging.LEVEL_ERROR)
+		# check index file of model and load the models
+		#	multiple workers => the master process loads the lda, each worker loads the nns after being
+		#		forked (TensorFlow does not survive forking, see after_fork())
+		self.use_model = RequestChecker.approach()
+		self.type_handling = TypeHandler()
+		self.prefork = is_shared()
+		try:
+			self.models = ModelSet(RequestChecker.MODELS_DIR, self.use_model, self.type_handling, load_nn=not self.prefork)
+		except ValueError as e:
+			Logging.log(str(e), Logging.LEVEL_ERROR)
 			exit()
 
-		Logging.log("Found Model " + self.models['name'])
-
-		# load default 2 class models
-		self.lda = LDAPredictor(self.models['lda'], RequestChecker.MODELS_DIR)
-		if os.environ.get("BLOCK_CRAWLING") == "true":
-			self.nn = NNPredictor(self.models['nn-crawl'], RequestChecker.MODELS_DIR)
-		else:
-			self.nn = NNPredictor(self.models['nn-attack'], RequestChecker.MODELS_DIR)
-
-		# load models to get type
-		self.type_handling = TypeHandler()
+		Logging.log("Found Model " + self.models.name)
+		Logging.log('Using model(s) "' + self.use_model + '"')
 		if self.type_handling.is_active():
 			Logging.log("TypeHandler active")
-			self.nn_types = NNPredictor(self.models['nn-types'], RequestChecker.MODELS_DIR)
 
 		# connector to use for models
 		# 	or => one model classifies as safe
@@ -55,17 +69,202 @@ class RequestChecker():
 			self.connector = "or"
 		Logging.log('Using connector "' + self.connector + '"')
 
-		# model to use 
-		if "APPROACH_USE" in os.environ:
-			self.use_model = os.environ.get("APPROACH_USE") if os.environ.get("APPROACH_USE") in ['lda', 'nn'] else "lda,nn" 
+		# cache the predictions of the nns for requests having the same features
+		if "VERDICT_CACHE_SIZE" in os.environ and len(os.environ.get("VERDICT_CACHE_SIZE")) > 0 and int(os.environ.get("VERDICT_CACHE_SIZE")) > 0:
+			ttl = int(os.environ.get("VERDICT_CACHE_TTL")) if "VERDICT_CACHE_TTL" in os.environ and len(os.environ.get("VERDICT_CACHE_TTL")) > 0 else 3600
+			self.verdict_cache = VerdictCache(int(os.environ.get("VERDICT_CACHE_SIZE")), ttl)
+			Logging.log("Caching nn predictions (" + os.environ.get("VERDICT_CACHE_SIZE") + " entries, " + str(ttl) + "s)")
 		else:
-			self.use_model = "lda,nn"
-		Logging.log('Using model(s) "' + self.use_model + '"')
+			self.verdict_cache = None
+
+		# run the models for a request in parallel
+		self.parallel = "PARALLEL_PREDICTION" in os.environ and os.environ.get("PARALLEL_PREDICTION") == "true"
+		if self.parallel:
+			Logging.log('Running models in parallel')
+		self.executor = None
+		self.executor_pid = None
+		self.executor_lock = threading.Lock()
+
+		# reload the models if the index.json changed (checked every MODEL_RELOAD_INTERVAL seconds) or on SIGUSR1
+		#	a single process reloads its models in a thread (started by its first request)
+		#	multiple workers => the master process reloads the models and replaces the workers (see wsgi.py)
+		self.reload_interval = float(os.environ.get("MODEL_RELOAD_INTERVAL")) if len(os.environ.get("MODEL_RELOAD_INTERVAL", "")) > 0 else 0
+		self.reload_requested = threading.Event()
+		self.reloader_pid = None
+		self.models_lock = threading.Lock()
+		# the time of an index.json which failed to load, not retried until it changes
+		self.failed_mtime = None
+		if not self.prefork:
+			try:
+				signal.signal(signal.SIGUSR1, lambda signum, frame: self.reload_requested.set())
+			except ValueError:
+				# not in the main thread (e.g., flask's development server)
+				pass
 
 		# create a notification (=mail) object
 		if Notifications.is_active():
 			self.notifications = Notifications()
 
+		self.create_gauges()
+
+		self.models.warmup()
+
+	@staticmethod
+	def approach():
+		"""
+			Returns the model(s) to use (APPROACH_USE).
+		"""
+		if "APPROACH_USE" in os.environ:
+			return os.environ.get("APPROACH_USE") if os.environ.get("APPROACH_USE") in ['lda', 'nn'] else "lda,nn" 
+		else:
+			return "lda,nn"
+
+	def after_fork(self):
+		"""
+			Prepares a forked worker (of multiple ones) for serving requests, i.e., loads and warms up
+			the nns (raises an error if a model failed to load).
+		"""
+		self.models.load_nn()
+
+	@contextmanager
+	def acquire_models(self):
+		"""
+			Returns the current set of models for the block and counts the block as using the set,
+			such that a reload does not stop the set while requests use it.
+		"""
+		with self.models_lock:
+			models = self.models
+			models.active += 1
+		try:
+			yield models
+		finally:
+			with self.models_lock:
+				models.active -= 1
+
+	def start_reloader(self):
+		"""
+			Starts the thread reloading the models, once (if not reloaded by the master of multiple workers).
+		"""
+		if not self.prefork and self.reloader_pid != os.getpid():
+			with self.models_lock:
+				if self.reloader_pid != os.getpid():
+					self.reloader_pid = os.getpid()
+					threading.Thread(target=self.watch_models, daemon=True).start()
+
+	def watch_models(self):
+		"""
+			Waits for SIGUSR1 or a change of the index.json and reloads the models.
+		"""
+		while True:
+			requested = self.reload_requested.wait(self.reload_interval if self.reload_interval > 0 else None)
+			self.reload_requested.clear()
+
+			if requested or self.index_changed():
+				self.reload_models()
+
+	def index_changed(self):
+		"""
+			Returns whether the index.json changed since the current models were loaded. A changed
+			index which failed to load is not reported again until it changes again.
+		"""
+		try:
+			mtime = os.stat(RequestChecker.MODELS_DIR + "index.json").st_mtime_ns
+		except OSError:
+			return False
+		return mtime != self.models.index_mtime and mtime != self.failed_mtime
+
+	def load_models(self):
+		"""
+			Loads and warms up a new set of models (in this process, the nns only if there is a
+			single one). Returns the set, None if loading failed.
+		"""
+		Logging.log("Reloading the models")
+		try:
+			mtime = os.stat(RequestChecker.MODELS_DIR + "index.json").st_mtime_ns
+		except OSError:
+			mtime = None
+		try:
+			models = ModelSet(RequestChecker.MODELS_DIR, self.use_model, self.type_handling, previous=self.models, load_nn=not self.prefork)
+			models.warmup()
+		except Exception as e:
+			self.failed_mtime = mtime
+			Logging.log("Reloading the models failed, keeping " + self.models.name + ": " + str(e), Logging.LEVEL_ERROR)
+			RELOADS.inc('error')
+			return None
+		return models
+
+	def reload_models(self):
+		"""
+			Loads and warms up a new set of models while the current one keeps serving the requests,
+			then replaces the current set. The old set is stopped (and freed) after the requests
+			using it are done. Returns whether the models were reloaded.
+		"""
+		start = time.perf_counter()
+		old = self.models
+		models = self.load_models()
+		if models == None:
+			return False
+
+		with self.models_lock:
+			self.models = models
+		self.release_models(old, start)
+		return True
+
+	def restore_models(self, models, error):
+		"""
+			Makes a replaced set of models the current one again, as the new set failed to load in
+			a worker (see wsgi.py).
+
+			Args:
+				models (ModelSet): The replaced set.
+				error (string): The reason (for the log).
+		"""
+		failed = self.models
+		with self.models_lock:
+			self.models = models
+		self.failed_mtime = failed.index_mtime
+		Logging.log("Reloading the models failed, keeping " + models.name + ": " + error, Logging.LEVEL_ERROR)
+		RELOADS.inc('error')
+		failed.close()
+
+	def release_models(self, old, start):
+		"""
+			Counts a successful reload and stops the replaced set of models after the requests
+			using it are done.
+
+			Args:
+				old (ModelSet): The replaced set.
+				start (float): The start of the reload (time.perf_counter()).
+		"""
+		RELOADS.inc('success')
+		Logging.log("Reloaded the models (" + self.models.name + ") in " + ("%.2f" % (time.perf_counter() - start)) + "s")
+
+		# wait for the requests still using the old set
+		deadline = time.monotonic() + 60
+		while old.active > 0 and time.monotonic() < deadline:
+			time.sleep(0.05)
+		if old.active > 0:
+			Logging.log("Requests still using the old models, not stopping them", Logging.LEVEL_WARN)
+		else:
+			old.close()
+		del old
+		gc.collect()
+
+	def create_gauges(self):
+		"""
+			Declares the metrics of the caches and queues of the checker.
+		"""
+		if self.verdict_cache != None:
+			metrics.gauge("prp_verdict_cache_entries", "Predictions in the verdict cache.", lambda: len(self.verdict_cache.entries))
+		if self.models.lda != None and self.models.lda.shared_windows == None:
+			metrics.gauge("prp_lda_windows", "Connections with a window of requests.", lambda: len(self.models.lda.known_requests))
+			metrics.gauge("prp_lda_windows_bytes", "Estimated memory of the windows of requests.", lambda: self.models.lda.known_requests.bytes)
+		if isinstance(self.models.nn, BatchingPredictor):
+			metrics.gauge("prp_nn_batch_pending", "Requests waiting for a batched nn prediction.", lambda: self.models.nn.pending)
+		if Notifications.is_active():
+			mailer = self.notifications.mailer
+			metrics.gauge("prp_mail_queue", "Mails waiting to be sent.", lambda: mailer.queue.qsize() if mailer.pid == os.getpid() else 0)
+
 	def model_connector(self, lda_bool, nn_bool):
 		"""
 			The results of each model may be logically connected by 
@@ -86,6 +285,68 @@ class RequestChecker():
 			else:
 				return lda_bool or nn_bool
 
+	def get_executor(self):
+		"""
+			Returns the executor to run the models in parallel. Each process
+			(e.g., a forked worker) creates its own, as threads do not survive forking.
+		"""
+		with self.executor_lock:
+			if self.executor_pid != os.getpid():
+				self.executor_pid = os.getpid()
+				self.executor = ThreadPoolExecutor(thread_name_prefix="prediction")
+			return self.executor
+
+	def predict_lda(self, models, request_data):
+		"""
+			Prediction by the lda, assumes an attack on any error.
+		"""
+		try:
+			with STAGES.time('lda'):
+				return models.lda.predict(request_data)
+		except:
+			return True, [['attack', 0], ['attack', 0], ['attack', 0], ['attack', 0], ['attack', 0]]
+
+	def predict_cached(self, name, models, request_data):
+		"""
+			Prediction by a nn, uses the verdict cache (if active).
+
+			Args:
+				name (string): The name of the nn ('nn' or 'nn_types').
+				models (ModelSet): The models to use.
+				request_data (RequestData): The request to classify.
+		"""
+		predictor = getattr(models, name)
+		if self.verdict_cache == None:
+			return predictor.predict(request_data)
+
+		# predictions of replaced models are not used anymore (and removed by the lru)
+		key = (name, models.generation, predictor.fingerprint(request_data.get_context()))
+		result = self.verdict_cache.get(key)
+		if result == None:
+			result = predictor.predict(request_data)
+			self.verdict_cache.put(key, result)
+		return result
+
+	def predict_nn(self, models, request_data):
+		"""
+			Prediction by the nn, assumes an attack on any error.
+		"""
+		try:
+			with STAGES.time('nn'):
+				return self.predict_cached('nn', models, request_data)
+		except:
+			return True, []
+
+	def predict_nn_types(self, models, request_data):
+		"""
+			Prediction of the types by the nn, assumes an unknown type on any error.
+		"""
+		try:
+			with STAGES.time('nn_types'):
+				return self.predict_cached('nn_types', models, request_data)
+		except:
+			return True, [['99', 0], ['99', 0], ['99', 0], ['99', 0], ['99', 0]]
+
 	def is_safe(self, request_data):
 		"""
 			Classifies a request, returns if the given request object can be assumed 
@@ -96,26 +357,34 @@ class RequestChecker():
 		"""
 		is_safe = None
 
-		# two class prediction
+		# two class prediction (and types, if needed)
 		#	if we get any type of error, the request may be insecure!
-		try:
-			lda_is_attack, lda_types = self.lda.predict(request_data)
-		except:
-			lda_is_attack, lda_types = True, [['attack', 0], ['attack', 0], ['attack', 0], ['attack', 0], ['attack', 0]]
+		#	models not loaded (see APPROACH_USE) are ignored by model_connector()
+		self.start_reloader()
+		with self.acquire_models() as models:
+			predictors = {}
+			if models.lda != None:
+				predictors['lda'] = self.predict_lda
+			if models.nn != None:
+				predictors['nn'] = self.predict_nn
+			if models.nn_types != None:
+				predictors['nn_types'] = self.predict_nn_types
 
-		try:
-			nn_is_attack, _ = self.nn.predict(request_data)
-		except:
-			nn_is_attack = True
+			if self.parallel:
+				executor = self.get_executor()
+				futures = {name : executor.submit(p, models, request_data) for name, p in predictors.items()}
+				results = {name : f.result() for name, f in futures.items()}
+			else:
+				results = {name : p(models, request_data) for name, p in predictors.items()}
+
+		lda_is_attack, lda_types = results.get('lda', (False, []))
+		nn_is_attack, _ = results.get('nn', (False, []))
+		_, nn_types = results.get('nn_types', (False, []))
 
 		# block or allow types defined by user => we are also interested in the types, not only "is save?"
 		if self.type_handling.is_active():
-			try:
-				_, nn_types = self.nn_types.predict(request_data)
-			except:
-				nn_types = [['99', 0], ['99', 0], ['99', 0], ['99', 0], ['99', 0]]
-
-			for lda_type,nn_type in zip(lda_types,nn_types):
+			# only one model used => compare its types on both sides (the other side is ignored)
+			for lda_type,nn_type in zip(lda_types if 'lda' in results else nn_types, nn_types if 'nn_types' in results else lda_types):
 				
 				# check blocked types
 				no_block = self.model_connector(
@@ -139,13 +408,24 @@ class RequestChecker():
 		if is_safe == None:
 			is_safe = self.model_connector( not lda_is_attack, not nn_is_attack)
 
+		if 'lda' in results:
+			VERDICTS.inc('lda', 'attack' if lda_is_attack else 'safe')
+		if 'nn' in results:
+			VERDICTS.inc('nn', 'attack' if nn_is_attack else 'safe')
+		VERDICTS.inc('prp', 'safe' if is_safe else 'attack')
+		if not is_safe:
+			if len(lda_types) > 0:
+				TYPES.inc('lda', TypeHandler.category(lda_types[0][0]))
+			if len(nn_types) > 0:
+				TYPES.inc('nn_types', TypeHandler.category(nn_types[0][0]))
+
 		# send notification if activated and given unsafe request
 		if Notifications.is_active():
 			if not is_safe:
 				self.notifications.log_attack(
-					request_data.connection_id,
+					request_data.connection_id, request_data.remote_ip,
 					lda_is_attack, nn_is_attack,
-					lda_types, nn_types if self.type_handling.is_active() else []
+					lda_types, nn_types
 				)
 			
 			# always check if daily report should be sent
@@ -3,13 +3,17 @@ import time
 import hashlib
 import re
 
+from src.data.request_context import RequestContext
+from src.utils.shared_state import create_counter
+
 class RequestData():
 	"""
 		Represents a request and allows export in the specified data format used
 		by the IDS.
 	"""
 
-	current_id = 0
+	# ids of the requests (shared between the workers, if there are multiple)
+	ids = create_counter(0)
 
 	def __init__(self, request, connection_id):
 		"""
@@ -18,10 +22,10 @@ class RequestData():
 				request: Flask request object
 				connection_id: The connection id of client
 		"""
-		self.id = RequestData.current_id
-		RequestData.current_id += 1
+		self.id = next(RequestData.ids)
 
 		self.connection_id = connection_id
+		self.context = None
 
 		self.url = str(request.full_path)
 		self.protocol = str(request.environ['SERVER_PROTOCOL'])
@@ -40,6 +44,32 @@ class RequestData():
 
 		self.clear_session_cookie(self.header_dict)
 
+	@staticmethod
+	def from_dict(data):
+		"""
+			Creates an object from a request in the specified data format used by the IDS
+			(e.g., an entry of the request log or a benchmark corpus), without a Flask request.
+			Args:
+				data (dict): The request as returned by create_dict()
+		"""
+		request_data = RequestData.__new__(RequestData)
+		request_data.id = data['id'] if 'id' in data else next(RequestData.ids)
+
+		request_data.connection_id = data['connection-id']
+		request_data.context = None
+
+		request_data.url = data['request']['uri']
+		request_data.protocol = data['request'].get('protocol', 'HTTP/1.1')
+		request_data.remote_ip = data.get('sender', {}).get('ip', '')
+
+		request_data.method = data['request']['method']
+		request_data.header_dict = dict(data['header'])
+		request_data.time = data['timestamp'] if 'timestamp' in data else int(time.time())
+		body = data['request']['body']
+		request_data.body = dict(body) if isinstance(body, dict) else body
+
+		return request_data
+
 	def print(self):
 		"""
 			Prints the request (as json string)
@@ -80,6 +110,15 @@ class RequestData():
 			}
 		}
 
+	def get_context(self):
+		"""
+			Returns the request as RequestContext, which is created once and then
+			shared by all models classifying the request.
+		"""
+		if self.context == None:
+			self.context = RequestContext(self.create_dict())
+		return self.context
+
 	def clear_session_cookie(self, header):
 		"""Removes the systems session cookie from a given HTTP header.
 
@@ -1,35 +1,171 @@
 
-import time, os, atexit, json
+import time, os, atexit, json, threading, queue, random, hashlib, gzip, shutil
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+from log import Logging
+from log_reader import LogReader, INDEX_RECORD, LENGTH_PREFIX
+from src.utils.connection_table import ConnectionTable
 
 class RequestLogger():
 	"""
 		This class handles the logging of the request in the format used by the IDS.
 		The logs should be used to learn better models later.
+
+		The requests are only queued while handling them, a background thread
+		writes the queued entries in batches.
+
+		The log is split into segments (files), a new segment is started when the current
+		one gets too large or too old. Each finished segment is a valid JSON array and
+		is compressed in the background.
+
+		Formats of the log (see log_reader.py to read them):
+			json: One JSON array per file (default).
+			ndjson: One JSON object per line.
+			msgpack: Each entry as msgpack, prefixed by its length (4 bytes, big endian).
+		For ndjson and msgpack an index file is written next to each segment (extension .idx),
+		containing the timestamp and the offset of each entry in the (uncompressed) segment.
 	"""
 
 	LOGPATH = "/proxy/logs/"
-	
+	# maximum number of entries written at once
+	BATCH_SIZE = 100
+
 	def __init__(self):
 		"""
-			Open a new logfile and register a listener to close file on python shutdown
+			Prepare the logging, the logfile itself is opened by the process writing the first entry
 		"""
-		filename = RequestLogger.LOGPATH + "/requests_"+ time.strftime( "%Y-%m-%d_%H-%M-%S" ) + ".json"
-
-		self.logfile = open(filename, "w+")
-		self.first_entry = True
+		self.logfile = None
+		self.pid = None
+		self.lock = threading.Lock()
 
 		self.log_all = "LOG_REQUESTS" in os.environ and os.environ.get("LOG_REQUESTS") == "all"
 
+		self.format = os.environ.get("LOG_FORMAT", "json")
+		if self.format == "msgpack" and msgpack == None:
+			Logging.log("Package msgpack not installed, writing the request log as ndjson!", Logging.LEVEL_WARN)
+			self.format = "ndjson"
+		elif self.format not in ["json", "ndjson", "msgpack"]:
+			self.format = "json"
+
+		# queue between requests and writer thread
+		#	size: entries queued at most
+		#	overflow: 'block' the request until there is space, or 'drop' the entry (and count it)
+		self.queue_size = int(os.environ.get("LOG_QUEUE_SIZE")) if len(os.environ.get("LOG_QUEUE_SIZE", "")) > 0 else 10000
+		self.block_on_overflow = os.environ.get("LOG_OVERFLOW") != "drop"
+		self.dropped = 0
+
+		# seconds between flushes of the file, and whether to also fsync
+		self.flush_interval = float(os.environ.get("LOG_FLUSH_INTERVAL")) if len(os.environ.get("LOG_FLUSH_INTERVAL", "")) > 0 else 1
+		self.fsync = os.environ.get("LOG_FSYNC") == "true"
+
+		# rotation of the segments by size (MB) and age (seconds), 0 for no rotation
+		self.rotate_size = int(float(os.environ.get("LOG_ROTATE_SIZE")) * 1024 * 1024) if len(os.environ.get("LOG_ROTATE_SIZE", "")) > 0 else 0
+		self.rotate_age = float(os.environ.get("LOG_ROTATE_AGE")) if len(os.environ.get("LOG_ROTATE_AGE", "")) > 0 else 0
+		# number of segments kept in LOGPATH (of all processes and former runs), 0 to keep all
+		self.retention = int(os.environ.get("LOG_RETENTION")) if len(os.environ.get("LOG_RETENTION", "")) > 0 else 0
+
+		# compression of finished segments ('gzip' or 'zstd')
+		self.compression = os.environ.get("LOG_COMPRESS", "")
+		if self.compression == "zstd" and zstandard == None:
+			Logging.log("Package zstandard not installed, compressing the request log using gzip!", Logging.LEVEL_WARN)
+			self.compression = "gzip"
+		elif self.compression not in ["gzip", "zstd"]:
+			self.compression = None
+
+		# fraction of safe requests logged (attacks are always logged)
+		self.sample_rate = float(os.environ.get("LOG_SAMPLE_RATE")) if len(os.environ.get("LOG_SAMPLE_RATE", "")) > 0 else 1
+		# safe requests equal to one logged during the last LOG_DEDUP_TTL seconds are not logged again
+		dedup_size = int(os.environ.get("LOG_DEDUP_SIZE")) if len(os.environ.get("LOG_DEDUP_SIZE", "")) > 0 else 0
+		dedup_ttl = int(os.environ.get("LOG_DEDUP_TTL")) if len(os.environ.get("LOG_DEDUP_TTL", "")) > 0 else 3600
+		self.seen = ConnectionTable(max_entries=dedup_size, ttl=dedup_ttl) if dedup_size > 0 else None
+		self.sampled_out = 0
+		self.duplicates = 0
+
+	def start(self):
+		"""
+			Start the writer and compression threads for the current process and register a listener
+			to close the log on python shutdown.
+		"""
+		self.pid = os.getpid()
+		self.logfile = None
+		self.segment_counter = 0
+
+		self.queue = queue.Queue(maxsize=self.queue_size)
+		self.writer = threading.Thread(target=self.write_entries, daemon=True)
+		self.writer.start()
+
+		self.finished = queue.Queue()
+		self.compressor = threading.Thread(target=self.compress_segments, daemon=True)
+		self.compressor.start()
+
 		atexit.register(self.end_json)
 
+	def open_segment(self):
+		"""
+			Open a new logfile. Workers forked from the master process each get an own
+			file (suffixed by the pid), such that their entries do not interleave.
+		"""
+		filename = RequestLogger.LOGPATH + "/requests_"+ time.strftime( "%Y-%m-%d_%H-%M-%S" )
+		if "PRP_WORKERS" in os.environ and os.environ.get("PRP_WORKERS") not in ["", "1"]:
+			filename += "_" + str(self.pid)
+
+		# segments rotated within the same second are numbered
+		suffix = lambda: "_" + str(self.segment_counter) if self.segment_counter > 0 else ""
+		extension = "." + self.format
+		while any(os.path.exists(filename + suffix() + extension + ext) for ext in ["", ".gz", ".zst"]):
+			self.segment_counter += 1
+		self.filename = filename + suffix() + extension
+
+		if self.format == "json":
+			self.logfile = open(self.filename, "w+", encoding="utf-8")
+			self.indexfile = None
+		else:
+			self.logfile = open(self.filename, "wb")
+			self.indexfile = open(self.filename + ".idx", "wb")
+		self.first_entry = True
+		self.segment_bytes = 0
+		self.segment_opened = time.monotonic()
+
+	def close_segment(self):
+		"""
+			Finishes the current logfile with the closing array bracket and hands it to the compression.
+		"""
+		if self.logfile == None:
+			return
+
+		if self.format == "json":
+			self.logfile.write('[\n]' if self.first_entry else '\n]')
+		else:
+			self.indexfile.close()
+		self.logfile.close()
+		self.logfile = None
+		self.finished.put(self.filename)
+
+	def needs_rotation(self):
+		"""
+			Checks whether the current logfile is too large or too old.
+		"""
+		return self.logfile != None and (
+			(self.rotate_size > 0 and self.segment_bytes >= self.rotate_size)
+			or (self.rotate_age > 0 and time.monotonic() - self.segment_opened >= self.rotate_age)
+		)
 
 	def log(self, request_data, is_safe, captcha):
 		"""
 			Log a request in our specified format. We append the given request by
 			another property containing the status whether the request was assumed
-			safe or not by the system. Furthermore, we track whether the captcha was 
+			safe or not by the system. Furthermore, we track whether the captcha was
 			solved successfully.
-		
+
 			Args:
 				request_data (RequestData): RequestData object holding the information
 				about the received request.
@@ -37,15 +173,184 @@ class RequestLogger():
 				captcha (bool): Indicates whether the captcha has been solved successfully.
 		"""
 		if self.log_all or not is_safe:
+			if is_safe and not self.keep_safe(request_data):
+				return
+
 			data = request_data.create_dict()
 			data['prp'] = {
 				'assumed_safe' : 'unknown' if is_safe == None else is_safe,
-				'captcha_solved' : 'unknown' if captcha == None else captcha 
+				'captcha_solved' : 'unknown' if captcha == None else captcha
 			}
-			self.append_json(data)
+			self.enqueue(data)
+
+	def keep_safe(self, request_data):
+		"""
+			Decides whether a safe request is logged, by sampling and removing duplicates.
+			Args:
+				request_data (RequestData): The request to log.
+		"""
+		if self.sample_rate < 1 and random.random() >= self.sample_rate:
+			self.sampled_out += 1
+			return False
+
+		if self.seen != None:
+			key = hashlib.blake2b(json.dumps([
+				request_data.method, request_data.url, request_data.body, request_data.header_dict
+			], sort_keys=True).encode('utf-8'), digest_size=16).digest()
 
-	def append_json(self, logentry):
-		"""Appends a given JSON object to the log.
+			# not get(), which would keep a request repeated all the time from expiring
+			with self.seen.lock:
+				self.seen.cleanup()
+				if key in self.seen:
+					self.duplicates += 1
+					return False
+				self.seen.put(key, True)
+
+		return True
+
+	def enqueue(self, logentry):
+		"""
+			Queues an entry for the writer thread.
+			Args:
+				logentry (dict): The JSON object to append.
+		"""
+		with self.lock:
+			if self.pid != os.getpid():
+				self.start()
+
+		if self.block_on_overflow:
+			self.queue.put(logentry)
+		else:
+			try:
+				self.queue.put_nowait(logentry)
+			except queue.Full:
+				self.dropped += 1
+
+	def write_entries(self):
+		"""
+			The writer thread, writes the queued entries in batches and flushes the
+			file every flush_interval seconds. Stops when getting None from the queue.
+		"""
+		last_flush = time.monotonic()
+		running = True
+		while running:
+			batch = []
+			try:
+				batch.append(self.queue.get(timeout=self.flush_interval))
+				while len(batch) < RequestLogger.BATCH_SIZE:
+					batch.append(self.queue.get_nowait())
+			except queue.Empty:
+				pass
+
+			if None in batch:
+				running = False
+				batch = batch[:batch.index(None)]
+
+			try:
+				if len(batch) > 0:
+					self.write_batch(batch)
+
+				if not running or self.needs_rotation():
+					self.close_segment()
+				elif self.logfile != None and time.monotonic() - last_flush >= self.flush_interval:
+					for file in [self.logfile, self.indexfile]:
+						if file != None:
+							file.flush()
+							if self.fsync:
+								os.fsync(file.fileno())
+					last_flush = time.monotonic()
+			except:
+				Logging.log("Error writing the request log!", Logging.LEVEL_ERROR)
+
+		self.finished.put(None)
+
+	def write_batch(self, batch):
+		"""
+			Appends entries to the current logfile (opens one if there is none). Starts a new
+			logfile as soon as the current one reaches the rotation size, i.e., a logfile exceeds
+			it by at most one entry.
+			Args:
+				batch (list): The JSON objects to append.
+		"""
+		for entry in batch:
+			if self.logfile == None:
+				self.open_segment()
+
+			if self.format == "json":
+				string = self.format_json(entry)
+				self.logfile.write(string)
+				# the size on disk (in bytes, not characters) decides the rotation
+				self.segment_bytes += len(string.encode("utf-8"))
+			else:
+				data = self.format_entry(entry)
+				self.indexfile.write(INDEX_RECORD.pack(int(entry.get('timestamp', 0)), self.segment_bytes))
+				self.logfile.write(data)
+				self.segment_bytes += len(data)
+
+			if self.rotate_size > 0 and self.segment_bytes >= self.rotate_size:
+				self.close_segment()
+
+	def compress_segments(self):
+		"""
+			The compression thread, compresses the finished logfiles and removes the oldest
+			ones exceeding the retention. Stops when getting None from the queue.
+		"""
+		while True:
+			filename = self.finished.get()
+			if filename == None:
+				break
+
+			try:
+				if self.compression == "gzip":
+					with open(filename, "rb") as source, gzip.open(filename + ".gz", "wb") as target:
+						shutil.copyfileobj(source, target)
+					os.remove(filename)
+					filename += ".gz"
+				elif self.compression == "zstd":
+					with open(filename, "rb") as source, open(filename + ".zst", "wb") as target:
+						zstandard.ZstdCompressor().copy_stream(source, target)
+					os.remove(filename)
+					filename += ".zst"
+
+				if self.retention > 0:
+					self.remove_segments()
+			except:
+				Logging.log("Error compressing the request log!", Logging.LEVEL_ERROR)
+
+	def remove_segments(self):
+		"""
+			Removes the oldest logfiles in LOGPATH exceeding the retention, including the ones of
+			other workers and former runs. If the logfiles are compressed, only compressed ones
+			are counted (the others are being written or compressed).
+		"""
+		extension = {"gzip": ".gz", "zstd": ".zst"}.get(self.compression, None)
+		segments = []
+		for name in os.listdir(RequestLogger.LOGPATH):
+			split = LogReader.split_name(name) if name.startswith("requests_") else None
+			if split == None or (extension != None and split[1] != extension):
+				continue
+			path = os.path.join(RequestLogger.LOGPATH, name)
+			try:
+				segments.append((os.path.getmtime(path), name, path))
+			except FileNotFoundError:
+				# removed by another worker meanwhile
+				pass
+
+		segments.sort()
+		for _, name, path in segments[:max(0, len(segments) - self.retention)]:
+			# the logfile currently written by this process
+			if name == os.path.basename(self.filename):
+				continue
+			# the index belongs to the uncompressed name
+			index = path[:len(path) - len(LogReader.split_name(path)[1])] + ".idx"
+			for filename in [path, index]:
+				try:
+					os.remove(filename)
+				except FileNotFoundError:
+					pass
+
+	def format_json(self, logentry):
+		"""Formats a given JSON object to append it to the log.
 			Args:
 				logentry (dict): The JSON object to append.
 		"""
@@ -54,17 +359,36 @@ class RequestLogger():
 			self.first_entry = False
 		else:
 			string = ",\n"
-		
+
 		string += json.dumps([logentry], indent=4, sort_keys=False)[2:-2] # for indentation
-		self.logfile.write(string)
-		self.logfile.flush()
+		return string
+
+	def format_entry(self, logentry):
+		"""Encodes a given JSON object as ndjson line or length prefixed msgpack.
+			Args:
+				logentry (dict): The JSON object to append.
+		"""
+		if self.format == "msgpack":
+			data = msgpack.packb(logentry, use_bin_type=True)
+			return LENGTH_PREFIX.pack(len(data)) + data
+		else:
+			return (json.dumps(logentry, separators=(',', ':')) + "\n").encode('utf-8')
 
 	def end_json(self):
 		"""
-			Finishes the logfile with the closing array bracket.
+			Writes the remaining entries, finishes the logfile with the closing array bracket
+			and compresses it.
 		"""
-		self.logfile.write('\n]')
-		self.logfile.close()
-	
-		
-		
\ No newline at end of file
+		if self.pid != os.getpid() or not self.writer.is_alive():
+			return
+
+		self.queue.put(None)
+		self.writer.join(timeout=10)
+		self.compressor.join(timeout=30)
+
+		if self.dropped > 0:
+			Logging.log(str(self.dropped) + " requests were not logged, the queue was full!", Logging.LEVEL_WARN)
+		if self.sampled_out > 0 or self.duplicates > 0:
+			Logging.log("Safe requests not logged: " + str(self.sampled_out) + " by sampling, " + str(self.duplicates) + " duplicates.", Logging.LEVEL_INFO)
+
+
@@ -0,0 +1,139 @@
+import math, hashlib
+import numpy
+
+from src.utils.shared_state import create_arrays
+
+def hash64(key):
+	"""
+		Returns a 64 bit hash of a key (stable between processes, unlike hash()).
+		Args:
+			key: The key to hash, converted to a string.
+	"""
+	return int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'little')
+
+class CountMinSketch():
+	"""
+		Estimates how often each key was added using constant memory (width * depth counters).
+		The estimates never underestimate, they overestimate by at most 2/width * total
+		with probability 1 - 0.5^depth.
+
+		Additionally tracks the (estimated) top keys, stored as strings (of at most KEY_BYTES bytes).
+	"""
+
+	KEY_BYTES = 64
+
+	def __init__(self, width=1024, depth=4, top=10, shared=False):
+		"""
+			Args:
+				width (int): Counters per row.
+				depth (int): Number of rows (independent hash functions).
+				top (int): Number of top keys to track.
+				shared (bool): Whether the sketch is in memory shared by the processes forked afterwards
+					(the caller has to lock it).
+		"""
+		self.width = width
+		self.depth = depth
+		self.rows = numpy.arange(depth)
+
+		# the top keys, unused ones have a count of 0
+		arrays = create_arrays([
+			('counters', numpy.int64, (depth, width)),
+			('totals', numpy.int64, (1,)),
+			('top_keys', 'S' + str(CountMinSketch.KEY_BYTES), (top,)),
+			('top_counts', numpy.int64, (top,))
+		], shared)
+		self.counters = arrays['counters']
+		self.totals = arrays['totals']
+		self.top_keys = arrays['top_keys']
+		self.top_counts = arrays['top_counts']
+
+	@property
+	def total(self):
+		return int(self.totals[0])
+
+	def columns(self, key):
+		"""
+			Returns the counter of the key in each row (double hashing).
+		"""
+		h = hash64(key)
+		return ((h & 0xffffffff) + self.rows * ((h >> 32) | 1)) % self.width
+
+	def add(self, key, count=1):
+		"""
+			Adds a key count times.
+		"""
+		columns = self.columns(key)
+		self.counters[self.rows, columns] += count
+		self.totals[0] += count
+
+		estimate = int(self.counters[self.rows, columns].min())
+		stored = str(key).encode('utf-8')[:CountMinSketch.KEY_BYTES]
+		found = numpy.flatnonzero((self.top_keys == stored) & (self.top_counts > 0))
+		# the key itself, else an unused one, else the smallest one (if smaller)
+		top = found[0] if len(found) > 0 else numpy.argmin(self.top_counts)
+		if len(found) > 0 or estimate > self.top_counts[top]:
+			self.top_keys[top] = stored
+			self.top_counts[top] = estimate
+
+	def estimate(self, key):
+		"""
+			Returns the estimated number of times the key was added.
+		"""
+		return int(self.counters[self.rows, self.columns(key)].min())
+
+	def most_common(self, n=None):
+		"""
+			Returns the top keys with their estimated counts [(key, count), ...], the most common first.
+		"""
+		top = [(key.decode('utf-8', errors='replace'), int(count)) for key, count in zip(self.top_keys.tolist(), self.top_counts.tolist()) if count > 0]
+		return sorted(top, key=lambda item: item[1], reverse=True)[:n]
+
+	def clear(self):
+		self.counters[:] = 0
+		self.totals[:] = 0
+		self.top_counts[:] = 0
+
+class HyperLogLog():
+	"""
+		Estimates the number of distinct keys added using constant memory (2^precision bytes).
+		The standard error is about 1.04 / sqrt(2^precision), i.e., 3.3% for the default.
+	"""
+
+	def __init__(self, precision=10, shared=False):
+		"""
+			Args:
+				precision (int): Number of bits of the hash selecting the register (4 to 16).
+				shared (bool): Whether the registers are in memory shared by the processes forked afterwards.
+		"""
+		self.precision = precision
+		self.m = 1 << precision
+		self.registers = create_arrays([('registers', numpy.uint8, (self.m,))], shared)['registers']
+		self.alpha = 0.7213 / (1 + 1.079 / self.m)
+
+	def add(self, key):
+		"""
+			Adds a key.
+		"""
+		h = hash64(key)
+		register = h >> (64 - self.precision)
+		# position of the first 1 bit in the remaining bits
+		rest = h & ((1 << (64 - self.precision)) - 1)
+		rank = (64 - self.precision) - rest.bit_length() + 1
+		if rank > self.registers[register]:
+			self.registers[register] = rank
+
+	def count(self):
+		"""
+			Returns the estimated number of distinct keys.
+		"""
+		estimate = self.alpha * self.m * self.m / numpy.sum(numpy.power(2.0, -self.registers.astype(numpy.float64)))
+
+		# small range correction (linear counting)
+		zeros = int(numpy.count_nonzero(self.registers == 0))
+		if estimate <= 2.5 * self.m and zeros > 0:
+			estimate = self.m * math.log(self.m / zeros)
+
+		return int(round(estimate))
+
+	def clear(self):
+		self.registers[:] = 0
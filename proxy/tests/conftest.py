@@ -0,0 +1,7 @@
+import os, sys
+
+# the tests import the modules of the proxy (run from its directory in the container) and of the protection
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, "protection"))
+sys.path.insert(0, os.path.join(ROOT, "proxy"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
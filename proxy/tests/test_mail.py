@@ -0,0 +1,122 @@
+import time, types, threading
+import pytest
+
+import mail
+from mail import Mailer
+
+class FakeSMTP():
+	"""
+		Records the connections and mails instead of talking to a smtp server.
+	"""
+
+	# the connections opened, the number of sendmail() calls failing next and an event blocking them
+	connections = []
+	failures = 0
+	release = None
+
+	def __init__(self, host=None, port=None, timeout=None):
+		self.logins = 0
+		self.mails = []
+		self.closed = False
+		self.sending = threading.Event()
+		FakeSMTP.connections.append(self)
+
+	def ehlo(self):
+		pass
+
+	def starttls(self):
+		pass
+
+	def login(self, user, password):
+		self.logins += 1
+
+	def sendmail(self, sender, to, message):
+		self.sending.set()
+		if FakeSMTP.release != None:
+			FakeSMTP.release.wait(5)
+		if FakeSMTP.failures > 0:
+			FakeSMTP.failures -= 1
+			raise OSError("connection lost")
+		self.mails.append(message)
+
+	def quit(self):
+		self.closed = True
+
+	def close(self):
+		self.closed = True
+
+def subjects(connections):
+	return [line for c in connections for message in c.mails for line in message.splitlines() if line.startswith("Subject:")]
+
+@pytest.fixture
+def mailer(monkeypatch):
+	for name, value in [("MAIL_HOST", "localhost"), ("MAIL_PORT", "1025"), ("MAIL_USERNAME", "prp"), ("MAIL_PASSWORD", "prp"),
+			("MAIL_FROM", "prp@localhost"), ("MAIL_TO", "admin@localhost")]:
+		monkeypatch.setenv(name, value)
+	monkeypatch.setattr(mail.smtplib, "SMTP", FakeSMTP)
+	monkeypatch.setattr(FakeSMTP, "connections", [])
+	monkeypatch.setattr(FakeSMTP, "failures", 0)
+	monkeypatch.setattr(FakeSMTP, "release", None)
+	return Mailer()
+
+def test_coalesce():
+	mails = [("emergency", "1", "E"), (None, "a", "T"), ("report", "r", "R"), ("emergency", "2", "E"), (None, "b", "T")]
+	assert Mailer.coalesce(mails) == [("a", "T"), ("r", "R"), ("2", "E"), ("b", "T")]
+
+def test_send_does_not_wait_for_server(mailer):
+	FakeSMTP.release = threading.Event()
+
+	start = time.monotonic()
+	mailer.send("text", "First")
+	assert time.monotonic() - start < 1
+
+	FakeSMTP.release.set()
+	mailer.queue.join()
+	assert subjects(FakeSMTP.connections) == ["Subject: [PRP] First"]
+
+def test_burst_is_coalesced(mailer):
+	FakeSMTP.release = threading.Event()
+	mailer.send("0", "Emergency 0", kind="emergency")
+	# wait until the first mail is being sent, the others are queued meanwhile
+	for _ in range(100):
+		if len(FakeSMTP.connections) > 0 and FakeSMTP.connections[0].sending.is_set():
+			break
+		time.sleep(0.01)
+	for i in range(1, 5):
+		mailer.send(str(i), "Emergency " + str(i), kind="emergency")
+	mailer.send("text", "Testmail")
+
+	FakeSMTP.release.set()
+	mailer.queue.join()
+	assert subjects(FakeSMTP.connections) == ["Subject: [PRP] Emergency 0", "Subject: [PRP] Emergency 4", "Subject: [PRP] Testmail"]
+
+def test_connection_is_reused_and_closed_when_idle(mailer, monkeypatch):
+	monkeypatch.setattr(Mailer, "IDLE_TIMEOUT", 0.2)
+	for subject in ["First", "Second"]:
+		mailer.send("text", subject)
+		mailer.queue.join()
+
+	assert len(FakeSMTP.connections) == 1
+	connection = FakeSMTP.connections[0]
+	assert connection.logins == 1 and len(connection.mails) == 2
+
+	for _ in range(100):
+		if connection.closed:
+			break
+		time.sleep(0.01)
+	assert connection.closed and mailer.client == None
+
+def test_retry_with_backoff(mailer, monkeypatch):
+	sleeps = []
+	monkeypatch.setattr(mail, "time", types.SimpleNamespace(sleep=sleeps.append))
+
+	FakeSMTP.failures = 2
+	assert mailer.deliver("text", "Retried")
+	assert sleeps == [2, 4]
+	# a new connection per attempt, the failed ones are closed
+	assert len(FakeSMTP.connections) == 3
+	assert all(c.closed for c in FakeSMTP.connections[:2])
+	assert subjects(FakeSMTP.connections) == ["Subject: [PRP] Retried"]
+
+	FakeSMTP.failures = mailer.retries
+	assert not mailer.deliver("text", "Failed")
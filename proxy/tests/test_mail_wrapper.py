@@ -0,0 +1,40 @@
+import os, time
+import pytest
+
+from mail_wrapper import Notifications
+
+@pytest.fixture
+def notifications(monkeypatch):
+	for name, value in [("MAIL_HOST", "localhost"), ("MAIL_PORT", "1025"), ("MAIL_USERNAME", "prp"), ("MAIL_PASSWORD", "prp"),
+			("MAIL_FROM", "prp@localhost"), ("MAIL_TO", "admin@localhost"), ("PRP_WORKERS", "2")]:
+		monkeypatch.setenv(name, value)
+	return Notifications()
+
+def test_attacks_shared_with_forked_worker(notifications):
+	pid = os.fork()
+	if pid == 0:
+		notifications.log_attack(1, "10.0.0.1", True, False, [["sqli", 0.2]])
+		os._exit(0)
+	os.waitpid(pid, 0)
+	notifications.log_attack(2, "10.0.0.2", True, False, [["xss", 0.1], ["sqli", 0.3]])
+
+	assert notifications.state[Notifications.NEXT_ATTACK] == 2
+	assert notifications.day_counts.sum() == 2
+	assert sorted(key for key, _ in notifications.top_ips.most_common()) == ["10.0.0.1", "10.0.0.2"]
+	assert notifications.distinct_connections.count() == 2
+
+	# the type added by the other worker is reused
+	attack = notifications.attacks[1]
+	assert notifications.format_types(attack['lda_types'], attack['lda_distances']) == "xss (0.100), sqli (0.300)"
+	assert notifications.state[Notifications.TYPE_COUNT] == 2
+
+def test_mail_sent_by_one_worker(notifications):
+	due = int(time.time()) + 86401
+
+	pid = os.fork()
+	if pid == 0:
+		os._exit(0 if notifications.claim_mail(Notifications.LAST_REPORTMAIL, due, 86400) else 1)
+	_, status = os.waitpid(pid, 0)
+
+	assert os.waitstatus_to_exitcode(status) == 0
+	assert not notifications.claim_mail(Notifications.LAST_REPORTMAIL, due, 86400)
@@ -0,0 +1,106 @@
+import os, json
+import pytest
+
+from request_log import RequestLogger
+from log_reader import LogReader
+
+ENTRIES = [
+	{"id": i, "timestamp": 100 + i, "connection-id": i % 3, "request": {"method": "GET", "uri": "/?q=" + "ä" * i}, "prp": {"assumed_safe": i % 2 == 0}}
+	for i in range(10)
+]
+
+def write_log(tmp_path, monkeypatch, entries=ENTRIES, **env):
+	"""
+		Writes the entries by a RequestLogger (configured by env) into tmp_path, returns the files written.
+	"""
+	monkeypatch.setattr(RequestLogger, "LOGPATH", str(tmp_path))
+	monkeypatch.delenv("PRP_WORKERS", raising=False)
+	for name, value in dict({"LOG_FLUSH_INTERVAL": "0.05"}, **env).items():
+		monkeypatch.setenv(name, value)
+
+	logger = RequestLogger()
+	for entry in entries:
+		logger.enqueue(entry)
+	logger.end_json()
+	return sorted(os.listdir(tmp_path))
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+@pytest.mark.parametrize("format", ["json", "ndjson", "msgpack"])
+def test_round_trip(tmp_path, monkeypatch, format, compression):
+	if format == "msgpack":
+		pytest.importorskip("msgpack")
+	if compression == "zstd":
+		pytest.importorskip("zstandard")
+
+	files = write_log(tmp_path, monkeypatch, LOG_FORMAT=format, LOG_COMPRESS=compression)
+	extension = "." + format + {"none": "", "gzip": ".gz", "zstd": ".zst"}[compression]
+	assert [f for f in files if not f.endswith(".idx")][0].endswith(extension)
+
+	reader = LogReader(str(tmp_path))
+	assert list(reader.entries()) == ENTRIES
+	assert list(reader.entries(start=103, end=106)) == ENTRIES[3:6]
+	assert list(reader.entries(start=200)) == []
+
+def test_time_range_read_by_index(tmp_path, monkeypatch):
+	files = write_log(tmp_path, monkeypatch, LOG_FORMAT="ndjson")
+	segment = str(tmp_path / files[0])
+	index = LogReader.read_index(segment)
+	assert [timestamp for timestamp, _ in index] == [e["timestamp"] for e in ENTRIES]
+
+	# an entry outside of the range is not read at all
+	with open(segment, "r+b") as file:
+		file.write(b"x")
+	assert list(LogReader(segment).entries(start=105)) == ENTRIES[5:]
+	with pytest.raises(json.JSONDecodeError):
+		list(LogReader(segment).entries())
+
+def test_incomplete_entries_are_skipped(tmp_path, monkeypatch):
+	files = write_log(tmp_path, monkeypatch, LOG_FORMAT="ndjson")
+	segment = str(tmp_path / files[0])
+
+	# the process was killed while writing the last entry
+	with open(segment, "r+b") as file:
+		file.truncate(os.path.getsize(segment) - 5)
+	assert list(LogReader(segment).entries()) == ENTRIES[:-1]
+
+def test_repair_killed_json_segment(tmp_path, monkeypatch):
+	files = write_log(tmp_path, monkeypatch)
+	segment = str(tmp_path / files[0])
+	with open(segment, encoding="utf-8") as file:
+		content = file.read()
+
+	# without the closing bracket and within the last entry
+	assert LogReader.repair_json(content[:-2]) == ENTRIES
+	assert LogReader.repair_json(content[:content.rindex("}")]) == ENTRIES[:-1]
+	with open(segment, "w", encoding="utf-8") as file:
+		file.write(content[:-10])
+	assert list(LogReader(segment).entries()) == ENTRIES[:-1]
+
+	assert LogReader.repair_json("") == []
+	assert LogReader.repair_json("[\n") == []
+
+def test_rotation_by_size_per_entry(tmp_path, monkeypatch):
+	limit = 250
+	files = write_log(tmp_path, monkeypatch, LOG_FORMAT="ndjson", LOG_ROTATE_SIZE=str(limit / 1024 / 1024))
+	segments = [f for f in files if not f.endswith(".idx")]
+	assert 1 < len(segments) < 10
+
+	for segment in segments:
+		with open(tmp_path / segment, "rb") as file:
+			lines = file.read().splitlines(keepends=True)
+		# exceeds the size by at most the last entry
+		assert sum(len(line) for line in lines[:-1]) < limit
+	assert list(LogReader(str(tmp_path)).entries()) == ENTRIES
+
+def test_retention_counts_all_logfiles(tmp_path, monkeypatch):
+	# logfiles of a former run
+	for name in ["requests_2000-01-01_00-00-00.ndjson.gz", "requests_2000-01-01_00-00-00.ndjson.idx", "other.txt"]:
+		(tmp_path / name).write_bytes(b"")
+		os.utime(tmp_path / name, (0, 0))
+
+	files = write_log(tmp_path, monkeypatch, LOG_FORMAT="ndjson", LOG_COMPRESS="gzip", LOG_RETENTION="2", LOG_ROTATE_SIZE=str(250 / 1024 / 1024))
+	segments = [f for f in files if f.endswith(".gz")]
+	assert len(segments) == 2
+	assert "requests_2000-01-01_00-00-00.ndjson.idx" not in files and "other.txt" in files
+	# the newest entries are kept
+	assert list(LogReader(str(tmp_path)).entries())[-1] == ENTRIES[-1]
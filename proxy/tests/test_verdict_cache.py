@@ -0,0 +1,76 @@
+import types
+
+import verdict_cache
+from verdict_cache import VerdictCache
+from request_check import RequestChecker
+
+class Clock():
+	"""
+		Replaces time.monotonic() of the cache.
+	"""
+
+	def __init__(self):
+		self.now = 1000.0
+
+	def monotonic(self):
+		return self.now
+
+def test_least_recently_used_is_evicted():
+	cache = VerdictCache(2, 60)
+	cache.put("a", 1)
+	cache.put("b", 2)
+	assert cache.get("a") == 1
+	cache.put("c", 3)
+
+	assert cache.get("b") == None
+	assert cache.get("a") == 1 and cache.get("c") == 3
+	assert cache.stats() == {'size' : 2, 'hits' : 3, 'misses' : 1, 'evictions' : 1, 'expirations' : 0}
+
+def test_entries_expire(monkeypatch):
+	clock = Clock()
+	monkeypatch.setattr(verdict_cache, "time", clock)
+	cache = VerdictCache(10, 60)
+	cache.put("a", 1)
+
+	clock.now += 59
+	assert cache.get("a") == 1
+	clock.now += 1
+	assert cache.get("a") == None
+	assert cache.stats() == {'size' : 0, 'hits' : 1, 'misses' : 1, 'evictions' : 0, 'expirations' : 1}
+
+	# storing again renews the entry
+	cache.put("a", 2)
+	clock.now += 30
+	assert cache.get("a") == 2
+
+class StubPredictor():
+	"""
+		Counts the predictions, the fingerprint is the uri of the request.
+	"""
+
+	def __init__(self):
+		self.predictions = 0
+
+	def fingerprint(self, context):
+		return context
+
+	def predict(self, request_data):
+		self.predictions += 1
+		return self.predictions
+
+def test_reload_invalidates_cached_verdicts():
+	checker = types.SimpleNamespace(verdict_cache=VerdictCache(10, 60))
+	request = types.SimpleNamespace(get_context=lambda: "/index.php")
+	predictor = StubPredictor()
+	models = types.SimpleNamespace(generation=1, nn=predictor, nn_types=predictor)
+
+	assert RequestChecker.predict_cached(checker, "nn", models, request) == 1
+	assert RequestChecker.predict_cached(checker, "nn", models, request) == 1
+	# each nn has its own predictions
+	assert RequestChecker.predict_cached(checker, "nn_types", models, request) == 2
+
+	# the models of the next reload
+	reloaded = types.SimpleNamespace(generation=2, nn=predictor, nn_types=predictor)
+	assert RequestChecker.predict_cached(checker, "nn", reloaded, request) == 3
+	assert RequestChecker.predict_cached(checker, "nn", reloaded, request) == 3
+	assert RequestChecker.predict_cached(checker, "nn", models, request) == 1
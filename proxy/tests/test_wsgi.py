@@ -0,0 +1,154 @@
+import os, sys, time, json, shutil, signal, subprocess
+
+import pytest
+
+from load_fcgi import fcgi_request, fcgi_environ
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# runs the server of wsgi.py with multiple workers, on the socket, ready file and models given
+SERVER = """
+import sys
+import request_check
+request_check.RequestChecker.MODELS_DIR = sys.argv[1]
+import wsgi
+wsgi.READY_FILE = sys.argv[3]
+wsgi.PreforkServer(wsgi.app, wsgi.checker, 2, bindAddress=sys.argv[2]).run()
+"""
+
+def wait_for(condition, timeout=60):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		if time.monotonic() > deadline:
+			raise TimeoutError()
+		time.sleep(0.1)
+
+def children(pid):
+	"""
+		Returns the pids of the child processes of a process.
+	"""
+	pids = set()
+	for entry in os.listdir("/proc"):
+		try:
+			with open("/proc/" + entry + "/stat", "r") as file:
+				# the command may contain spaces, the parent follows the state after it
+				if int(file.read().rsplit(")", 1)[1].split()[1]) == pid:
+					pids.add(int(entry))
+		except (ValueError, OSError):
+			pass
+	return pids
+
+def copy_models(tmp_path):
+	"""
+		Returns the directory of a copy of the dummy model.
+	"""
+	models_dir = str(tmp_path / "model") + "/"
+	shutil.copytree(os.path.join(ROOT, "models", "dummy"), models_dir)
+	return models_dir
+
+def start_server(tmp_path, models_dir, **env):
+	"""
+		Starts the server, returns the process, the socket and the ready file.
+	"""
+	sock, ready = str(tmp_path / "prp.sock"), str(tmp_path / "prp.ready")
+	env = {
+		**os.environ,
+		'PYTHONPATH' : os.path.join(ROOT, "protection"), 'PRP_WORKERS' : "2", 'APPROACH_USE' : "lda",
+		'METRICS' : "true", 'WARMUP_REQUESTS' : "2",
+		**env
+	}
+	process = subprocess.Popen([sys.executable, "-c", SERVER, models_dir, sock, ready], cwd=os.path.join(ROOT, "proxy"), env=env)
+	return process, sock, ready
+
+@pytest.fixture
+def server(tmp_path):
+	models_dir = copy_models(tmp_path)
+	process, sock, ready = start_server(tmp_path, models_dir)
+	try:
+		wait_for(lambda: os.path.exists(ready) or process.poll() != None)
+		assert process.poll() == None
+		yield process, models_dir, sock, ready
+	finally:
+		process.terminate()
+		process.wait(30)
+
+def send(sock):
+	params = fcgi_environ({
+		'request' : {'method' : 'GET', 'uri' : '/index.php?page=1'},
+		'header' : {'Host' : 'localhost', 'User-Agent' : 'test'}
+	}, b"", "")
+	return fcgi_request(sock, params, b"")
+
+def reloads(sock):
+	"""
+		Returns the number of successful and failed reloads (of all processes, see METRICS).
+	"""
+	_, _, body = fcgi_request(sock, dict(fcgi_environ({'request' : {'method' : 'GET', 'uri' : '/metrics'}, 'header' : {}}, b"", ""), PRP_METRICS="true"), b"")
+	counts = {}
+	for line in body.decode().split("\n"):
+		if line.startswith("prp_model_reloads_total"):
+			counts[line.split('"')[1]] = float(line.split(" ")[-1])
+	return counts.get('success', 0), counts.get('error', 0)
+
+def test_reload_replaces_the_workers(server):
+	process, models_dir, sock, ready = server
+	assert send(sock)[0] == 200
+	workers = children(process.pid)
+	assert len(workers) == 2
+
+	# like `pkill -USR1 -f wsgi.py`, the workers ignore the signal
+	for pid in workers | {process.pid}:
+		os.kill(pid, signal.SIGUSR1)
+	wait_for(lambda: reloads(sock) == (1, 0) and len(children(process.pid) & workers) == 0)
+
+	assert process.poll() == None
+	assert os.path.exists(sock) and os.path.exists(ready)
+	assert len(children(process.pid)) == 2
+	for _ in range(10):
+		assert send(sock)[0] == 200
+
+def test_failed_reload_keeps_the_workers(server):
+	process, models_dir, sock, ready = server
+	workers = children(process.pid)
+
+	with open(models_dir + "index.json", "w") as file:
+		json.dump({"name" : "invalid"}, file)
+	os.kill(process.pid, signal.SIGHUP)
+	wait_for(lambda: reloads(sock) == (0, 1))
+
+	assert process.poll() == None
+	assert children(process.pid) == workers
+	assert send(sock)[0] == 200
+
+def test_stop_removes_socket_and_ready_file(server):
+	process, models_dir, sock, ready = server
+	assert os.path.exists(sock)
+	process.terminate()
+	process.wait(30)
+	assert not os.path.exists(sock)
+	assert not os.path.exists(ready)
+
+def test_worker_failing_to_load_stops(tmp_path):
+	# the nns are loaded by the workers
+	models_dir = copy_models(tmp_path)
+	with open(models_dir + "index.json", "r") as file:
+		index = json.load(file)
+	index['nn-attack']['tfmodel'] = "missing.tf"
+	index['nn-crawl']['tfmodel'] = "missing.tf"
+	with open(models_dir + "index.json", "w") as file:
+		json.dump(index, file)
+
+	process, sock, ready = start_server(tmp_path, models_dir, APPROACH_USE="lda,nn")
+	try:
+		assert process.wait(60) == 0
+		assert not os.path.exists(ready)
+	finally:
+		if process.poll() == None:
+			process.kill()
+
+@pytest.mark.parametrize("workers", ["0", "-2", "two"])
+def test_invalid_workers_are_rejected(tmp_path, workers):
+	env = {**os.environ, 'PYTHONPATH' : os.path.join(ROOT, "protection"), 'PRP_WORKERS' : workers}
+	result = subprocess.run([sys.executable, "wsgi.py"], cwd=os.path.join(ROOT, "proxy"), env=env, capture_output=True, text=True, timeout=60)
+	assert result.returncode == 1
+	assert "PRP_WORKERS has to be a positive integer" in result.stdout
@@ -0,0 +1,82 @@
+import time, threading
+from collections import OrderedDict
+
+from src.utils import metrics
+
+LOOKUPS = metrics.counter("prp_verdict_cache_lookups_total", "Lookups in the verdict cache.", {
+	'result' : ['hit', 'miss']
+})
+
+class VerdictCache():
+	"""
+		Least recently used cache for the predictions of the stateless models (the nns).
+		Entries expire after a given time, such that a cached verdict is renewed from time to time.
+	"""
+
+	def __init__(self, size, ttl):
+		"""
+			Args:
+				size (int): The maximum number of cached predictions.
+				ttl (int): Seconds until a cached prediction expires.
+		"""
+		self.size = size
+		self.ttl = ttl
+
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+
+	def get(self, key):
+		"""
+			Returns the cached prediction for key or None if there is none.
+
+			Args:
+				key: The key of the prediction (e.g., a fingerprint of the request).
+		"""
+		with self.lock:
+			if key in self.entries:
+				expires, value = self.entries[key]
+				if expires > time.monotonic():
+					self.entries.move_to_end(key)
+					self.hits += 1
+					LOOKUPS.inc('hit')
+					return value
+
+				del self.entries[key]
+				self.expirations += 1
+
+			self.misses += 1
+			LOOKUPS.inc('miss')
+			return None
+
+	def put(self, key, value):
+		"""
+			Stores a prediction, removes the least recently used ones if the cache is full.
+
+			Args:
+				key: The key of the prediction.
+				value: The prediction to store.
+		"""
+		with self.lock:
+			self.entries[key] = (time.monotonic() + self.ttl, value)
+			self.entries.move_to_end(key)
+
+			while len(self.entries) > self.size:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+
+	def stats(self):
+		"""
+			Returns the counters of the cache as dict.
+		"""
+		return {
+			'size' : len(self.entries),
+			'hits' : self.hits,
+			'misses' : self.misses,
+			'evictions' : self.evictions,
+			'expirations' : self.expirations
+		}
\ No newline at end of file
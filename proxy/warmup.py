@@ -0,0 +1,83 @@
+import os, time
+
+from log import Logging
+from request_data import RequestData
+
+# connection id of the warmup requests (real connections start at 0), its window is removed afterwards
+WARMUP_CONNECTION = -1
+
+# synthetic requests: method, uri, body (run through the models once to initialize them)
+TEMPLATES = [
+	("GET", "/", ""),
+	("GET", "/index.php?page=1&lang=en", ""),
+	("GET", "/static/js/app.min.js", ""),
+	("GET", "/search?q=red+shoes&sort=price", ""),
+	("POST", "/account/login", {"user": "user", "password": "password", "submit": "Login"}),
+	("GET", "/products/item.php?id=1%27%20OR%20%271%27%3D%271", ""),
+	("GET", "/search?q=%3Cscript%3Ealert(1)%3C%2Fscript%3E", ""),
+	("GET", "/download.php?file=..%2F..%2F..%2Fetc%2Fpasswd", ""),
+	("POST", "/contact", {"name": "name", "message": "hello " * 50, "submit": "Send"}),
+	("GET", "/wp-login.php", "")
+]
+
+def create_requests(count):
+	"""
+		Returns count synthetic requests (in the format of RequestData.create_dict()) of the
+		warmup connection.
+	"""
+	requests = []
+	for i in range(count):
+		method, uri, body = TEMPLATES[i % len(TEMPLATES)]
+		header = {
+			"Host": "localhost",
+			"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:82.0) Gecko/20100101 Firefox/82.0",
+			"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+			"Connection": "keep-alive"
+		}
+		if method == "POST":
+			header["Content-Type"] = "application/x-www-form-urlencoded"
+		requests.append({
+			"id" : 0,
+			"timestamp" : int(time.time()),
+			"connection-id" : WARMUP_CONNECTION,
+			"request" : {"method" : method, "uri" : uri, "protocol" : "HTTP/1.1", "body" : dict(body) if isinstance(body, dict) else body},
+			"header" : header,
+			"sender" : {"ip" : "127.0.0.1"}
+		})
+	return requests
+
+def load_requests(path, count):
+	"""
+		Returns (at most count) requests of a request log (or json file of requests), assigned
+		to the warmup connection.
+	"""
+	from log_reader import LogReader
+
+	requests = []
+	for entry in LogReader(path).entries():
+		if len(requests) >= count:
+			break
+		entry['id'] = 0
+		entry['connection-id'] = WARMUP_CONNECTION
+		requests.append(entry)
+	return requests
+
+def warmup_requests():
+	"""
+		Returns the requests to warm up the models with, given by WARMUP_REQUESTS and WARMUP_FILE.
+	"""
+	count = int(os.environ.get("WARMUP_REQUESTS")) if len(os.environ.get("WARMUP_REQUESTS", "")) > 0 else 20
+	if count <= 0:
+		return []
+
+	path = os.environ.get("WARMUP_FILE", "")
+	if len(path) > 0:
+		try:
+			requests = load_requests(path, count)
+			if len(requests) > 0:
+				return [RequestData.from_dict(r) for r in requests]
+			Logging.log("No requests for the warmup in " + path + ", using synthetic ones", Logging.LEVEL_WARN)
+		except Exception as e:
+			Logging.log("Unable to read the requests for the warmup from " + path + ": " + str(e), Logging.LEVEL_WARN)
+
+	return [RequestData.from_dict(r) for r in create_requests(count)]
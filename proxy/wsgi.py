@@ -1,6 +1,283 @@
 #!/usr/bin/python3
+import os, sys, time, signal, resource, multiprocessing, importlib.metadata
+start = time.perf_counter()
+
 from flup.server.fcgi import WSGIServer
-from app import app
+from flup.server.fcgi_fork import WSGIServer as PreforkWSGIServer
+
+SOCKET = '/tmp/protection-proxy.sock'
+# exists while the socket accepts requests, nginx answers "starting" (503) otherwise
+READY_FILE = '/tmp/prp.ready'
+
+# the version of flup the master's loop was checked against (see PreforkServer), pinned in the Dockerfile
+FLUP_VERSION = "1.0.3"
+
+# the state of the workers shared with the master: generation, number of workers ready, number failed
+GENERATION, READY, FAILED = 0, 1, 2
+
+def set_ready(ready):
+	"""
+		Creates or removes the readiness file.
+	"""
+	if ready:
+		open(READY_FILE, "w").close()
+	elif os.path.exists(READY_FILE):
+		os.remove(READY_FILE)
+
+class ReadyServer():
+	"""
+		Marks the PRP core as ready as soon as the socket is set up (models are loaded
+		and warmed up before) and as not ready when the socket is closed (and removed).
+	"""
+
+	def _setupSocket(self):
+		sock = super()._setupSocket()
+		set_ready(True)
+		return sock
+
+	def _cleanupSocket(self, sock):
+		set_ready(False)
+		super()._cleanupSocket(sock)
+		# flup only removes a socket file left over when binding
+		if isinstance(self._bindAddress, str) and os.path.exists(self._bindAddress):
+			os.remove(self._bindAddress)
+
+class Server(ReadyServer, WSGIServer):
+	pass
+
+class PreforkServer(ReadyServer, PreforkWSGIServer):
+	"""
+		Forks the worker processes serving the socket. The master process loads the lda (in
+		RequestChecker), each worker loads the nns after being forked (TensorFlow does not survive
+		forking) and marks the PRP core as ready as soon as it accepts requests.
+
+		The master reloads the models on SIGUSR1 or SIGHUP (and if the index.json changed, see
+		MODEL_RELOAD_INTERVAL): it loads the new models, forks new workers and stops a worker
+		of the previous models for each new worker ready. If a new worker fails to load the
+		models, the previous models and workers are kept.
+	"""
+
+	def __init__(self, application, checker, workers, **kwargs):
+		"""
+			Args:
+				application: The WSGI application.
+				checker (RequestChecker): The checker of the application, holding the models.
+				workers (int): The number of workers.
+				kwargs: Further arguments of flup's server (e.g., bindAddress).
+		"""
+		super().__init__(application, minSpare=workers, maxSpare=workers, maxChildren=workers, **kwargs)
+		self.checker = checker
+		self.workers = workers
+
+		# the generation of the workers forked next, i.e., of the current models
+		#	the workers of the current generation count in shared memory whether they are ready
+		#	(resp. failed to load the models), the master reads the counts on each iteration
+		self.generation = 0
+		self.state = multiprocessing.RawArray('q', 3)
+		self.state_lock = multiprocessing.Lock()
+		self.start_generation()
+
+		# the running reload: replaced set of models (None if there is no reload), the workers of
+		#	the previous models not yet stopped, the start of the reload
+		self.previous = None
+		self.retiring = []
+		self.retired = 0
+		self.reload_start = None
+		# set by the signal handlers, the reload is run by the master's loop
+		self.reload_requested = False
+		self.next_check = time.monotonic() + checker.reload_interval
+
+		# flup waits for activity of the workers without timeout, unless there are workers to purge
+		#	=> a placeholder (never purged, as the last purge is in the future) lets the master
+		#		wake up every 2 seconds to run the reloads
+		#	(a timer would not help, select() is resumed after a signal handler)
+		#	this relies on the loop of PreforkServer.run() in flup 1.0.3 (FLUP_VERSION)
+		if not isinstance(getattr(self, "_children_to_purge", None), list) or not hasattr(self, "_last_purge"):
+			raise RuntimeError("Unsupported version of flup, the workers need flup " + FLUP_VERSION)
+		version = importlib.metadata.version("flup")
+		if version != FLUP_VERSION:
+			Logging.log("The workers were checked against flup " + FLUP_VERSION + " (found " + version + "), reloads may not run", Logging.LEVEL_WARN)
+		self._children_to_purge = [None]
+		self._last_purge = float('inf')
+
+	def start_generation(self):
+		"""
+			Starts a new generation of workers, the ones forked before are not counted anymore.
+		"""
+		self.generation += 1
+		with self.state_lock:
+			self.state[GENERATION] = self.generation
+			self.state[READY] = 0
+			self.state[FAILED] = 0
+
+	def set_workers(self, count):
+		"""
+			Sets the number of workers the master keeps running.
+		"""
+		self._minSpare = self._maxSpare = self._maxChildren = count
+
+	def _setupSocket(self):
+		# ready as soon as the first worker loaded the models (see _child())
+		return PreforkWSGIServer._setupSocket(self)
+
+	def _installSignalHandlers(self):
+		# the workers restore the handlers found here, they must not react to the reload signals
+		signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+		signal.signal(signal.SIGHUP, signal.SIG_IGN)
+		super()._installSignalHandlers()
+
+	def _hupHandler(self, signum, frame):
+		# flup would stop the server
+		self.reload_requested = True
+
+	def _usr1Handler(self, signum, frame):
+		# flup would purge the workers (failing in Python 3)
+		self.reload_requested = True
+
+	def _child(self, sock, parent):
+		"""
+			Runs a worker: loads the models, then serves the requests (flup's loop).
+		"""
+		try:
+			self.checker.after_fork()
+		except Exception as e:
+			Logging.log("Worker " + str(os.getpid()) + " failed to load the models: " + str(e), Logging.LEVEL_ERROR)
+			self.count(FAILED)
+			return
+
+		self.count(READY)
+		set_ready(True)
+		# wakes up the master
+		self._notifyParent(parent, b'\xff')
+		super()._child(sock, parent)
+
+	def count(self, index):
+		"""
+			Counts a worker as ready resp. failed, if it is of the current generation.
+		"""
+		with self.state_lock:
+			if self.state[GENERATION] == self.generation:
+				self.state[index] += 1
+
+	def _reapChildren(self):
+		super()._reapChildren()
+		# called on each iteration of the master's loop
+		self.tend_models()
+
+	def tend_models(self):
+		"""
+			Reloads the models (if requested or the index.json changed) and replaces the workers.
+		"""
+		with self.state_lock:
+			ready, failed = self.state[READY], self.state[FAILED]
+
+		if self.previous != None:
+			if failed > 0:
+				self.abort_reload()
+			else:
+				self.replace_workers(ready)
+		elif failed > 0:
+			Logging.log("A worker failed to load the models, stopping", Logging.LEVEL_ERROR)
+			self._keepGoing = False
+		else:
+			if self.checker.reload_interval > 0 and time.monotonic() >= self.next_check:
+				self.next_check = time.monotonic() + self.checker.reload_interval
+				self.reload_requested = self.reload_requested or self.checker.index_changed()
+			if self.reload_requested:
+				self.reload_requested = False
+				self.reload()
+
+	def reload(self):
+		"""
+			Loads the new models in the master and forks the workers using them, the current
+			workers are stopped as soon as new ones are ready (see replace_workers()).
+		"""
+		start = time.perf_counter()
+		previous = self.checker.models
+		models = self.checker.load_models()
+		if models == None:
+			return
+
+		with self.checker.models_lock:
+			self.checker.models = models
+		self.previous = previous
+		self.reload_start = start
+		self.start_generation()
+
+		# flup forks the new workers (in this iteration), the current ones keep serving requests
+		self.retiring = [pid for pid, child in self._children.items() if child['file'] != None]
+		self.retired = 0
+		self.set_workers(self.workers + len(self.retiring))
+		Logging.log("Replacing " + str(len(self.retiring)) + " workers")
+
+	def replace_workers(self, ready):
+		"""
+			Stops a worker of the previous models for each new worker ready, finishes the reload
+			when all are stopped.
+		"""
+		while len(self.retiring) > 0 and self.retired < ready:
+			self.stop_worker(self.retiring.pop(0))
+			self.retired += 1
+			self.set_workers(self.workers + len(self.retiring))
+
+		if len(self.retiring) == 0:
+			previous, self.previous = self.previous, None
+			self.checker.release_models(previous, self.reload_start)
+
+	def abort_reload(self):
+		"""
+			Makes the previous models the current ones again (a new worker failed to load the new ones)
+			and stops the workers of the new models.
+		"""
+		previous, self.previous = self.previous, None
+		self.checker.restore_models(previous, "a worker failed to load them")
+		self.start_generation()
+
+		# flup forks workers of the previous models instead
+		for pid in list(self._children.keys()):
+			if pid not in self.retiring:
+				self.stop_worker(pid)
+		self.retiring = []
+		self.set_workers(self.workers)
+
+	def stop_worker(self, pid):
+		"""
+			Lets a worker exit after its current request (by closing its socket, like flup does).
+		"""
+		child = self._children.get(pid)
+		if child != None and child['file'] != None:
+			child['file'].close()
+			child['file'] = None
+			child['avail'] = False
+
+from log import Logging
+from src.utils.shared_state import worker_count
 
 if __name__ == "__main__":
-	WSGIServer(app, bindAddress='/tmp/protection-proxy.sock').run()
\ No newline at end of file
+	# number of processes serving the socket
+	#	1 => a single (threaded) process
+	#	n => the master forks n workers, which accept on the same listening socket
+	#		they share the lda loaded below (copy-on-write) and load the nns themselves
+	try:
+		workers = worker_count()
+	except ValueError as e:
+		Logging.log(str(e), Logging.LEVEL_ERROR)
+		sys.exit(1)
+
+	# a ready file of the previous run (e.g., killed) must not survive loading the models
+	set_ready(False)
+
+# importing the app loads the models (in the master process, except the nns if there are multiple workers)
+from app import app, checker
+
+if __name__ == "__main__":
+	# ru_maxrss is in KB (on Linux)
+	Logging.log("Loaded in " + ("%.2f" % (time.perf_counter() - start)) + "s, using " + str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024) + "MB of memory")
+
+	if workers > 1:
+		Logging.log("Starting " + str(workers) + " worker processes")
+		if len(os.environ.get("NN_BATCH_WAIT", "")) > 0 and float(os.environ.get("NN_BATCH_WAIT")) > 0 and "nn" in checker.use_model.split(","):
+			Logging.log("NN_BATCH_WAIT has no effect with multiple workers, each one serves a single request at a time", Logging.LEVEL_WARN)
+		PreforkServer(app, checker, workers, bindAddress=SOCKET).run()
+	else:
+		Server(app, bindAddress=SOCKET).run()